@@ -4,5 +4,8 @@ from .models import *
 # Register your models here.
 
 admin.site.register(ChatRoom)
+admin.site.register(ChatRoomMember)
 admin.site.register(Message)
-admin.site.register(Promise)
\ No newline at end of file
+admin.site.register(Promise)
+admin.site.register(MessageArchiveSegment)
+admin.site.register(OutboxEvent)
\ No newline at end of file
@@ -0,0 +1,187 @@
+"""
+오래된 채팅 메시지 보관 (archive)
+
+Message 테이블이 계속 커지면 안 읽은 메시지/최근 메시지/이전 메시지 조회가 모두 느려지므로,
+CHAT_ARCHIVE_AFTER_DAYS 보다 오래된 메시지는 채팅방별로 (timestamp, id) 순서대로 묶어서
+MessageArchiveSegment 한 행에 압축 저장하고 Message 테이블에서는 지운다. (archive_chat_messages 명령)
+
+- 세그먼트는 append-only: 한 번 만든 세그먼트는 수정하지 않고, 다음 보관 때 새 세그먼트를 뒤에 추가한다.
+- 채팅방의 최근 메시지(ChatRoom.last_message)는 보관하지 않는다.
+- MessageListView 는 Message 테이블의 메시지를 다 넘기면 필요한 세그먼트만 풀어서 이어 붙인다. (paginate_with_archive)
+  보관된 메시지는 저장되지 않은 Message 객체로 만들어서 기존 serializer 를 그대로 쓴다.
+"""
+import json
+import zlib
+from datetime import datetime
+
+from django.db import transaction
+from django.db.models import Q
+
+from accounts.models import User
+from .models import Message, MessageArchiveSegment, Promise
+from .pagination import decode_cursor, paginate_messages
+from .recent import forget_rooms
+
+ARCHIVE_FIELDS = ("id", "sender_id", "text", "timestamp", "promise_id", "is_read", "image", "seq")
+
+
+def pack_messages(rows):
+    """Message.values(*ARCHIVE_FIELDS) 리스트 -> 압축된 bytes"""
+    payload = [
+        [row["id"], row["sender_id"], row["text"], row["timestamp"].isoformat(), row["promise_id"],
+         row["is_read"], row["image"] or "", row["seq"]]
+        for row in rows
+    ]
+    return zlib.compress(json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode())
+
+
+def unpack_segment(segment):
+    """세그먼트 -> 저장되지 않은 Message 리스트 (오래된 순, sender/promise 는 hydrate_messages 로 채움)"""
+    payload = json.loads(zlib.decompress(bytes(segment.data)))
+    messages = []
+    for message_id, sender_id, text, timestamp, promise_id, is_read, image, *rest in payload:
+        message = Message(
+            id=message_id,
+            room_id=segment.room_id,
+            sender_id=sender_id,
+            text=text,
+            timestamp=datetime.fromisoformat(timestamp),
+            promise_id=promise_id,
+            is_read=is_read,
+            image=image or None,
+            seq=rest[0] if rest else 0  # seq 추가 전에 만든 세그먼트는 0
+        )
+        message._state.adding = False
+        messages.append(message)
+    return messages
+
+
+def hydrate_messages(room, messages):
+    """보관된 메시지의 sender/promise 를 한 번에 채움 (탈퇴한 유저의 메시지는 CASCADE 처럼 제외)"""
+    senders = User.objects.in_bulk({message.sender_id for message in messages})
+    promises = Promise.objects.in_bulk({message.promise_id for message in messages if message.promise_id})
+    hydrated = []
+    for message in messages:
+        sender = senders.get(message.sender_id)
+        if sender is None:
+            continue
+        message.room = room
+        message.sender = sender
+        message.promise = promises.get(message.promise_id)  # 삭제된 예약은 SET_NULL 처럼 None
+        hydrated.append(message)
+    return hydrated
+
+
+def message_key(message):
+    return message.timestamp, message.id
+
+
+def archive_room(room, cutoff, segment_size):
+    """cutoff 보다 오래된 room 의 메시지를 세그먼트로 옮기고 옮긴 메시지 수 반환"""
+    archived = 0
+    with transaction.atomic():
+        candidates = (
+            Message.objects.filter(room=room, timestamp__lt=cutoff)
+            .exclude(id=room.last_message_id)
+            .order_by("timestamp", "id")
+            .values(*ARCHIVE_FIELDS)
+        )
+        while True:
+            rows = list(candidates[:segment_size])
+            if not rows:
+                break
+            MessageArchiveSegment.objects.create(
+                room=room,
+                start_at=rows[0]["timestamp"],
+                start_message_id=rows[0]["id"],
+                end_at=rows[-1]["timestamp"],
+                end_message_id=rows[-1]["id"],
+                message_count=len(rows),
+                data=pack_messages(rows)
+            )
+            Message.objects.filter(id__in=[row["id"] for row in rows]).delete()
+            archived += len(rows)
+    if archived:
+        forget_rooms([room.id])
+    return archived
+
+
+def load_archived_before(room, key=None, limit=50):
+    """
+    key((timestamp, id)) 이전의 보관 메시지 중 최신 limit 개를 오래된 순으로 반환 (key 가 없으면 가장 최근 보관 메시지부터)
+    필요한 세그먼트만 최신 것부터 하나씩 푼다. 반환: (메시지 리스트, 더 이전 보관 메시지 존재 여부)
+    """
+    segments = room.archive_segments.all()
+    if key:
+        timestamp, message_id = key
+        segments = segments.filter(Q(start_at__lt=timestamp) | Q(start_at=timestamp, start_message_id__lt=message_id))
+    segment_ids = list(segments.order_by("-end_at", "-end_message_id").values_list("id", flat=True))
+
+    collected = []
+    for index, segment_id in enumerate(segment_ids):
+        segment = MessageArchiveSegment.objects.get(id=segment_id)
+        messages = unpack_segment(segment)
+        if key:
+            messages = [message for message in messages if message_key(message) < key]
+        collected = messages + collected
+        if len(collected) >= limit:
+            has_more = len(collected) > limit or index + 1 < len(segment_ids)
+            return hydrate_messages(room, collected[-limit:]), has_more
+    return hydrate_messages(room, collected), False
+
+
+def load_archived_after(room, key, limit=50):
+    """key 이후의 보관 메시지 중 오래된 순 limit 개. 반환: (메시지 리스트, 더 이후 보관 메시지 존재 여부)"""
+    timestamp, message_id = key
+    segment_ids = list(
+        room.archive_segments.filter(Q(end_at__gt=timestamp) | Q(end_at=timestamp, end_message_id__gt=message_id))
+        .order_by("start_at", "start_message_id")
+        .values_list("id", flat=True)
+    )
+
+    collected = []
+    for index, segment_id in enumerate(segment_ids):
+        segment = MessageArchiveSegment.objects.get(id=segment_id)
+        collected += [message for message in unpack_segment(segment) if message_key(message) > key]
+        if len(collected) >= limit:
+            has_more = len(collected) > limit or index + 1 < len(segment_ids)
+            return hydrate_messages(room, collected[:limit]), has_more
+    return hydrate_messages(room, collected), False
+
+
+def has_archived_before(room, key):
+    timestamp, message_id = key
+    return room.archive_segments.filter(
+        Q(start_at__lt=timestamp) | Q(start_at=timestamp, start_message_id__lt=message_id)
+    ).exists()
+
+
+def paginate_with_archive(room, queryset, before=None, after=None, limit=50):
+    """
+    paginate_messages 와 같은 형태로 반환하되, Message 테이블 범위를 벗어나면 보관 세그먼트에서 이어서 채운다.
+    보관 메시지는 항상 Message 테이블의 메시지보다 오래되었으므로 앞쪽(이전)에만 붙는다.
+    """
+    page, has_more_before, has_more_after = paginate_messages(queryset, before=before, after=after, limit=limit)
+
+    if after:
+        # cursor 가 보관 구간 안이면 보관 메시지부터 이어서
+        archived, archived_more = load_archived_after(room, decode_cursor(after), limit)
+        if archived:
+            combined = archived + page
+            return combined[:limit], True, archived_more or has_more_after or len(combined) > limit
+        return page, has_more_before, has_more_after
+
+    if has_more_before:
+        return page, has_more_before, has_more_after
+
+    if page:
+        key = message_key(page[0])
+    else:
+        key = decode_cursor(before) if before else None
+
+    if len(page) < limit:
+        archived, has_more_before = load_archived_before(room, key, limit - len(page))
+        page = archived + page
+    elif key:
+        has_more_before = has_archived_before(room, key)
+    return page, has_more_before, has_more_after
@@ -0,0 +1,42 @@
+"""
+웹소켓 프레임 인코딩 협상
+
+클라이언트가 Sec-WebSocket-Protocol 에 sharedog.msgpack.v1 을 보내면 같은 프레임을 msgpack 바이너리로 주고받고,
+그렇지 않으면 기존처럼 JSON 텍스트 프레임을 사용한다.
+"""
+import msgpack
+
+MSGPACK_SUBPROTOCOL = "sharedog.msgpack.v1"
+
+
+class NegotiatedCodecMixin:
+    """AsyncJsonWebsocketConsumer 와 함께 사용 (send_json/receive_json 은 그대로 사용)"""
+    use_msgpack = False
+
+    async def accept(self, subprotocol=None):
+        if subprotocol is None and MSGPACK_SUBPROTOCOL in self.scope.get("subprotocols", []):
+            subprotocol = MSGPACK_SUBPROTOCOL
+        self.use_msgpack = subprotocol == MSGPACK_SUBPROTOCOL
+        await super().accept(subprotocol=subprotocol)
+
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        if bytes_data is not None and self.use_msgpack:
+            # resume 의 {room_id: last_seq} 처럼 키가 int 인 map 도 허용
+            # 잘못된 프레임은 연결을 끊지 않고 error 프레임으로 응답
+            try:
+                content = msgpack.unpackb(bytes_data, raw=False, strict_map_key=False)
+            except (msgpack.ExtraData, ValueError) as e:
+                await self.send_json({"error": f"잘못된 msgpack 프레임: {e}"})
+                return
+            if not isinstance(content, dict):
+                await self.send_json({"error": "msgpack 프레임은 map 이어야 합니다."})
+                return
+            await self.receive_json(content, **kwargs)
+        else:
+            await super().receive(text_data=text_data, bytes_data=bytes_data, **kwargs)
+
+    async def send_json(self, content, close=False):
+        if self.use_msgpack:
+            await self.send(bytes_data=msgpack.packb(content), close=close)
+        else:
+            await super().send_json(content, close=close)
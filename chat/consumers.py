@@ -1,89 +1,307 @@
-from collections import defaultdict
+import asyncio
+import weakref
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
-from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
-from .models import ChatRoom, Message
-from .serializers import ChatRoomSerializer
+from django.conf import settings
+from django.db import transaction
+from .models import ChatRoom, ChatRoomMember, Message, resolve_is_read
+from .presence import get_presence
+from .inbox import build_inbox_room, forget_inbox_snapshots, get_inbox_snapshot
+from .codecs import NegotiatedCodecMixin
+from .db import db_sync_to_async
+from .outbound import DeferredFrame, OutboundQueueMixin
+from .heartbeat import HeartbeatMixin
+from .throttle import FloodControlMixin
+from .fanout import EnvelopeDispatchMixin, FanOut
+from .pipeline import MessageWriter, PendingMessage, get_message_writer
+from .utils import get_user_group_name, serialize_chat_message
 
-from accounts.models import Dog
 
-from django.db.models import Count, Q
+User = get_user_model()
+
 
-from datetime import datetime, timedelta
-from django.utils.timezone import get_current_timezone
-from asgiref.sync import sync_to_async
+def parse_int(value):
+    """클라이언트가 보낸 id/숫자 값 (bool, 숫자가 아닌 값이면 None)"""
+    if isinstance(value, bool):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
 
-import re
 
-from channels.layers import get_channel_layer
+class ChatRoomSessionMixin:
+    """
+    채팅방 하나에 들어가 있는 동안 필요한 공통 로직
+    ChatConsumer(채팅방마다 연결 하나)와 MultiplexConsumer(유저당 연결 하나에서 join/leave)가 같이 사용한다.
+    """
 
-User = get_user_model()
+    @staticmethod
+    def get_group_name(room_id):
+        return f"chat_room_{room_id}"
+
+    def get_device_id(self):
+        """?device_id=... 로 전달된 디바이스 식별자 (없으면 연결 단위로 구분)"""
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        device_ids = query.get('device_id')
+        return device_ids[0] if device_ids else None
+
+    @db_sync_to_async
+    def bootstrap_connection(self, room_id, user, resume_seq=None):
+        """
+        연결 시 필요한 DB 작업을 한 트랜잭션으로 처리
+        채팅방이 없으면 None, 참여자가 아니면 is_member=False
+        """
+        with transaction.atomic():
+            room = ChatRoom.objects.filter(id=room_id).first()
+            if room is None:
+                return None
+
+            participants = list(room.participants.only('id', 'email'))
+            if user.id not in {participant.id for participant in participants}:
+                return {'room': room, 'is_member': False}
+
+            opponent = next((participant for participant in participants if participant.id != user.id), None)
+
+            if resume_seq is not None:
+                frame = self.make_resume_frame(room, user, opponent, resume_seq)
+            else:
+                unread_messages = []
+                has_more = False
+                if opponent:
+                    limit = settings.CHAT_BACKLOG_LIMIT
+                    read_upto = (
+                        ChatRoomMember.objects.filter(room=room, user=user)
+                        .values_list('last_read_message_id', flat=True).first() or 0
+                    )
+                    unread_messages = list(
+                        Message.objects.filter(room=room, sender=opponent, id__gt=read_upto)
+                        .select_related('sender', 'promise')
+                        .order_by('-id')[:limit + 1]
+                    )
+                    has_more = len(unread_messages) > limit
+                    unread_messages = unread_messages[:limit][::-1]
+                    if unread_messages:
+                        # 페이지에 포함되지 않은 이전 메시지도 cursor 로 이어서 받을 수 있으므로 함께 읽음 처리
+                        room.mark_read_by(user, upto_id=unread_messages[-1].id)
+                frame = self.make_backlog_frame(
+                    [serialize_chat_message(msg, is_read=True) for msg in unread_messages], has_more
+                )
+
+            return {
+                'room': room,
+                'is_member': True,
+                'opponent_id': opponent.id if opponent else None,
+                'opponent_email': opponent.email if opponent else None,
+                'frame': frame,
+            }
+
+    @staticmethod
+    def make_resume_frame(room, user, opponent, resume_seq):
+        """
+        resume_seq 이후 메시지와 현재 읽음 위치 (bootstrap_connection 트랜잭션 안에서 호출)
+        밀린 메시지가 CHAT_RESUME_MAX_MESSAGES 개보다 많거나 중간 메시지가 없으면(보관 등) 전체 다시 조회 요청
+        """
+        resync = {'type': 'resync_required', 'last_seq': room.last_seq}
+        gap = room.last_seq - resume_seq
+        if resume_seq < 0 or gap < 0 or gap > settings.CHAT_RESUME_MAX_MESSAGES:
+            return resync
+
+        messages = list(
+            Message.objects.filter(room=room, seq__gt=resume_seq).select_related('sender', 'promise').order_by('seq')
+        )
+        if len(messages) != gap:
+            return resync
+
+        room.mark_read_by(user)
+        watermarks = room.get_read_watermarks()
+        return {
+            'type': 'resume',
+            'messages': [serialize_chat_message(msg, is_read=resolve_is_read(msg, watermarks)) for msg in messages],
+            'last_seq': room.last_seq,
+            # 상대방이 읽은 내 메시지 위치 (이 id 까지 읽음)
+            'read_upto': watermarks.get(opponent.id, 0) if opponent else 0
+        }
+
+    async def send_room_error(self, command, room_id, code, detail):
+        """{"type": "room_error", "command": 명령, "room_id": ..., "code": 4400(잘못된 값) | 4403(참여 중이 아님), "detail": ...}"""
+        await self.send_json({'type': 'room_error', 'command': command, 'room_id': room_id, 'code': code, 'detail': detail})
+
+    @db_sync_to_async
+    def get_messages_before(self, room, before, limit):
+        """cursor(메시지 id) 이전 메시지를 최신순으로 limit 개 가져와서 오래된 순으로 반환"""
+        messages = list(
+            Message.objects.filter(room=room, id__lt=before)
+            .select_related('sender', 'promise')
+            .order_by('-id')[:limit + 1]
+        )
+        has_more = len(messages) > limit
+        watermarks = room.get_read_watermarks()
+        return [
+            serialize_chat_message(msg, is_read=resolve_is_read(msg, watermarks)) for msg in messages[:limit][::-1]
+        ], has_more
 
-class ChatConsumer(AsyncJsonWebsocketConsumer):
-    connected_users = defaultdict(set)
+    @staticmethod
+    def make_backlog_frame(messages, has_more):
+        return {
+            'type': 'backlog',
+            'messages': messages,
+            'has_more': has_more,
+            'cursor': messages[0]['id'] if messages else None
+        }
 
+    @staticmethod
+    def make_chat_message_frame(event):
+        """chat_message 이벤트 -> 클라이언트로 보내는 메시지 프레임"""
+        response_data = {
+            'message': event['message'],
+            'sender_email': event['sender_email'],
+            'is_read': event.get('is_read')
+        }
+        if event.get("provisional_id"):
+            response_data["provisional_id"] = event["provisional_id"]
+        if event.get("image_url"):
+            response_data["image_url"] = event["image_url"]
+        if "promise_id" in event:
+            response_data.update({
+                "promise_id": event["promise_id"],
+                "promise_day": event["promise_day"],
+                "promise_time": event["promise_time"]
+            })
+        return response_data
+
+    async def publish_room_message(self, room, user, opponent_id, opponent_email, message, image=None):
+        """
+        보낸 사람은 클라이언트가 보낸 sender_email 대신 인증된 사용자 사용
+        메시지는 바로 브로드캐스트하고 저장은 MessageWriter 가 모아서 처리 (임시 id -> 보낸 연결에 message_persisted 로 실제 id 전달)
+        """
+        group_name = self.get_group_name(room.id)
+        is_read = bool(opponent_id) and await get_presence().ais_present(group_name, opponent_id)
+
+        pending = PendingMessage(
+            message=Message(room=room, sender=user, text=message, is_read=is_read, image=image),
+            provisional_id=MessageWriter.make_provisional_id(),
+            group_name=group_name,
+            sender=weakref.ref(self),
+            inbox_email=None if is_read else opponent_email
+        )
+        await self.channel_layer.group_send(group_name, {
+            'type': 'chat_message',
+            'room_id': room.id,
+            'provisional_id': pending.provisional_id,
+            'message': message,
+            'sender_email': user.email,
+            'is_read': is_read,
+            'image_url': pending.message.image.url if pending.message.image else None
+        })
+        get_message_writer().enqueue(pending)
+
+    async def publish_room_joined(self, user, room_id):
+        """입장 알림: 상대방에게 읽음 상태, 내 채팅방 목록에 안 읽은 메시지 수 갱신 (순서는 그대로)"""
+        fanout = FanOut(self.channel_layer).add(self.get_group_name(room_id), {
+            'type': 'update_read_status',
+            'room_id': int(room_id),
+            'is_read': True
+        })
+        fanout.add_inbox_delta([user.email], room_id)
+        await fanout.publish()
+
+
+class ChatConsumer(ChatRoomSessionMixin, FloodControlMixin, HeartbeatMixin, OutboundQueueMixin, NegotiatedCodecMixin, EnvelopeDispatchMixin, AsyncJsonWebsocketConsumer):
     async def connect(self):
         try:
             self.room_id = self.scope['url_route']['kwargs']['room_id']
-            if not await self.check_room_exists(self.room_id):
-                raise ValueError('채팅방이 존재하지 않습니다.')
+            user = self.scope["user"]
+            if user.is_anonymous:
+                await self.reject(4401)
+                return
+
+            # 채팅방 확인 / 참여자 확인 / 안 읽은 메시지 조회 / 읽음 처리를 한 트랜잭션(thread hop 한 번)으로
+            bootstrap = await self.bootstrap_connection(self.room_id, user, self.get_resume_seq())
+            if bootstrap is None:
+                await self.reject(4404)  # 채팅방이 존재하지 않음
+                return
+            if not bootstrap['is_member']:
+                await self.reject(4403)  # 채팅방 참여자가 아님
+                return
+
+            # 이후 receive_json 에서 다시 조회하지 않도록 저장
+            self.room = bootstrap['room']
+            self.is_member = True
+            self.opponent_id = bootstrap['opponent_id']
+            self.opponent_email = bootstrap['opponent_email']
 
             group_name = self.get_group_name(self.room_id)
             await self.channel_layer.group_add(group_name, self.channel_name)
 
-            current_user_email = self.scope["user"].email
-            print(current_user_email)
+            # 접속 상태 등록 (다른 워커에서도 보이도록 공유 레지스트리에 기록)
+            self.device_id = self.get_device_id()
+            await get_presence().aadd(group_name, user.id, self.channel_name, self.device_id)
+            self.presence_task = asyncio.create_task(self.keep_presence_alive(group_name))
 
-            room = await self.get_room_by_id(self.room_id)
-            opponent_email = await self.get_opponent_email(room, current_user_email)
+            await self.accept()
 
-            self.connected_users[group_name].add(current_user_email)
-            
-            unread_messages = await self.get_unread_messages(room, opponent_email)
+            # 처음 연결: 안 읽은 메시지는 최근 것부터 최대 CHAT_BACKLOG_LIMIT 개만 프레임 하나로 전송
+            #   더 이전 메시지는 cursor 로 {"type": "load_backlog", "before": cursor} 요청
+            # 재연결(?last_seq=N): 그 이후 메시지만 resume 프레임으로, 너무 많이 밀렸으면 resync_required
+            await self.send_json(bootstrap['frame'])
 
-            await self.accept()
-            print(unread_messages)
-
-            for msg in unread_messages:
-                print(f"보낸 메시지: {msg['message']}")
-                # 모든 참여자에게 메시지를 전송
-                await self.send_json({
-                    'type': 'chat_message',
-                    'message': msg['message'],
-                    'sender_email': msg['sender_email'],
-                    'is_read': True  # b는 읽음 처리된 상태로 받음
-                })
-
-            # ✅ 3️⃣ 메시지를 읽음 처리 (update 실행)
-            await self.mark_messages_as_read(room, opponent_email)
-            group_name = self.get_group_name(self.room_id)
-            await self.channel_layer.group_send(group_name, {
-                'type': 'update_read_status',
-                'room_id': self.room_id,
-                'is_read': True
-            })
+            await self.publish_room_joined(user, self.room_id)
         except Exception as e:
             await self.send_json({'error': f'연결 오류: {str(e)}'})
 
     async def disconnect(self, close_code):
+        if not hasattr(self, 'room_id'):
+            return
+        # 아직 저장되지 않은 메시지 저장
+        await get_message_writer().flush()
         group_name = self.get_group_name(self.room_id)
-        current_user_email = self.scope["user"].email
-        self.connected_users[group_name].discard(current_user_email)
+        presence_task = getattr(self, 'presence_task', None)
+        if presence_task:
+            presence_task.cancel()
+            await get_presence().aremove(group_name, self.scope["user"].id, self.channel_name, self.device_id)
         await self.channel_layer.group_discard(group_name, self.channel_name)
 
+    async def keep_presence_alive(self, group_name):
+        """TTL 안에 접속 상태를 계속 갱신 (연결이 비정상 종료되면 TTL 후 자동으로 사라짐)"""
+        presence = get_presence()
+        interval = max(presence.ttl / 3, 1)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await presence.atouch(group_name, self.scope["user"].id, self.channel_name, self.device_id)
+            except Exception as e:
+                print(f"Error in keep_presence_alive: {e}")
+
+    def get_resume_seq(self):
+        """재연결 시 ?last_seq=... 로 전달된 마지막으로 받은 메시지 번호 (처음 연결이면 None)"""
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        try:
+            return int(query['last_seq'][0])
+        except (KeyError, ValueError):
+            return None
+
     async def receive_json(self, content):
         user = self.scope["user"]
         if user.is_anonymous:
             raise ValueError("인증된 사용자만 메시지를 보낼 수 있습니다.")
 
-        sender_email = content['sender_email']
+        if await self.handle_heartbeat(content):
+            return
+
+        if content.get('type') == 'load_backlog':
+            await self.load_backlog(content)
+            return
+
         message = content.get("message", "")
         image = content.get("image", None)
         if not message:
             raise ValueError("메시지가 비어 있습니다.")
 
-        if hasattr(self, 'room_id') and await self.check_room_exists(self.room_id):
-            room = await self.get_room_by_id(self.room_id)
+        if getattr(self, 'is_member', False):
+            # connect 에서 확인/저장한 채팅방과 상대방 정보 사용
+            room = self.room
         else:
             participant1_email = content.get('participant1_email')
             participant2_email = content.get('participant2_email')
@@ -91,150 +309,92 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
                 raise ValueError("두 참가자 이메일이 필요합니다.")
             room = await self.get_or_create_room(participant1_email, participant2_email)
             self.room_id = str(room.id)
+            opponent = await self.get_opponent(room, user.email)
+            self.room = room
+            self.is_member = True
+            self.opponent_id = opponent.id if opponent else None
+            self.opponent_email = opponent.email if opponent else None
 
         if not self.room_id:
             raise ValueError("채팅방 ID를 찾을 수 없습니다.")
-        
-        group_name = self.get_group_name(self.room_id)
-        opponent_email = await self.get_opponent_email(room, sender_email)
-        is_read = opponent_email in self.connected_users[group_name]
-
-        # 메시지 저장
-        await self.save_message(room, sender_email, message, is_read, image)
 
-        await self.channel_layer.group_send(group_name, {
-            'type': 'chat_message',
-            'message': message,
-            'sender_email': sender_email,
-            'is_read': is_read,
-            'image_url': image.url if image else None
-        })
+        # 연결/유저별 전송 속도 제한 (초과하면 throttled 프레임만 보내고 메시지는 버림)
+        if not await self.check_flood(self.room_id):
+            return
 
-        if not is_read:
-            unread_count = await self.get_unread_messages_count(room, opponent_email)
-            # 여기서 UserChatConsumer로 업데이트 요청
-            user_group_name = re.sub(r'[^a-zA-Z0-9._-]', '_', f"user_{opponent_email}")
-            await self.channel_layer.group_send(user_group_name, {
-                "type": "update_unread_count",
-                "room_id": self.room_id,
-                "unread_messages": unread_count
-            })
+        await self.publish_room_message(room, user, self.opponent_id, self.opponent_email, message, image)
 
-            # 채팅방 리스트 갱신을 요청
-            await self.channel_layer.group_send(user_group_name, {
-                "type": "update_chatrooms"
-            })
+    async def load_backlog(self, content):
+        """{"type": "load_backlog", "before": <cursor>, "limit": n} -> cursor 이전 메시지를 backlog 프레임으로 전송"""
+        room_id = parse_int(getattr(self, 'room_id', None))
+        if not getattr(self, 'is_member', False):
+            await self.send_room_error("load_backlog", room_id, 4403, "채팅방에 참여한 사용자만 메시지를 조회할 수 있습니다.")
+            return
+        before = parse_int(content.get('before'))
+        limit = parse_int(content.get('limit', settings.CHAT_BACKLOG_LIMIT))
+        if before is None or limit is None:
+            await self.send_room_error("load_backlog", room_id, 4400, "before, limit 은 숫자여야 합니다.")
+            return
+        limit = max(1, min(limit, settings.CHAT_BACKLOG_LIMIT))
+        messages, has_more = await self.get_messages_before(self.room, before, limit)
+        await self.send_json(self.make_backlog_frame(messages, has_more))
 
     async def chat_message(self, event):
-        message = event['message']
-        sender_email = event['sender_email']
-        is_read = event.get('is_read')
-        response_data = {
-            'message': message,
-            'sender_email': sender_email,
-            'is_read': is_read
-        }
-        if "promise_id" in event:
-            response_data.update({
-                "promise_id": event["promise_id"],
-                "promise_day": event["promise_day"],
-                "promise_time": event["promise_time"]
-            })
-        await self.send_json(response_data)
+        await self.send_json(self.make_chat_message_frame(event))
+
+    async def message_persisted(self, event):
+        """저장 완료 (MessageWriter 가 보낸 연결에 직접 호출): 임시 id 를 실제 메시지 id 로 교체하도록 전달"""
+        await self.send_json({
+            'type': 'message_persisted',
+            'messages': event['messages']
+        })
+
+    async def message_failed(self, event):
+        await self.send_json({
+            'type': 'message_failed',
+            'provisional_ids': event['provisional_ids']
+        })
 
     async def update_read_status(self, event):
         """
-        상대방이 채팅을 읽었을 때, 기존 메시지들의 읽음 상태를 업데이트하여 보냄
+        상대방이 채팅을 읽었을 때, 기존 메시지들의 읽음 상태를 업데이트하여 보냄 (아직 보내지 않은 이전 상태는 대체)
         """
-        await self.send_json({
+        await self.queue_frame({
             'type': 'update_read_status',
             'room_id': event['room_id'],
             'is_read': event['is_read']
-        })
-
-    @staticmethod
-    def get_group_name(room_id):
-        return f"chat_room_{room_id}"
+        }, key=('update_read_status', int(event['room_id'])))
 
-    @database_sync_to_async
+    @db_sync_to_async
     def get_or_create_room(self, email1, email2):
         user1, _ = User.objects.get_or_create(email=email1)
         user2, _ = User.objects.get_or_create(email=email2)
-        room, created = ChatRoom.objects.get_or_create(
-            participants__in=[user1, user2]
-        )
-        if created:
-            room.participants.set([user1, user2])
-            room.save()
+        room, created = ChatRoom.get_or_create_direct(user1, user2)
         return room
 
-    @database_sync_to_async
-    def get_room_by_id(self, room_id):
-        return ChatRoom.objects.get(id=room_id)
-
-    @database_sync_to_async
-    def check_room_exists(self, room_id):
-        return ChatRoom.objects.filter(id=room_id).exists()
-
-    @database_sync_to_async
-    def get_unread_messages(self, room, opponent_email):
-        if opponent_email is None:
-            return []
-        """
-        읽지 않은 메시지를 조회만 하는 함수 (update는 하지 않음)
-        """
-        unread_messages = list(Message.objects.filter(
-            room=room, sender__email=opponent_email, is_read=False
-        ))
-
-        messages_to_return = [
-            {"message": msg.text, "sender_email": msg.sender.email} for msg in unread_messages
-        ]
-
-        return messages_to_return
-    @database_sync_to_async
-    def mark_messages_as_read(self, room, opponent_email):
-        if opponent_email is None:
-            return
-        """
-        읽지 않은 메시지를 읽음 처리하는 함수
-        """
-        Message.objects.filter(room=room, sender__email=opponent_email, is_read=False).update(is_read=True) 
-    
-    @database_sync_to_async
-    def get_opponent_email(self, room, current_user_email):
-        opponent = room.participants.exclude(email=current_user_email).first()
-        if opponent:
-            return opponent.email
-        return None
-    
-    @database_sync_to_async
-    def get_unread_messages_count(self, room, user_email):
-        return Message.objects.filter(room=room, sender__email=user_email, is_read=False).count()
-    
-    @database_sync_to_async
-    def save_message(self, room, sender_email, message_text, is_read, image):
-        sender = User.objects.get(email=sender_email)
-        Message.objects.create(room=room, sender=sender, text=message_text, is_read=is_read, image=image)
-
-def safe_datetime(val):
-    if isinstance(val, datetime):
-        return val
-    try:
-        return datetime.fromisoformat(val)
-    except:
-        return datetime.min
+    @db_sync_to_async
+    def get_opponent(self, room, current_user_email):
+        return room.participants.exclude(email=current_user_email).first()
 
 
-class UserChatConsumer(AsyncJsonWebsocketConsumer):
+class UserChatConsumer(HeartbeatMixin, OutboundQueueMixin, NegotiatedCodecMixin, EnvelopeDispatchMixin, AsyncJsonWebsocketConsumer):
     async def connect(self):
+        if self.scope["user"].is_anonymous:
+            await self.reject(4401)
+            return
         try:
             self.user_email = self.scope["user"].email
-            self.group_name = re.sub(r'[^a-zA-Z0-9._-]', '_', f"user_{self.user_email}")
+            self.group_name = get_user_group_name(self.user_email)
 
             await self.channel_layer.group_add(self.group_name, self.channel_name)
 
-            chatrooms = await self.get_chatrooms_with_unread_messages(self.user_email)
+            # 재연결(?resume=1)이면 전체 목록 대신 클라이언트가 보내는 {"type": "resume", ...} 에 변경분만 응답
+            query = parse_qs(self.scope.get('query_string', b'').decode())
+            if query.get('resume') == ['1']:
+                await self.accept()
+                return
+
+            chatrooms = await self.get_chatrooms_with_unread_messages(self.scope["user"])
 
             await self.accept()
 
@@ -246,128 +406,256 @@ class UserChatConsumer(AsyncJsonWebsocketConsumer):
             await self.send_json({'error': f'연결 오류: {str(e)}'})
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
 
     async def receive_json(self, content):
-        if 'message' in content:
-            room_id = content.get("room_id")
-            message = content.get("message")
+        if await self.handle_heartbeat(content):
+            return
 
-            chatrooms = await self.get_chatrooms_with_unread_messages(self.user_email)
+        if content.get("type") == "resync":
+            # 클라이언트가 목록이 어긋났다고 판단했을 때만 전체 목록을 다시 보냄 (캐시된 snapshot 은 버리고 새로 만듦)
+            await db_sync_to_async(forget_inbox_snapshots)([self.user_email])
+            await self.send_chatrooms_list()
+
+        elif content.get("type") == "resume":
+            await self.send_chatrooms_delta(content.get("rooms"))
+
+        elif 'message' in content:
+            room_id = parse_int(content.get("room_id"))
+            if room_id:
+                # 같은 유저의 다른 연결(탭/디바이스)에도 이 방의 변경분만 전송
+                await FanOut(self.channel_layer).add_inbox_delta([self.user_email], room_id, position=0).publish()
+
+    async def send_chatrooms_list(self):
+        """전체 목록(snapshot) 전송 - 연결 시, resync 요청 시에만 사용 (보낼 때 만들고, 밀려 있으면 한 번만)"""
+        await self.queue_frame(DeferredFrame(self.build_chatrooms_list), key=("chatrooms_list",))
+
+    async def build_chatrooms_list(self):
+        chatrooms = await self.get_chatrooms_with_unread_messages(self.scope["user"])
+        return {
+            "type": "chatrooms_list",
+            "chatrooms": chatrooms
+        }
 
-            await self.send_json({
-                "type": "chatrooms_list",
-                "chatrooms": chatrooms
-            })
+    async def send_chatrooms_delta(self, known_rooms):
+        """
+        {"type": "resume", "rooms": {"<room_id>": last_seq, ...}} (클라이언트가 가진 목록) 에 대한 응답
+        -> {"type": "chatrooms_delta", "rooms": [last_seq 가 다르거나 새로 생긴 채팅방], "removed": [없어진 채팅방 id],
+            "unread": {"<room_id>": 안 읽은 메시지 수}}  (읽음 상태는 메시지 없이도 바뀌므로 전체 방의 숫자만 보냄)
+        rooms 가 없으면 전체 목록을 보냄
+        """
+        if not isinstance(known_rooms, dict):
+            await self.send_chatrooms_list()
+            return
 
-            group_name = f"user_{self.user_email.replace('@', '_').replace('.', '_')}"
-            await self.channel_layer.group_send(
-                group_name,
-                {
-                    "type": "update_chatrooms",
-                    "room_id": room_id,
-                }
-            )
+        known_rooms = {str(room_id): last_seq for room_id, last_seq in known_rooms.items()}  # msgpack 은 키가 int 일 수 있음
+        chatrooms = await self.get_chatrooms_with_unread_messages(self.scope["user"])
+        current_ids = {str(room["id"]) for room in chatrooms}
+        await self.send_json({
+            "type": "chatrooms_delta",
+            "rooms": [room for room in chatrooms if known_rooms.get(str(room["id"])) != room["last_seq"]],
+            "removed": [int(room_id) for room_id in known_rooms if room_id.isdigit() and room_id not in current_ids],
+            "unread": {str(room["id"]): room["unread_messages"] for room in chatrooms}
+        })
 
-    async def get_chatrooms_with_unread_messages(self, user_email):
+    async def get_chatrooms_with_unread_messages(self, user):
         try:
-            rooms = await database_sync_to_async(
-                lambda: list(ChatRoom.objects.filter(participants__email=user_email))
-            )()
-
-            chatrooms_info = []
-            for room in rooms:
-                opponent = await database_sync_to_async(
-                lambda: room.participants.exclude(email=user_email).first()
-                )()
-
-                opponent_name = opponent.user_name if opponent else "알 수 없음"
-                opponent_email = opponent.email if opponent else "알 수 없음"
-
-                # 상대방의 대표 강아지 프로필 이미지 가져오기
-                opponent_dog = await database_sync_to_async(
-                    lambda: Dog.objects.filter(user=opponent, represent=True).first()
-                )()
-                opponent_profile = (
-                    opponent_dog.dog_image.url
-                    if opponent_dog and opponent_dog.dog_image
-                    else None
-                )
-
-                # 안 읽은 메시지 개수 가져오기
-                unread_count = await database_sync_to_async(
-                    lambda: Message.objects.filter(room=room, is_read=False)
-                    .exclude(sender__email=user_email)
-                    .count()
-                )()
-
-                # 최근 메시지 가져오기
-                latest_message = await database_sync_to_async(
-                    lambda: Message.objects.filter(room=room, timestamp__isnull=False).order_by("-timestamp").first()
-                )()
-                last_message_text = latest_message.text if latest_message else ""
-                latest_message_timestamp = latest_message.timestamp if latest_message else None
-
-                # 최근 메시지의 시간 포맷 변환 (오전/오후 hh:mm)
-                latest_message_time = ""
-                if latest_message and latest_message.timestamp:
-                    tz = await sync_to_async(get_current_timezone, thread_sensitive=False)()  # 현재 설정된 타임존 가져오기
-                    message_time = latest_message.timestamp.astimezone(tz)  # 서버 타임존에서 현재 타임존으로 변환
-                    now = datetime.now(tz)  # 현재 시간 가져오기 (타임존 적용)
-
-                    if message_time.date() == now.date():
-                        period = "오전" if message_time.hour < 12 else "오후"
-                        formatted_hour = message_time.hour if message_time.hour == 12 or message_time.hour == 0 else message_time.hour % 12
-                        latest_message_time = f"{period} {formatted_hour}:{message_time.minute:02d}"
-
-                    elif message_time.date() == (now - timedelta(days=1)).date():
-                        latest_message_time = "어제"
-
-                    elif message_time.year == now.year:
-                        latest_message_time = message_time.strftime("%m월 %d일")
-
-                    else:
-                        latest_message_time = message_time.strftime("%Y.%m.%d")
-                else:
-                    latest_message_time = ""
-
-                is_promise = latest_message.promise if latest_message else False
-
-                chatrooms_info.append({
-                    "id": room.id,
-                    "room_id": room.id,
-                    "opponent_user": opponent_name,
-                    "opponent_email": opponent_email,
-                    "opponent_user_profile": opponent_profile,
-                    "unread_messages": unread_count,
-                    "latest_message": last_message_text,
-                    "latest_message_time": latest_message_time,
-                    "is_promise": is_promise,  # 필요에 따라 값 설정
-                    "participants": list(await database_sync_to_async(lambda: list(room.participants.values_list("id", flat=True)))()),
-                    "latest_message_timestamp": latest_message_timestamp.isoformat() if latest_message_timestamp else None  # 정렬을 위해 추가
-                })
-            chatrooms_info.sort(key=lambda x: safe_datetime(x.get("latest_message_timestamp")), reverse=True)
-            # chatrooms_info.sort(key=lambda x: x["latest_message_timestamp"] or datetime.min, reverse=True)
-
-            return chatrooms_info
+            # 채팅방 목록 전체를 쿼리 한 번(thread hop 한 번)으로 생성, 재연결이 몰릴 때는 짧은 TTL 캐시에서
+            return await db_sync_to_async(get_inbox_snapshot)(user)
         except Exception as e:
             print(f"Error in get_chatrooms_with_unread_messages: {e}")
             return []
 
-    async def update_unread_count(self, event):
-        room_id = event['room_id']
-        unread_messages = event['unread_messages']
+    async def inbox_delta(self, event):
+        """
+        채팅방 하나의 요약만 다시 계산해서 전송
+        {"type": "chatroom_update", "room": {...채팅방 목록 항목...}, "position": 0 | null}
+        보낼 때 계산하므로 같은 채팅방 변경분이 밀려 있으면 한 번만 조회/전송
+        """
+        room_id = int(event["room_id"])
+        await self.queue_frame(
+            DeferredFrame(self.build_chatroom_update, room_id=room_id, position=event.get("position")),
+            key=("chatroom_update", room_id)
+        )
 
-        chatrooms = await self.get_chatrooms_with_unread_messages(self.user_email)
+    async def build_chatroom_update(self, room_id, position):
+        room = await db_sync_to_async(build_inbox_room)(self.scope["user"], room_id)
+        if room is None:
+            return None
+        return {
+            "type": "chatroom_update",
+            "room": room,
+            "position": position
+        }
 
-        for room in chatrooms:
-            if room["room_id"] == int(room_id):
-                room["unread_messages"] = unread_messages
+    async def update_unread_count(self, event):
+        """(이전 버전 호환) 해당 채팅방의 변경분 전송"""
+        await self.inbox_delta({"room_id": int(event['room_id']), "position": None})
 
     async def update_chatrooms(self, event):
-        """ 채팅방 리스트를 즉시 갱신 """
-        chatrooms = await self.get_chatrooms_with_unread_messages(self.user_email)
-        await self.send_json({
-            'type': 'chatrooms_list',
-            'chatrooms': chatrooms
-        })
\ No newline at end of file
+        """(이전 버전 호환) room_id 가 있으면 변경분, 없으면 전체 목록 전송"""
+        if event.get("room_id"):
+            await self.inbox_delta({"room_id": int(event["room_id"]), "position": event.get("position")})
+        else:
+            await self.send_chatrooms_list()
+
+    async def community_event(self, event):
+        """커뮤니티 알림 (좋아요, 댓글) 전송 - {"type": "notification", "event": "post_like" | "comment", ...}"""
+        payload = {key: value for key, value in event.items() if key != "type"}
+        await self.send_json({"type": "notification", **payload})
+
+
+class MultiplexConsumer(ChatRoomSessionMixin, FloodControlMixin, UserChatConsumer):
+    """
+    유저당 웹소켓 하나 (ws/user/stream)
+    채팅방 목록(UserChatConsumer 와 같은 프레임)과 여러 채팅방을 한 연결에서 처리해서
+    채팅방을 옮길 때마다 새로 연결(handshake, JWT 인증)하지 않도록 함
+
+    채팅방 명령 (모두 room_id 포함)
+      {"type": "join", "room_id": 1, "last_seq": N(재연결 시)} -> backlog / resume / resync_required 프레임
+      {"type": "leave", "room_id": 1}
+      {"type": "send", "room_id": 1, "message": "...", "image": ...}
+      {"type": "load_backlog", "room_id": 1, "before": cursor}
+    채팅방에서 오는 프레임에는 room_id 를 붙여서 보냄 (join 하지 않은 채팅방의 이벤트는 보내지 않음)
+    잘못된 명령(room_id/before/limit 가 숫자가 아님, join 하지 않은 채팅방)에는 연결을 유지한 채 room_error 프레임으로 응답
+    """
+    room_commands = ("join", "leave", "send", "load_backlog")
+
+    async def connect(self):
+        # room_id -> {'room', 'opponent_id', 'opponent_email'}
+        self.rooms = {}
+        self.device_id = self.get_device_id()
+        self.presence_task = None
+        await super().connect()
+
+    async def disconnect(self, close_code):
+        rooms = getattr(self, 'rooms', {})
+        if rooms:
+            # 아직 저장되지 않은 메시지 저장
+            await get_message_writer().flush()
+        for room_id in list(rooms):
+            await self.leave_room(room_id)
+        await super().disconnect(close_code)
+
+    async def receive_json(self, content):
+        command = content.get("type")
+        if command not in self.room_commands:
+            await super().receive_json(content)
+            return
+
+        # 잘못된 채팅방 명령은 error 프레임으로 응답 (예외로 끊으면 채팅방 목록과 다른 채팅방까지 같이 끊김)
+        room_id = parse_int(content.get("room_id"))
+        if room_id is None:
+            await self.send_room_error(command, content.get("room_id"), 4400, "room_id 는 숫자여야 합니다.")
+        elif command == "join":
+            await self.join_room(room_id, content)
+        elif command == "leave":
+            await self.leave_room(room_id)
+        elif room_id not in self.rooms:
+            await self.send_room_error(command, room_id, 4403, "참여 중인 채팅방이 아닙니다.")
+        elif command == "send":
+            await self.send_room_message(room_id, content)
+        else:
+            await self.load_room_backlog(room_id, content)
+
+    async def join_room(self, room_id, content):
+        user = self.scope["user"]
+        last_seq = content.get("last_seq")
+        if last_seq is not None and parse_int(last_seq) is None:
+            await self.send_room_error("join", room_id, 4400, "last_seq 는 숫자여야 합니다.")
+            return
+        if room_id not in self.rooms and len(self.rooms) >= settings.CHAT_MULTIPLEX_MAX_ROOMS:
+            await self.send_json({'type': 'join_error', 'room_id': room_id, 'code': 4429})
+            return
+
+        bootstrap = await self.bootstrap_connection(room_id, user, parse_int(last_seq))
+        if bootstrap is None or not bootstrap['is_member']:
+            # ChatConsumer 의 close code 와 같음 (4404: 채팅방 없음, 4403: 참여자가 아님)
+            await self.send_json({'type': 'join_error', 'room_id': room_id, 'code': 4404 if bootstrap is None else 4403})
+            return
+
+        group_name = self.get_group_name(room_id)
+        if room_id not in self.rooms:
+            await self.channel_layer.group_add(group_name, self.channel_name)
+            await get_presence().aadd(group_name, user.id, self.channel_name, self.device_id)
+        self.rooms[room_id] = {
+            'room': bootstrap['room'],
+            'opponent_id': bootstrap['opponent_id'],
+            'opponent_email': bootstrap['opponent_email'],
+        }
+        if self.presence_task is None:
+            self.presence_task = asyncio.create_task(self.keep_presence_alive())
+
+        await self.send_json({**bootstrap['frame'], 'room_id': room_id})
+        await self.publish_room_joined(user, room_id)
+
+    async def leave_room(self, room_id):
+        if self.rooms.pop(room_id, None) is None:
+            return
+        group_name = self.get_group_name(room_id)
+        await get_presence().aremove(group_name, self.scope["user"].id, self.channel_name, self.device_id)
+        await self.channel_layer.group_discard(group_name, self.channel_name)
+        if not self.rooms and self.presence_task:
+            self.presence_task.cancel()
+            self.presence_task = None
+
+    async def keep_presence_alive(self):
+        """참여 중인 모든 채팅방의 접속 상태를 TTL 안에 한 번에 갱신"""
+        presence = get_presence()
+        interval = max(presence.ttl / 3, 1)
+        while True:
+            await asyncio.sleep(interval)
+            for room_id in list(self.rooms):
+                try:
+                    await presence.atouch(self.get_group_name(room_id), self.scope["user"].id, self.channel_name, self.device_id)
+                except Exception as e:
+                    print(f"Error in keep_presence_alive: {e}")
+
+    async def send_room_message(self, room_id, content):
+        message = content.get("message", "")
+        if not message:
+            await self.send_room_error("send", room_id, 4400, "메시지가 비어 있습니다.")
+            return
+        if not await self.check_flood(room_id):
+            return
+        joined = self.rooms[room_id]
+        await self.publish_room_message(
+            joined['room'], self.scope["user"], joined['opponent_id'], joined['opponent_email'],
+            message, content.get("image", None)
+        )
+
+    async def load_room_backlog(self, room_id, content):
+        before = parse_int(content.get('before'))
+        limit = parse_int(content.get('limit', settings.CHAT_BACKLOG_LIMIT))
+        if before is None or limit is None:
+            await self.send_room_error("load_backlog", room_id, 4400, "before, limit 은 숫자여야 합니다.")
+            return
+        limit = max(1, min(limit, settings.CHAT_BACKLOG_LIMIT))
+        messages, has_more = await self.get_messages_before(self.rooms[room_id]['room'], before, limit)
+        await self.send_json({**self.make_backlog_frame(messages, has_more), 'room_id': room_id})
+
+    async def chat_message(self, event):
+        if event.get('room_id') in self.rooms:
+            await self.send_json({**self.make_chat_message_frame(event), 'room_id': event['room_id']})
+
+    async def message_persisted(self, event):
+        if event.get('room_id') in self.rooms:
+            await self.send_json({'type': 'message_persisted', 'room_id': event['room_id'], 'messages': event['messages']})
+
+    async def message_failed(self, event):
+        if event.get('room_id') in self.rooms:
+            await self.send_json({
+                'type': 'message_failed',
+                'room_id': event['room_id'],
+                'provisional_ids': event['provisional_ids']
+            })
+
+    async def update_read_status(self, event):
+        room_id = int(event['room_id'])
+        if room_id in self.rooms:
+            await self.queue_frame({
+                'type': 'update_read_status',
+                'room_id': room_id,
+                'is_read': event['is_read']
+            }, key=('update_read_status', room_id))
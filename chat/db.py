@@ -0,0 +1,79 @@
+"""
+consumer DB 조회용 전용 스레드 풀
+
+channels 의 database_sync_to_async 는 thread_sensitive=True 라서 워커의 모든 웹소켓 연결이 스레드 하나에서 차례로 DB 를 조회한다.
+(Django 5.1 의 async ORM - aget, acount, aupdate, async for - 도 내부적으로 sync_to_async(thread_sensitive=True) 를 거치므로
+바꿔도 같은 스레드 앞에 줄을 선다.)
+입장(bootstrap_connection), 이전 메시지 조회, 채팅방 목록처럼 consumer 에서 자주 하는 조회는
+db_sync_to_async 로 크기가 CHAT_DB_EXECUTOR_WORKERS 로 정해진 스레드 풀에서 실행한다.
+
+- 스레드마다 DB 연결을 하나씩 쓰므로 이 워커의 동시 DB 연결 수도 이 값을 넘지 않는다.
+- 메시지 저장(MessageWriter.persist)은 쓰기가 겹치지 않도록 지금처럼 database_sync_to_async 로 한 스레드에서 한다.
+- 대기/실행 중인 작업 수는 db_executor_stats() 로 조회한다. (ws/stats 의 "db")
+"""
+import functools
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.db import DatabaseSyncToAsync
+from django.conf import settings
+
+_executor = None
+_executor_lock = threading.Lock()
+_totals = Counter()
+_totals_lock = threading.Lock()
+_in_flight = 0
+_peak_in_flight = 0
+
+
+def get_db_executor():
+    """consumer DB 조회용 스레드 풀 (프로세스당 하나)"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.CHAT_DB_EXECUTOR_WORKERS, thread_name_prefix="chat-db"
+                )
+    return _executor
+
+
+def db_sync_to_async(func):
+    """database_sync_to_async 와 같지만(DB 연결 정리 포함) 전용 스레드 풀에서 실행"""
+
+    @functools.wraps(func)
+    def timed(submitted_at, *args, **kwargs):
+        with _totals_lock:
+            _totals["wait_ms"] += (time.monotonic() - submitted_at) * 1000
+        return func(*args, **kwargs)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        global _in_flight, _peak_in_flight
+        _in_flight += 1
+        _peak_in_flight = max(_peak_in_flight, _in_flight)
+        try:
+            call = DatabaseSyncToAsync(timed, thread_sensitive=False, executor=get_db_executor())
+            return await call(time.monotonic(), *args, **kwargs)
+        finally:
+            _in_flight -= 1
+            with _totals_lock:
+                _totals["calls"] += 1
+
+    return wrapper
+
+
+def db_executor_stats():
+    """현재 워커의 DB 스레드 풀 상태"""
+    workers = settings.CHAT_DB_EXECUTOR_WORKERS
+    calls = _totals["calls"]
+    return {
+        "workers": workers,
+        "in_flight": _in_flight,
+        "queued": max(0, _in_flight - workers),
+        "peak_in_flight": _peak_in_flight,
+        "calls": calls,
+        "avg_wait_ms": round(_totals["wait_ms"] / calls, 1) if calls else 0,
+    }
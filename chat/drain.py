@@ -0,0 +1,51 @@
+"""
+배포(daphne 재시작) 시 웹소켓 연결 정리 (drain)
+
+daphne 를 그냥 재시작하면 모든 클라이언트가 같은 순간에 다시 연결하면서
+JWT 인증과 채팅방 목록 snapshot 조회가 한꺼번에 몰린다.
+project/server.py 로 실행한 워커는 SIGTERM 을 받으면 리스닝 소켓을 닫고 start_drain() 을 호출한다.
+
+- 이 워커의 기존 연결에는 {"type": "server_restart", "reconnect_after": 초} 를 보내고 4503 으로 끊는다.
+  reconnect_after 는 0 ~ WEBSOCKET_DRAIN_RECONNECT_SPREAD 초 사이 랜덤 값이라 재연결이 퍼져서 들어온다.
+- drain 중에 들어온 새 연결도 같은 프레임을 보내고 바로 끊는다.
+- 재연결 때 채팅방 목록은 짧은 TTL snapshot 캐시(chat/inbox.py)에서 먼저 찾는다.
+"""
+import asyncio
+import random
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+# 1012(service restart)는 daphne(autobahn)에서 보낼 수 없으므로 4503 사용
+CLOSE_CODE_SERVICE_RESTART = 4503
+
+_draining = False
+
+
+def is_draining():
+    return _draining
+
+
+def make_restart_event():
+    return {
+        "type": "server_restart",
+        "reconnect_after": round(random.uniform(0, settings.WEBSOCKET_DRAIN_RECONNECT_SPREAD), 1)
+    }
+
+
+async def start_drain(channel_layer=None):
+    """이 워커의 모든 연결에 server_restart 전송 요청, 요청한 연결 수 반환"""
+    global _draining
+    from .heartbeat import live_channel_names
+
+    _draining = True
+    channel_layer = channel_layer or get_channel_layer()
+    channel_names = live_channel_names()
+    results = await asyncio.gather(
+        *(channel_layer.send(channel_name, make_restart_event()) for channel_name in channel_names),
+        return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"Error in start_drain: {result}")
+    return len(channel_names)
@@ -0,0 +1,71 @@
+"""
+채널 레이어 fan-out 묶음 전송
+
+하나의 동작(메시지 전송, 입장, 약속 생성 등)에서 나오는 이벤트를 그룹별로 모아서
+그룹마다 group_send 한 번으로 보낸다. 이벤트가 두 개 이상이면 fanout_envelope 하나로 감싸고,
+받는 쪽 consumer 는 EnvelopeDispatchMixin 이 원래 이벤트 핸들러로 하나씩 풀어서 전달한다.
+서로 다른 그룹으로의 전송은 동시에 실행한다. (그룹마다 group_send 를 따로 호출하는 것이고 Redis pipeline 으로 묶지는 않음)
+inbox_delta 를 보내기 전에 해당 유저들의 채팅방 목록 snapshot 캐시를 지운다. (chat/inbox.py)
+"""
+import asyncio
+from collections import defaultdict
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+from .db import db_sync_to_async
+from .inbox import forget_inbox_snapshots
+from .utils import get_user_group_name
+
+
+class FanOut:
+    def __init__(self, channel_layer=None):
+        self.channel_layer = channel_layer
+        self.events = defaultdict(list)
+        self.inbox_emails = set()
+
+    def add(self, group_name, event):
+        self.events[group_name].append(event)
+        return self
+
+    def add_inbox_delta(self, emails, room_id, position=None):
+        """참여자들의 UserChatConsumer 에 채팅방 하나의 변경분(inbox_delta) 요청 추가"""
+        for email in emails:
+            if email:
+                self.inbox_emails.add(email)
+                self.add(get_user_group_name(email), {
+                    "type": "inbox_delta",
+                    "room_id": int(room_id),
+                    "position": position
+                })
+        return self
+
+    def envelopes(self):
+        for group_name, events in self.events.items():
+            if len(events) == 1:
+                yield group_name, events[0]
+            else:
+                yield group_name, {"type": "fanout_envelope", "events": events}
+
+    async def publish(self):
+        channel_layer = self.channel_layer or get_channel_layer()
+        envelopes = list(self.envelopes())
+        self.events.clear()
+        if self.inbox_emails:
+            emails, self.inbox_emails = self.inbox_emails, set()
+            await db_sync_to_async(forget_inbox_snapshots)(emails)
+        await asyncio.gather(*(
+            channel_layer.group_send(group_name, message) for group_name, message in envelopes
+        ))
+
+    def publish_sync(self):
+        """동기 코드(REST view, serializer)에서 사용"""
+        async_to_sync(self.publish)()
+
+
+class EnvelopeDispatchMixin:
+    """fanout_envelope 로 묶여서 온 이벤트를 각각의 핸들러로 전달"""
+
+    async def fanout_envelope(self, event):
+        for inner_event in event["events"]:
+            await self.dispatch(inner_event)
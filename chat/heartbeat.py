@@ -0,0 +1,146 @@
+"""
+웹소켓 연결 관리 (heartbeat, idle 연결 정리, 유저별 연결 수 제한)
+
+TCP 가 끊긴 걸 알아채기 전까지는 죽은 연결도 채널 레이어 그룹과 접속 상태(presence)에 그대로 남아서
+메모리와 그룹 전송 비용을 계속 쓴다.
+
+- 클라이언트가 WEBSOCKET_PING_INTERVAL 동안 아무 프레임도 보내지 않으면 {"type": "ping"} 을 보내고,
+  클라이언트는 {"type": "pong"} 으로 응답한다. (클라이언트가 {"type": "ping"} 을 보내면 {"type": "pong"} 응답)
+- WEBSOCKET_IDLE_TIMEOUT 동안 아무 프레임도 받지 못하면 4408 로 연결을 끊는다. (disconnect 에서 그룹/접속 상태 정리)
+- 유저별 연결 수는 presence 레지스트리("connections" 그룹)로 워커/노드 전체에서 세고,
+  WEBSOCKET_MAX_CONNECTIONS_PER_USER 개를 넘으면 새 연결을 4429 로 끊는다.
+- 워커(프로세스)별 연결 목록은 connection_stats() 로 조회한다.
+- 배포 중(chat/drain.py)에는 server_restart 프레임을 보내고 4503 으로 끊는다.
+"""
+import asyncio
+import time
+from collections import Counter
+
+from django.conf import settings
+
+from .drain import CLOSE_CODE_SERVICE_RESTART, is_draining, make_restart_event
+from .presence import get_presence
+
+CLOSE_CODE_IDLE = 4408
+CLOSE_CODE_TOO_MANY_CONNECTIONS = 4429
+CONNECTIONS_GROUP = "connections"
+
+# channel_name -> 연결 정보 (현재 워커)
+_connections = {}
+
+
+def live_channel_names():
+    return list(_connections)
+
+
+def connection_stats(top=10):
+    """현재 워커의 웹소켓 연결 현황"""
+    now = time.monotonic()
+    connections = list(_connections.values())
+    per_user = Counter(connection["user_id"] for connection in connections)
+    idle = [now - connection["last_seen"] for connection in connections]
+    return {
+        "connections": len(connections),
+        "users": len(per_user),
+        "by_consumer": dict(Counter(connection["consumer"] for connection in connections)),
+        "idle_over_ping_interval": sum(1 for seconds in idle if seconds >= settings.WEBSOCKET_PING_INTERVAL),
+        "max_idle_seconds": round(max(idle, default=0), 1),
+        "oldest_seconds": round(max((now - connection["connected_at"] for connection in connections), default=0), 1),
+        "top_users": [{"user_id": user_id, "connections": count} for user_id, count in per_user.most_common(top)],
+    }
+
+
+class HeartbeatMixin:
+    """
+    AsyncJsonWebsocketConsumer 와 함께 사용 (OutboundQueueMixin, NegotiatedCodecMixin 보다 앞에)
+    consumer 의 receive_json 맨 앞에서 handle_heartbeat(content) 가 True 면 더 처리하지 않는다.
+    """
+    heartbeat_task = None
+
+    async def websocket_connect(self, message):
+        if is_draining():
+            await self.reject(CLOSE_CODE_SERVICE_RESTART, make_restart_event())
+            return
+        user = self.scope.get("user")
+        if user is not None and not user.is_anonymous and await self.connection_limit_reached(user):
+            await self.reject(CLOSE_CODE_TOO_MANY_CONNECTIONS)
+            return
+        await super().websocket_connect(message)
+
+    async def reject(self, code, frame=None):
+        """
+        연결 거부: close code 를 전달하기 위해 수락 후 바로 종료 (connect 에서 사용)
+        수락 전에 close 하면 daphne 가 HTTP 403 으로 거절해서 클라이언트는 close code 를 받지 못한다.
+        연결 등록/heartbeat/송신 큐는 만들지 않는다.
+        """
+        await self.base_send({"type": "websocket.accept"})
+        if frame is not None:
+            await self.send_now(frame)
+        await self.base_send({"type": "websocket.close", "code": code})
+
+    async def connection_limit_reached(self, user):
+        try:
+            count = await get_presence().aconnection_count(CONNECTIONS_GROUP, user.id)
+        except Exception as e:
+            print(f"Error in connection_limit_reached: {e}")
+            return False
+        return count >= settings.WEBSOCKET_MAX_CONNECTIONS_PER_USER
+
+    async def accept(self, subprotocol=None):
+        await super().accept(subprotocol=subprotocol)
+        now = time.monotonic()
+        self.last_seen = now
+        _connections[self.channel_name] = {
+            "user_id": self.scope["user"].id,
+            "consumer": type(self).__name__,
+            "connected_at": now,
+            "last_seen": now,
+        }
+        await self.touch_connection()
+        self.heartbeat_task = asyncio.create_task(self.keep_alive())
+
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        self.last_seen = time.monotonic()
+        if self.channel_name in _connections:
+            _connections[self.channel_name]["last_seen"] = self.last_seen
+        await super().receive(text_data=text_data, bytes_data=bytes_data, **kwargs)
+
+    async def handle_heartbeat(self, content):
+        if content.get("type") == "ping":
+            await self.send_json({"type": "pong"})
+            return True
+        return content.get("type") == "pong"
+
+    async def touch_connection(self):
+        try:
+            await get_presence().atouch(CONNECTIONS_GROUP, self.scope["user"].id, self.channel_name)
+        except Exception as e:
+            print(f"Error in touch_connection: {e}")
+
+    async def keep_alive(self):
+        """ping 전송, 연결 수 집계 갱신, idle 연결 종료"""
+        interval = settings.WEBSOCKET_PING_INTERVAL
+        while True:
+            await asyncio.sleep(interval)
+            idle = time.monotonic() - self.last_seen
+            if idle >= settings.WEBSOCKET_IDLE_TIMEOUT:
+                await self.close(code=CLOSE_CODE_IDLE)
+                return
+            if idle >= interval:
+                await self.send_json({"type": "ping"})
+            await self.touch_connection()
+
+    async def server_restart(self, event):
+        """drain: 아직 보내지 않은 프레임은 버리고(재연결 후 resume) 재연결 시각만 알린 뒤 종료"""
+        await self.send_now({"type": "server_restart", "reconnect_after": event["reconnect_after"]})
+        await self.close(code=CLOSE_CODE_SERVICE_RESTART)
+
+    async def websocket_disconnect(self, message):
+        if self.heartbeat_task is not None:
+            self.heartbeat_task.cancel()
+            _connections.pop(self.channel_name, None)
+            try:
+                await get_presence().aremove(CONNECTIONS_GROUP, self.scope["user"].id, self.channel_name)
+            except Exception as e:
+                print(f"Error in websocket_disconnect: {e}")
+        await super().websocket_disconnect(message)
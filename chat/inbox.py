@@ -0,0 +1,107 @@
+"""
+UserChatConsumer 채팅방 목록(inbox) 조회
+
+채팅방마다 상대방/대표 강아지/안 읽은 메시지 수/최근 메시지를 따로 조회하던 것을
+Subquery 로 annotate 한 쿼리 하나 + participants prefetch 하나로 묶는다.
+최근 메시지와 안 읽은 메시지 수는 ChatRoom/ChatRoomMember 에 저장된 요약 컬럼을 읽는다.
+채팅방 수와 상관없이 쿼리 수가 일정하므로 consumer 에서는 thread hop 한 번으로 호출하면 된다.
+
+배포 후 재연결이 몰릴 때 같은 유저의 목록을 매번 다시 만들지 않도록 전체 목록은 CHAT_INBOX_SNAPSHOT_TTL 동안 캐시한다.
+(get_inbox_snapshot) 채팅방 목록이 바뀌는 곳(inbox_delta 전송, 채팅방 생성, 읽음 처리)에서 forget_inbox_snapshots 로 지운다.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, IntegerField, OuterRef, Prefetch, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from accounts.models import Dog, User
+from .models import ChatRoom, ChatRoomMember
+from .utils import format_latest_message_time
+
+
+def get_inbox_queryset(user):
+    """user 가 참여한 채팅방 + 목록에 필요한 값들을 annotate 한 queryset (최근 메시지 순)"""
+    opponents = User.objects.filter(chat_rooms=OuterRef("pk")).exclude(pk=user.pk).order_by("pk")
+    opponent_dogs = Dog.objects.filter(
+        user__chat_rooms=OuterRef("pk"), represent=True
+    ).exclude(user=user).order_by("id")
+    unread_counts = ChatRoomMember.objects.filter(room=OuterRef("pk"), user=user).values("unread_count")
+
+    # 최근 메시지/안 읽은 수는 ChatRoom, ChatRoomMember 에 저장된 요약을 사용 (last_message_at 인덱스로 정렬)
+    return (
+        ChatRoom.objects.filter(participants=user)
+        .select_related("last_message")
+        .annotate(
+            opponent_name=Subquery(opponents.values("user_name")[:1]),
+            opponent_email=Subquery(opponents.values("email")[:1]),
+            opponent_dog_image=Subquery(opponent_dogs.values("dog_image")[:1]),
+            unread_messages=Coalesce(Subquery(unread_counts[:1], output_field=IntegerField()), Value(0)),
+        )
+        .prefetch_related(Prefetch("participants", queryset=User.objects.only("id").order_by("id")))
+        .order_by(F("last_message_at").desc(nulls_last=True), "-id")
+    )
+
+
+def dog_image_url(name):
+    """Dog.dog_image 에 저장된 파일 이름을 URL 로 변환"""
+    if not name:
+        return None
+    return Dog._meta.get_field("dog_image").storage.url(name)
+
+
+def serialize_inbox_room(room):
+    """get_inbox_queryset 으로 가져온 채팅방 하나를 consumer 응답 형태로 변환"""
+    timestamp = room.last_message_at
+    return {
+        "id": room.id,
+        "room_id": room.id,
+        "opponent_user": room.opponent_name if room.opponent_email else "알 수 없음",
+        "opponent_email": room.opponent_email or "알 수 없음",
+        "opponent_user_profile": dog_image_url(room.opponent_dog_image),
+        "unread_messages": room.unread_messages,
+        "latest_message": room.last_message.text if room.last_message else "",
+        "latest_message_time": format_latest_message_time(timestamp),
+        "is_promise": room.last_message_has_promise,
+        "last_seq": room.last_seq,  # 재연결 시 {"type": "resume", "rooms": {id: last_seq}} 로 보냄
+        "participants": [participant.id for participant in room.participants.all()],
+        "latest_message_timestamp": timestamp.isoformat() if timestamp else None  # 정렬을 위해 추가
+    }
+
+
+def build_inbox(user):
+    """user 의 채팅방 목록 전체 (동기 함수, consumer 에서는 db_sync_to_async 로 한 번만 호출)"""
+    return [serialize_inbox_room(room) for room in get_inbox_queryset(user)]
+
+
+def build_inbox_room(user, room_id):
+    """채팅방 하나의 요약 (delta 전송용). user 가 참여하지 않은 방이면 None"""
+    room = get_inbox_queryset(user).filter(pk=room_id).first()
+    return serialize_inbox_room(room) if room else None
+
+
+def make_snapshot_key(email):
+    return f"chat:inbox:{email}"
+
+
+def get_inbox_snapshot(user):
+    """캐시된 전체 목록, 없으면 build_inbox 후 캐시 (캐시 오류는 무시하고 DB 에서 조회)"""
+    key = make_snapshot_key(user.email)
+    try:
+        inbox = cache.get(key)
+    except Exception as e:
+        print(f"채팅방 목록 캐시 조회 실패: {e}")
+        return build_inbox(user)
+    if inbox is None:
+        inbox = build_inbox(user)
+        try:
+            cache.set(key, inbox, settings.CHAT_INBOX_SNAPSHOT_TTL)
+        except Exception as e:
+            print(f"채팅방 목록 캐시 저장 실패: {e}")
+    return inbox
+
+
+def forget_inbox_snapshots(emails):
+    try:
+        cache.delete_many([make_snapshot_key(email) for email in emails if email])
+    except Exception as e:
+        print(f"채팅방 목록 캐시 삭제 실패: {e}")
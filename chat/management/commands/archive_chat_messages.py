@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chat.archive import archive_room
+from chat.models import ChatRoom, Message
+
+
+class Command(BaseCommand):
+    help = "오래된 채팅 메시지를 채팅방별 압축 세그먼트(MessageArchiveSegment)로 옮깁니다. (cron 등으로 주기적으로 실행)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=settings.CHAT_ARCHIVE_AFTER_DAYS, help="이 일수보다 오래된 메시지를 보관")
+        parser.add_argument("--segment-size", type=int, default=settings.CHAT_ARCHIVE_SEGMENT_SIZE, help="세그먼트당 최대 메시지 수")
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options["days"])
+        room_ids = list(
+            Message.objects.filter(timestamp__lt=cutoff).order_by().values_list("room_id", flat=True).distinct()
+        )
+
+        total = 0
+        for index, room in enumerate(ChatRoom.objects.filter(id__in=room_ids).order_by("id"), start=1):
+            # 채팅방 하나씩 트랜잭션 처리
+            total += archive_room(room, cutoff, options["segment_size"])
+            self.stdout.write(f"{index}/{len(room_ids)} 채팅방 처리")
+
+        self.stdout.write(self.style.SUCCESS(f"메시지 {total}개 보관 완료"))
@@ -0,0 +1,66 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from chat.models import ChatRoom, ChatRoomMember, Message
+
+
+class Command(BaseCommand):
+    help = "기존 데이터로 ChatRoom 최근 메시지 요약과 ChatRoomMember 읽음 위치/안 읽은 메시지 수를 다시 채웁니다."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="한 트랜잭션에서 처리할 채팅방 수")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        room_ids = list(ChatRoom.objects.order_by("id").values_list("id", flat=True))
+
+        for start in range(0, len(room_ids), batch_size):
+            batch = room_ids[start:start + batch_size]
+            with transaction.atomic():
+                self.backfill_rooms(batch)
+            self.stdout.write(f"{min(start + batch_size, len(room_ids))}/{len(room_ids)} 채팅방 처리")
+
+        self.stdout.write(self.style.SUCCESS("채팅방 요약 backfill 완료"))
+
+    def backfill_rooms(self, room_ids):
+        # 참여자 레코드 생성
+        participants = ChatRoom.participants.through.objects.filter(chatroom_id__in=room_ids)
+        ChatRoomMember.objects.bulk_create(
+            [ChatRoomMember(room_id=p.chatroom_id, user_id=p.user_id) for p in participants],
+            ignore_conflicts=True
+        )
+
+        # 최근 메시지 요약
+        for room in ChatRoom.objects.filter(id__in=room_ids):
+            latest = Message.objects.filter(room=room).order_by("-timestamp", "-id").first()
+            room.last_message = latest
+            room.last_message_at = latest.timestamp if latest else None
+            room.last_message_has_promise = bool(latest and latest.promise_id)
+            room.save(update_fields=["last_message", "last_message_at", "last_message_has_promise"])
+
+        # 참여자별 안 읽은 메시지 수 (읽음 위치 이후에 상대가 보낸 메시지)
+        # 읽음 위치가 아직 없는 참여자는 예전 is_read 값으로 채운다 (가장 오래된 안 읽은 메시지 바로 앞까지 읽음)
+        received_by_room = defaultdict(list)
+        received = Message.objects.filter(room_id__in=room_ids).order_by("id").values_list("room_id", "id", "sender_id", "is_read")
+        for room_id, message_id, sender_id, is_read in received:
+            received_by_room[room_id].append((message_id, sender_id, is_read))
+
+        members = list(ChatRoomMember.objects.filter(room_id__in=room_ids))
+        for member in members:
+            messages = received_by_room[member.room_id]
+            if not member.last_read_message_id:
+                first_unread_id = next(
+                    (message_id for message_id, sender_id, is_read in messages if sender_id != member.user_id and not is_read),
+                    None
+                )
+                if first_unread_id is not None:
+                    member.last_read_message_id = first_unread_id - 1
+                elif messages:
+                    member.last_read_message_id = messages[-1][0]
+            member.unread_count = sum(
+                1 for message_id, sender_id, _ in messages
+                if sender_id != member.user_id and message_id > member.last_read_message_id
+            )
+        ChatRoomMember.objects.bulk_update(members, ["last_read_message_id", "unread_count"])
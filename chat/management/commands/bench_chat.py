@@ -0,0 +1,379 @@
+import asyncio
+import time
+from collections import Counter
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.urls import path
+
+from accounts.models import User
+from chat import routing
+from chat.db import db_executor_stats
+from chat.models import ChatRoom, ChatRoomMember, Message
+from chat.presence import reset_presence
+from chat.search import get_search_backend
+from chat.throttle import reset_rate_limiter
+
+BENCH_EMAIL_DOMAIN = "bench.invalid"
+SCENARIOS = ("backlog", "fanout", "load")
+
+# --local: Redis 없이 한 프로세스 안에서 측정
+LOCAL_SETTINGS = {
+    "CHANNEL_LAYERS": {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    "CACHES": {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "email_verification": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    },
+    "CHAT_PRESENCE": {"BACKEND": "chat.presence.LocalPresenceBackend", "TTL": 60},
+    "CHAT_RATE_LIMIT": {"BACKEND": "chat.throttle.LocalRateLimiter"},
+}
+
+
+class LegacyJoinConsumer(AsyncJsonWebsocketConsumer):
+    """
+    backlog 비교용: 예전 ChatConsumer.connect 의 입장 처리
+    안 읽은 메시지(is_read=False)를 메시지마다 chat_message 프레임 하나로 모두 보내고 is_read 를 update
+    """
+
+    async def connect(self):
+        self.room_id = self.scope["url_route"]["kwargs"]["room_id"]
+        self.group_name = f"chat_room_{self.room_id}"
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        unread_messages = await self.get_unread_messages()
+        await self.accept()
+        for message in unread_messages:
+            await self.send_json({
+                "type": "chat_message",
+                "message": message["message"],
+                "sender_email": message["sender_email"],
+                "is_read": True
+            })
+        await self.mark_messages_as_read()
+        await self.channel_layer.group_send(self.group_name, {
+            "type": "update_read_status",
+            "room_id": self.room_id,
+            "is_read": True
+        })
+
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def update_read_status(self, event):
+        await self.send_json({"type": "update_read_status", "room_id": event["room_id"], "is_read": event["is_read"]})
+
+    def opponent_messages(self):
+        return Message.objects.filter(room_id=self.room_id, is_read=False).exclude(sender=self.scope["user"])
+
+    @database_sync_to_async
+    def get_unread_messages(self):
+        # 예전 코드처럼 sender 를 메시지마다 따로 조회
+        return [{"message": msg.text, "sender_email": msg.sender.email} for msg in self.opponent_messages()]
+
+    @database_sync_to_async
+    def mark_messages_as_read(self):
+        self.opponent_messages().update(is_read=True)
+
+
+def percentiles(seconds):
+    values = sorted(seconds)
+    if not values:
+        return "-"
+    p50 = values[len(values) // 2]
+    p99 = values[min(len(values) - 1, int(len(values) * 0.99))]
+    return f"p50={p50 * 1000:.0f}ms p99={p99 * 1000:.0f}ms max={values[-1] * 1000:.0f}ms"
+
+
+class Command(BaseCommand):
+    help = (
+        "채팅 웹소켓 성능을 측정합니다. (채팅방 입장 backlog, fan-out 전송, 동시 부하에서의 DB 스레드 풀)"
+        " @bench.invalid 유저/채팅방을 만들어 측정하고 끝나면 지웁니다. 운영 DB 가 아닌 복사본에서 실행하세요."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("scenarios", nargs="*", help="실행할 측정: backlog, fanout, load (없으면 전부)")
+        parser.add_argument("--sockets", type=int, default=1000, help="fanout/load 에서 연결할 유저 수 (2명당 채팅방 하나)")
+        parser.add_argument("--unread", type=int, default=1000, help="backlog 에서 입장 전에 쌓아둘 안 읽은 메시지 수")
+        parser.add_argument("--messages", type=int, default=60, help="fanout/load 채팅방마다 미리 저장할 메시지 수")
+        parser.add_argument(
+            "--db-workers", type=int, default=settings.CHAT_DB_EXECUTOR_WORKERS, help="CHAT_DB_EXECUTOR_WORKERS"
+        )
+        parser.add_argument(
+            "--local", action="store_true",
+            help="채널 레이어/캐시/접속 상태/속도 제한을 프로세스 안 메모리 백엔드로 바꿔서 측정 (Redis 없이 실행)"
+        )
+
+    def handle(self, *args, **options):
+        scenarios = options["scenarios"] or list(SCENARIOS)
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"알 수 없는 측정: {', '.join(sorted(unknown))} (가능: {', '.join(SCENARIOS)})")
+        overrides = {
+            "CHAT_DB_EXECUTOR_WORKERS": options["db_workers"],
+            # 측정 중에 ping/idle timeout 으로 끊기지 않도록
+            "WEBSOCKET_PING_INTERVAL": 3600,
+            "WEBSOCKET_IDLE_TIMEOUT": 7200,
+        }
+        if options["local"]:
+            overrides.update(LOCAL_SETTINGS)
+
+        with override_settings(**overrides):
+            reset_presence()
+            reset_rate_limiter()
+            self.application = URLRouter(routing.websocket_urlpatterns + [
+                path("bench/legacy/room/<int:room_id>", LegacyJoinConsumer.as_asgi()),
+            ])
+            for scenario in scenarios:
+                self.cleanup()
+                try:
+                    getattr(self, f"bench_{scenario}")(options)
+                finally:
+                    self.cleanup()
+
+    # --- 데이터 준비/정리 ---
+
+    def cleanup(self):
+        users = User.objects.filter(email__endswith=f"@{BENCH_EMAIL_DOMAIN}")
+        room_ids = list(ChatRoom.objects.filter(participants__in=users).values_list("id", flat=True).distinct())
+        if room_ids:
+            get_search_backend().clear(room_ids)
+        # 채팅방/메시지/참여자 레코드는 low_user, high_user, sender 에서 CASCADE 로 같이 삭제
+        users.delete()
+
+    def create_rooms(self, room_count, messages_per_room, unread=False):
+        """
+        2명씩 1:1 채팅방 room_count 개 -> (유저 목록, 채팅방 목록), users[2 * i], users[2 * i + 1] 이 rooms[i] 참여자
+        unread=False 면 메시지를 모두 읽은 상태, True 면 두 번째 유저가 아무것도 읽지 않은 상태
+        """
+        password = make_password(None)
+        users = User.objects.bulk_create([
+            User(email=f"bench{i}@{BENCH_EMAIL_DOMAIN}", user_name=f"bench{i}", password=password)
+            for i in range(room_count * 2)
+        ])
+        rooms = ChatRoom.objects.bulk_create([
+            ChatRoom(low_user=users[2 * i], high_user=users[2 * i + 1], last_seq=messages_per_room)
+            for i in range(room_count)
+        ])
+        Participant = ChatRoom.participants.through
+        Participant.objects.bulk_create([
+            Participant(chatroom_id=room.id, user_id=users[2 * i + k].id) for i, room in enumerate(rooms) for k in (0, 1)
+        ])
+        # 메시지 저장은 bulk_create 로 (Message.save 의 요약 갱신/검색 색인은 측정 대상이 아님)
+        Message.objects.bulk_create([
+            Message(
+                room_id=room.id, sender_id=users[2 * i + (0 if unread else j % 2)].id, text=f"bench {j}", seq=j + 1
+            )
+            for i, room in enumerate(rooms) for j in range(messages_per_room)
+        ])
+        read_upto = 0 if unread else Message.objects.order_by("-id").values_list("id", flat=True).first() or 0
+        ChatRoomMember.objects.bulk_create([
+            ChatRoomMember(room_id=room.id, user_id=users[2 * i + k].id, last_read_message_id=read_upto)
+            for i, room in enumerate(rooms) for k in (0, 1)
+        ])
+        return users, rooms
+
+    # --- 웹소켓 ---
+
+    async def connect(self, path, user, first_frame):
+        """연결 후 first_frame 타입 프레임을 받을 때까지 -> (communicator, 걸린 시간, 받은 프레임)"""
+        communicator = WebsocketCommunicator(self.application, path)
+        communicator.scope["user"] = user
+        started = time.perf_counter()
+        connected, _ = await communicator.connect(timeout=120)
+        if not connected:
+            raise RuntimeError(f"{path} 연결 실패")
+        frame = await self.receive_until(communicator, lambda frame: frame.get("type") == first_frame)
+        return communicator, time.perf_counter() - started, frame
+
+    @staticmethod
+    async def receive_until(communicator, predicate):
+        while True:
+            frame = await communicator.receive_json_from(timeout=120)
+            if predicate(frame):
+                return frame
+
+    @staticmethod
+    async def drain(communicator):
+        """남은 프레임을 모두 버림 (이전 측정의 프레임이 다음 측정에 섞이지 않도록)"""
+        frames = 0
+        while not await communicator.receive_nothing(0.05):
+            await communicator.receive_output()
+            frames += 1
+        return frames
+
+    # --- 측정 ---
+
+    def bench_backlog(self, options):
+        """
+        안 읽은 메시지가 --unread 개 쌓인 채팅방 입장 시간 (같은 데이터로 예전 방식/지금 방식 비교)
+        - 예전: 안 읽은 메시지마다 chat_message 프레임 하나 (LegacyJoinConsumer, 마지막 프레임까지)
+        - 지금: 최근 CHAT_BACKLOG_LIMIT 개만 backlog 프레임 하나 (ChatConsumer)
+        """
+        unread = options["unread"]
+        # 채팅방 두 개에 같은 메시지를 쌓고 하나씩 사용 (읽음 처리가 다른 쪽 측정에 영향을 주지 않도록)
+        users, rooms = self.create_rooms(2, unread, unread=True)
+
+        async def run_legacy():
+            communicator = WebsocketCommunicator(self.application, f"/bench/legacy/room/{rooms[0].id}")
+            communicator.scope["user"] = users[1]
+            started = time.perf_counter()
+            connected, _ = await communicator.connect(timeout=120)
+            if not connected:
+                raise RuntimeError("예전 방식 입장 연결 실패")
+            for _ in range(unread):
+                await self.receive_until(communicator, lambda frame: frame.get("type") == "chat_message")
+            elapsed = time.perf_counter() - started
+            await communicator.disconnect()
+            return elapsed
+
+        async def run():
+            communicator, elapsed, frame = await self.connect(f"/ws/room/{rooms[1].id}/messages", users[3], "backlog")
+            extra_frames = await self.drain(communicator)
+            await communicator.disconnect()
+            return elapsed, frame, extra_frames
+
+        legacy_elapsed = asyncio.run(run_legacy())
+        elapsed, frame, extra_frames = asyncio.run(run())
+        self.stdout.write(f"[backlog] 안 읽은 메시지 {unread}개 채팅방 입장")
+        self.stdout.write(f"  예전 방식: {legacy_elapsed * 1000:.0f}ms, chat_message 프레임 {unread}개")
+        self.stdout.write(
+            f"  지금 방식: {elapsed * 1000:.0f}ms, backlog 프레임 1개(메시지 {len(frame['messages'])}개, "
+            f"has_more={frame['has_more']}) + 다른 프레임 {extra_frames}개"
+        )
+
+    def bench_fanout(self, options):
+        """
+        유저마다 채팅방(ws/room) + 채팅방 목록(ws/user/chatrooms) 연결, 채팅방마다 메시지 하나씩 전송
+        상대방이 채팅방에 있을 때/나갔을 때 각각 전달 시간과 메시지당 group_send 횟수
+        (예전 코드: 상대방이 있으면 1회, 없으면 3회 - chat_message, update_unread_count, update_chatrooms)
+        --local 없이 실행하면 settings.CHANNEL_LAYERS(Redis) 로 측정
+        """
+        room_count = max(1, options["sockets"] // 2)
+        users, rooms = self.create_rooms(room_count, options["messages"])
+        channel_layer = get_channel_layer()
+        sends = Counter()
+        group_send = channel_layer.group_send
+
+        async def counted_group_send(group, message):
+            sends["group_send"] += 1
+            sends["events"] += len(message["events"]) if message["type"] == "fanout_envelope" else 1
+            return await group_send(group, message)
+
+        async def run():
+            connections = await asyncio.gather(*(
+                self.connect(f"/ws/room/{rooms[i // 2].id}/messages", users[i], "backlog") for i in range(len(users))
+            ))
+            room_sockets = [communicator for communicator, _, _ in connections]
+            inbox_connections = await asyncio.gather(*(
+                self.connect("/ws/user/chatrooms", user, "chatrooms_list") for user in users
+            ))
+            inbox_sockets = [communicator for communicator, _, _ in inbox_connections]
+            await asyncio.gather(*(self.drain(communicator) for communicator in room_sockets + inbox_sockets))
+
+            async def chat(index, phase, opponent_present):
+                await asyncio.sleep(0.002 * index)
+                text = f"fanout {phase} {index}"
+                started = time.perf_counter()
+                await room_sockets[2 * index].send_json_to({"message": text})
+                if opponent_present:
+                    await self.receive_until(room_sockets[2 * index + 1], lambda frame: frame.get("message") == text)
+                else:
+                    await self.receive_until(
+                        inbox_sockets[2 * index + 1],
+                        lambda frame: frame.get("type") == "chatroom_update" and frame["room"]["id"] == rooms[index].id
+                    )
+                latency = time.perf_counter() - started
+                # 저장 완료(message_persisted)까지 기다려야 저장 후 전송까지 group_send 횟수에 포함됨
+                await self.receive_until(room_sockets[2 * index], lambda frame: frame.get("type") == "message_persisted")
+                return latency
+
+            results = {}
+            for phase, opponent_present in (("present", True), ("absent", False)):
+                if not opponent_present:
+                    # 상대방은 채팅방에서 나가고 채팅방 목록 연결만 유지
+                    await asyncio.gather(*(room_sockets[2 * i + 1].disconnect() for i in range(len(rooms))))
+                    await asyncio.gather(*(self.drain(communicator) for communicator in room_sockets[::2] + inbox_sockets))
+                sends.clear()
+                channel_layer.group_send = counted_group_send
+                try:
+                    started = time.perf_counter()
+                    latencies = await asyncio.gather(*(
+                        chat(index, phase, opponent_present) for index in range(len(rooms))
+                    ))
+                    results[phase] = (latencies, time.perf_counter() - started, dict(sends))
+                finally:
+                    channel_layer.group_send = group_send
+            await asyncio.gather(*(communicator.disconnect() for communicator in room_sockets[::2] + inbox_sockets))
+            return results
+
+        results = asyncio.run(run())
+        self.stdout.write(
+            f"[fanout] {type(channel_layer).__name__}, 채팅방 {len(rooms)}개 ({len(users) * 2}개 연결), 채팅방마다 메시지 하나"
+        )
+        for phase, label, target in (("present", "상대방이 채팅방에 있음", "채팅방"), ("absent", "상대방이 나감", "채팅방 목록")):
+            latencies, total, counts = results[phase]
+            self.stdout.write(
+                f"  {label}: {total:.1f}s, group_send {counts.get('group_send', 0)}회 "
+                f"(메시지당 {counts.get('group_send', 0) / len(rooms):.1f}회, 이벤트 {counts.get('events', 0)}개), "
+                f"상대방 {target} 전달 {percentiles(latencies)}"
+            )
+
+    def bench_load(self, options):
+        """
+        --sockets 개 채팅방 연결 후 대부분의 연결이 동시에 이전 메시지(load_backlog)를 조회하는 동안
+        다른 채팅방 메시지 전달 시간 (consumer DB 조회가 전용 스레드 풀 chat/db.py 에서 실행되는지)
+        """
+        room_count = max(1, options["sockets"] // 2)
+        users, rooms = self.create_rooms(room_count, options["messages"])
+
+        async def run():
+            started = time.perf_counter()
+            connections = await asyncio.gather(*(
+                self.connect(f"/ws/room/{rooms[i // 2].id}/messages", users[i], "backlog") for i in range(len(users))
+            ))
+            self.stdout.write(
+                f"[load] 연결 {len(users)}개: {time.perf_counter() - started:.1f}s, "
+                f"{percentiles([elapsed for _, elapsed, _ in connections])}"
+            )
+            sockets = [communicator for communicator, _, _ in connections]
+            await asyncio.gather(*(self.drain(communicator) for communicator in sockets))
+
+            async def load_backlog(communicator):
+                started = time.perf_counter()
+                await communicator.send_json_to({"type": "load_backlog", "before": 10 ** 12, "limit": 50})
+                await self.receive_until(communicator, lambda frame: frame.get("type") == "backlog")
+                return time.perf_counter() - started
+
+            async def chat(index):
+                await asyncio.sleep(0.005 * index)
+                text = f"load {index}"
+                started = time.perf_counter()
+                await sockets[2 * index].send_json_to({"message": text})
+                await self.receive_until(sockets[2 * index + 1], lambda frame: frame.get("message") == text)
+                return time.perf_counter() - started
+
+            # 채팅방 10개 중 1개는 메시지만 주고받고 나머지는 전부 이전 메시지 조회
+            chatting = range(0, len(rooms), 10)
+            started = time.perf_counter()
+            backlog_latencies, chat_latencies = await asyncio.gather(
+                asyncio.gather(*(
+                    load_backlog(communicator) for i, communicator in enumerate(sockets) if (i // 2) % 10
+                )),
+                asyncio.gather(*(chat(index) for index in chatting)),
+            )
+            total = time.perf_counter() - started
+            await asyncio.gather(*(communicator.disconnect() for communicator in sockets))
+            return backlog_latencies, chat_latencies, total
+
+        backlog_latencies, chat_latencies, total = asyncio.run(run())
+        self.stdout.write(
+            f"  load_backlog {len(backlog_latencies)}개 동시: {total:.1f}s, {percentiles(backlog_latencies)}"
+        )
+        self.stdout.write(f"  그 사이 채팅 메시지 {len(chat_latencies)}개 전달 {percentiles(chat_latencies)}")
+        self.stdout.write(f"  DB 스레드 풀 {db_executor_stats()}")
@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat.outbox import dispatch_outbox
+
+
+class Command(BaseCommand):
+    help = "OutboxEvent 에 저장된 실시간 이벤트를 채널 레이어로 보냅니다. (웹 서버와 별도 프로세스로 하나만 실행)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="남은 이벤트를 한 번 보내고 종료")
+        parser.add_argument("--batch-size", type=int, default=settings.CHAT_OUTBOX_BATCH_SIZE, help="한 번에 보낼 이벤트 수")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if options["once"]:
+            total = 0
+            while True:
+                sent = dispatch_outbox(batch_size)
+                if not sent:
+                    break
+                total += sent
+            self.stdout.write(self.style.SUCCESS(f"이벤트 {total}개 전송"))
+            return
+
+        self.stdout.write("outbox 디스패처 시작")
+        while True:
+            # 보낼 이벤트가 있으면 바로 다음 배치, 없으면 잠시 대기
+            if not dispatch_outbox(batch_size):
+                time.sleep(settings.CHAT_OUTBOX_POLL_INTERVAL)
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from chat.archive import unpack_segment
+from chat.models import ChatRoom, Message, MessageArchiveSegment
+from chat.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = "메시지 검색 색인(chat/search.py)을 Message 테이블과 보관 세그먼트로 다시 만듭니다."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="한 트랜잭션에서 처리할 채팅방 수")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        backend = get_search_backend()
+        room_ids = list(ChatRoom.objects.order_by("id").values_list("id", flat=True))
+
+        indexed = 0
+        for start in range(0, len(room_ids), batch_size):
+            batch = room_ids[start:start + batch_size]
+            with transaction.atomic():
+                backend.clear(batch)
+                for segment in MessageArchiveSegment.objects.filter(room_id__in=batch).iterator():
+                    messages = unpack_segment(segment)
+                    backend.index(messages)
+                    indexed += len(messages)
+                messages = list(
+                    Message.objects.filter(room_id__in=batch).only("id", "room_id", "sender_id", "text", "timestamp")
+                )
+                backend.index(messages)
+                indexed += len(messages)
+            self.stdout.write(f"{min(start + batch_size, len(room_ids))}/{len(room_ids)} 채팅방 처리")
+
+        self.stdout.write(self.style.SUCCESS(f"메시지 검색 색인 완료 ({indexed}개)"))
@@ -0,0 +1,71 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:21
+
+import django.db.models.deletion
+from collections import defaultdict
+from django.conf import settings
+from django.db import migrations, models
+
+
+def merge_duplicate_direct_rooms(apps, schema_editor):
+    """같은 두 사람의 채팅방이 여러 개면 가장 먼저 만든 방으로 메시지를 옮기고 나머지는 삭제"""
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    ChatRoomMember = apps.get_model('chat', 'ChatRoomMember')
+    Message = apps.get_model('chat', 'Message')
+
+    participants = defaultdict(set)
+    for row in ChatRoom.participants.through.objects.values('chatroom_id', 'user_id'):
+        participants[row['chatroom_id']].add(row['user_id'])
+
+    pairs = defaultdict(list)
+    for room_id, user_ids in participants.items():
+        if len(user_ids) == 2:
+            pairs[tuple(sorted(user_ids))].append(room_id)
+
+    for (low_user_id, high_user_id), room_ids in pairs.items():
+        room_ids.sort()
+        keep_id, duplicate_ids = room_ids[0], room_ids[1:]
+
+        if duplicate_ids:
+            Message.objects.filter(room_id__in=duplicate_ids).update(room_id=keep_id)
+            ChatRoom.objects.filter(id__in=duplicate_ids).delete()
+
+            # 합쳐진 메시지로 요약 다시 계산
+            latest = Message.objects.filter(room_id=keep_id).order_by('-timestamp', '-id').first()
+            ChatRoom.objects.filter(id=keep_id).update(
+                last_message_id=latest.id if latest else None,
+                last_message_at=latest.timestamp if latest else None,
+                last_message_has_promise=bool(latest and latest.promise_id)
+            )
+            for member in ChatRoomMember.objects.filter(room_id=keep_id):
+                member.unread_count = Message.objects.filter(
+                    room_id=keep_id, is_read=False
+                ).exclude(sender_id=member.user_id).count()
+                member.save(update_fields=['unread_count'])
+
+        ChatRoom.objects.filter(id=keep_id).update(low_user_id=low_user_id, high_user_id=high_user_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0012_message_room_timestamp_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='high_user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='low_user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(merge_duplicate_direct_rooms, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='chatroom',
+            constraint=models.UniqueConstraint(fields=('low_user', 'high_user'), name='unique_direct_chat_room'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:22
+
+from django.db import migrations, models
+
+
+def init_read_watermarks(apps, schema_editor):
+    """기존 Message.is_read 값으로 참여자별 읽음 위치 초기화 (가장 오래된 안 읽은 메시지 바로 앞까지 읽음)"""
+    ChatRoomMember = apps.get_model('chat', 'ChatRoomMember')
+    Message = apps.get_model('chat', 'Message')
+
+    for member in ChatRoomMember.objects.all():
+        received = Message.objects.filter(room_id=member.room_id).exclude(sender_id=member.user_id)
+        first_unread_id = received.filter(is_read=False).order_by('id').values_list('id', flat=True).first()
+        if first_unread_id is None:
+            last_id = Message.objects.filter(room_id=member.room_id).order_by('-id').values_list('id', flat=True).first()
+            member.last_read_message_id = last_id or 0
+            member.unread_count = 0
+        else:
+            member.last_read_message_id = first_unread_id - 1
+            member.unread_count = received.filter(id__gte=first_unread_id).count()
+        member.save(update_fields=['last_read_message_id', 'unread_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0013_chatroom_direct_pair'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroommember',
+            name='last_read_message_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(init_read_watermarks, migrations.RunPython.noop),
+    ]
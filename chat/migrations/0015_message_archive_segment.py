@@ -0,0 +1,31 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0014_chatroommember_read_watermark'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageArchiveSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_at', models.DateTimeField()),
+                ('start_message_id', models.BigIntegerField()),
+                ('end_at', models.DateTimeField()),
+                ('end_message_id', models.BigIntegerField()),
+                ('message_count', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archive_segments', to='chat.chatroom')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['room', 'end_at', 'end_message_id'], name='chat_archive_room_end_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.1.4 on 2026-10-18 16:32
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def assign_message_seqs(apps, schema_editor):
+    """기존 메시지에 채팅방별 (timestamp, id) 순서로 번호 부여 (이미 보관된 메시지 수 다음부터)"""
+    ChatRoom = apps.get_model('chat', 'ChatRoom')
+    Message = apps.get_model('chat', 'Message')
+    MessageArchiveSegment = apps.get_model('chat', 'MessageArchiveSegment')
+
+    for room in ChatRoom.objects.all().iterator():
+        seq = MessageArchiveSegment.objects.filter(room=room).aggregate(total=Sum('message_count'))['total'] or 0
+        messages = list(Message.objects.filter(room=room).order_by('timestamp', 'id').only('id'))
+        for message in messages:
+            seq += 1
+            message.seq = seq
+        Message.objects.bulk_update(messages, ['seq'], batch_size=500)
+        room.last_seq = seq
+        room.save(update_fields=['last_seq'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0016_outbox_event'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_seq',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='seq',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(assign_message_seqs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='message',
+            constraint=models.UniqueConstraint(fields=('room', 'seq'), name='unique_chat_message_room_seq'),
+        ),
+    ]
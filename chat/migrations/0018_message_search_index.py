@@ -0,0 +1,29 @@
+# Generated by Django 5.1.4 on 2026-10-18 21:05
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    """메시지 검색용 FTS5 테이블 (chat/search.py), 기존 메시지는 rebuild_chat_search 명령으로 색인"""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS chat_message_search USING fts5("
+        "tokens, room_id UNINDEXED, sender_id UNINDEXED, text UNINDEXED, timestamp UNINDEXED)"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS chat_message_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0017_message_seq'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -1,5 +1,9 @@
-from django.db import models
+from collections import defaultdict
+
+from django.db import models, transaction
+from django.db.models import F, Q
 from accounts.models import User
+from .search import index_messages
 from django.core.exceptions import ValidationError
 
 # Create your models here.
@@ -33,13 +37,37 @@ class ChatRoom(models.Model):
     participants = models.ManyToManyField(User, related_name="chat_rooms")
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # 최근 메시지 요약 (메시지 저장 시 같은 트랜잭션에서 갱신, 채팅방 목록은 last_message_at 인덱스로 정렬)
+    last_message = models.ForeignKey("Message", on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+    last_message_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    last_message_has_promise = models.BooleanField(default=False)
+    # 마지막으로 발급한 메시지 번호 (Message.seq, 채팅방마다 1부터 빈틈없이 증가) - 재연결 시 delta-sync 에 사용
+    last_seq = models.PositiveBigIntegerField(default=0)
+
+    # 1:1 채팅방 참여자 쌍 (id 가 작은 쪽이 low_user) - 같은 두 사람의 채팅방은 하나만 존재
+    low_user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name="+")
+    high_user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name="+")
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
                 fields=["id"], name="unique_chat_room"
-            )  # 중복 방지
+            ),  # 중복 방지
+            models.UniqueConstraint(
+                fields=["low_user", "high_user"], name="unique_direct_chat_room"
+            )
         ]
 
+    @classmethod
+    def get_or_create_direct(cls, user1, user2):
+        """두 사람의 1:1 채팅방 조회 또는 생성 (동시에 요청해도 하나만 생성됨) -> (room, created)"""
+        low_user, high_user = sorted([user1, user2], key=lambda user: user.pk)
+        with transaction.atomic():
+            room, created = cls.objects.get_or_create(low_user=low_user, high_user=high_user)
+            if created:
+                room.participants.add(low_user, high_user)
+        return room, created
+
     def __str__(self):
         return f"ChatRoom {self.id} - Participants: {', '.join(user.email for user in self.participants.all())}"
     
@@ -50,6 +78,104 @@ class ChatRoom(models.Model):
             # 첫 번째 다른 참가자의 이름을 반환
             return other_participants.first().user_name  # 또는 email, 원하는 필드로 수정 가능
         return None
+
+    def reserve_seqs(self, count):
+        """
+        메시지 번호 count 개를 예약하고 첫 번호 반환 (메시지 저장과 같은 트랜잭션 안에서 호출)
+        채팅방 행을 update 하므로 커밋될 때까지 같은 방의 다른 저장은 기다리고, 번호는 커밋 순서대로 이어진다.
+        """
+        ChatRoom.objects.filter(id=self.id).update(last_seq=F("last_seq") + count)
+        self.last_seq = ChatRoom.objects.filter(id=self.id).values_list("last_seq", flat=True).get()
+        return self.last_seq - count + 1
+
+    def apply_new_message(self, message):
+        """새 메시지로 최근 메시지 요약과 참여자별 안 읽은 메시지 수 갱신 (Message.save 트랜잭션 안에서 호출)"""
+        self.apply_new_messages([message])
+
+    def apply_new_messages(self, messages):
+        """bulk_create 로 한 번에 저장한 메시지들을 요약에 반영 (트랜잭션 안에서 호출)"""
+        if not messages:
+            return
+        latest = max(messages, key=lambda message: (message.timestamp, message.id))
+        ChatRoom.objects.filter(pk=self.pk).filter(
+            Q(last_message_at__isnull=True) | Q(last_message_at__lte=latest.timestamp)
+        ).update(
+            last_message=latest,
+            last_message_at=latest.timestamp,
+            last_message_has_promise=latest.promise_id is not None
+        )
+
+        unread_by_sender = defaultdict(int)
+        read_upto_by_sender = {}
+        for message in messages:
+            if message.is_read:
+                # 상대방이 접속 중이라 바로 읽은 메시지 -> 상대방 읽음 위치를 이 메시지로
+                read_upto_by_sender[message.sender_id] = max(message.id, read_upto_by_sender.get(message.sender_id, 0))
+            else:
+                unread_by_sender[message.sender_id] += 1
+        for sender_id, count in unread_by_sender.items():
+            ChatRoomMember.objects.filter(room=self).exclude(user_id=sender_id).update(
+                unread_count=F("unread_count") + count
+            )
+        for sender_id, read_upto in read_upto_by_sender.items():
+            ChatRoomMember.objects.filter(room=self, last_read_message_id__lt=read_upto).exclude(
+                user_id=sender_id
+            ).update(last_read_message_id=read_upto)
+
+    def mark_read_by(self, user, upto_id=None):
+        """
+        user 의 읽음 위치(ChatRoomMember.last_read_message_id)를 옮기고 안 읽은 메시지 수 갱신 (한 행만 update)
+        upto_id 를 주면 그 id 까지만 읽음 처리 (조회 후 새로 들어온 메시지는 안 읽은 상태로 남김)
+        """
+        with transaction.atomic():
+            if upto_id is None:
+                upto_id = Message.objects.filter(room=self).order_by("-id").values_list("id", flat=True).first()
+                if upto_id is None:
+                    return 0
+                remaining = 0
+            else:
+                remaining = Message.objects.filter(room=self, id__gt=upto_id).exclude(sender=user).count()
+            return ChatRoomMember.objects.filter(room=self, user=user, last_read_message_id__lt=upto_id).update(
+                last_read_message_id=upto_id,
+                unread_count=remaining
+            )
+
+    def get_unread_count(self, user):
+        member = ChatRoomMember.objects.filter(room=self, user=user).only("unread_count").first()
+        return member.unread_count if member else 0
+
+    def get_read_watermarks(self):
+        """참여자별 읽음 위치 {user_id: last_read_message_id}"""
+        return dict(ChatRoomMember.objects.filter(room=self).values_list("user_id", "last_read_message_id"))
+
+
+def resolve_is_read(message, watermarks):
+    """
+    (이전 API 호환) 메시지의 is_read 값
+    보낸 사람을 제외한 참여자의 읽음 위치가 이 메시지 이상이면 읽은 것으로 본다.
+    watermarks: {user_id: last_read_message_id} (room 별)
+    """
+    read_upto = [read_id for user_id, read_id in watermarks.items() if user_id != message.sender_id]
+    if not read_upto:
+        return message.is_read
+    return message.id is not None and max(read_upto) >= message.id
+
+
+class ChatRoomMember(models.Model):
+    """채팅방 참여자별 상태 (participants 에 추가/삭제될 때 signals.py 에서 같이 생성/삭제)"""
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name="members")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="chat_memberships")
+    unread_count = models.PositiveIntegerField(default=0)
+    # 이 id 까지의 메시지는 읽음 (메시지가 보관(archive)되어도 유지되도록 FK 가 아닌 id 로 저장)
+    last_read_message_id = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["room", "user"], name="unique_chat_room_member")
+        ]
+
+    def __str__(self):
+        return f"ChatRoom {self.room_id} - {self.user_id} (안 읽음 {self.unread_count})"
     
 # ✅ Message 모델 (sender_email → sender를 User로 변경)
 class Message(models.Model):
@@ -58,8 +184,68 @@ class Message(models.Model):
     text = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
     promise = models.ForeignKey(Promise, on_delete=models.SET_NULL, null=True, blank=True)
+    # 채팅방 안에서의 메시지 번호 (ChatRoom.reserve_seqs)
+    seq = models.PositiveBigIntegerField(default=0)
+    # 저장 시점의 읽음 여부 (이후 읽음 처리는 ChatRoomMember.last_read_message_id 로, API 응답은 resolve_is_read 사용)
     is_read = models.BooleanField(default=False)
     image = models.ImageField(upload_to=image_upload_path, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # 채팅방 메시지 keyset 페이지네이션 (chat/pagination.py)
+            models.Index(fields=["room", "timestamp", "id"], name="chat_msg_room_ts_id_idx")
+        ]
+        constraints = [
+            # 재연결 시 seq 이후 메시지 조회 (chat/consumers.py resume)
+            models.UniqueConstraint(fields=["room", "seq"], name="unique_chat_message_room_seq")
+        ]
+
+    def save(self, *args, **kwargs):
+        """새 메시지면 채팅방 메시지 번호 발급과 요약 갱신, 검색 색인(chat/search.py)도 같은 트랜잭션에서"""
+        is_new = self._state.adding
+        with transaction.atomic():
+            if is_new and not self.seq:
+                self.seq = self.room.reserve_seqs(1)
+            super().save(*args, **kwargs)
+            if is_new:
+                self.room.apply_new_message(self)
+            index_messages([self])
+
+    def __str__(self):
+        return f"{self.sender.email}: {self.text[:30]}"
+
+class MessageArchiveSegment(models.Model):
+    """
+    오래된 메시지 보관 세그먼트 (chat/archive.py)
+    채팅방별로 (timestamp, id) 순서의 메시지 묶음을 압축해서 한 행에 저장하고, 한 번 만든 세그먼트는 수정하지 않는다.
+    """
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name="archive_segments")
+    start_at = models.DateTimeField()
+    start_message_id = models.BigIntegerField()
+    end_at = models.DateTimeField()
+    end_message_id = models.BigIntegerField()
+    message_count = models.PositiveIntegerField()
+    data = models.BinaryField()  # zlib 압축한 JSON 리스트
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["room", "end_at", "end_message_id"], name="chat_archive_room_end_idx")
+        ]
+
+    def __str__(self):
+        return f"ChatRoom {self.room_id} 보관 메시지 {self.message_count}개 ({self.start_at} ~ {self.end_at})"
+
+
+class OutboxEvent(models.Model):
+    """
+    REST 요청에서 나온 실시간 이벤트 (chat/outbox.py)
+    데이터 변경과 같은 트랜잭션에 저장하고, dispatch_outbox 명령이 커밋된 이벤트를 채널 레이어로 보낸 뒤 지운다.
+    """
+    group_name = models.CharField(max_length=100)
+    payload = models.JSONField()
+    attempts = models.PositiveSmallIntegerField(default=0)  # 전송 실패 횟수
+    created_at = models.DateTimeField(auto_now_add=True)
+
     def __str__(self):
-        return f"{self.sender.email}: {self.text[:30]}"
\ No newline at end of file
+        return f"{self.group_name}: {self.payload.get('type')}"
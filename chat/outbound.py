@@ -0,0 +1,187 @@
+"""
+웹소켓 연결별 송신 큐 (backpressure)
+
+채널 레이어 이벤트 핸들러가 send_json 을 바로 기다리면, 느린 클라이언트 하나 때문에 핸들러가 밀리고
+그 사이 이벤트가 channels_redis 에 쌓여서 만료되거나 그룹 전송이 막힌다.
+여기서는 연결마다 크기가 정해진 큐에 프레임을 넣고, 연결별 writer task 가 순서대로 보낸다.
+
+- key 가 있는 프레임(update_read_status, chatroom_update, chatrooms_list 처럼 마지막 상태만 의미 있는 프레임)은
+  아직 보내지 않은 같은 key 프레임을 지우고 맨 뒤에 새로 넣는다. (coalesce)
+- DeferredFrame 은 보낼 때 만든다. 같은 채팅방의 inbox_delta 가 여러 번 와도 DB 조회는 한 번만 한다.
+- 큐가 WEBSOCKET_OUTBOUND_QUEUE_SIZE 를 WEBSOCKET_OUTBOUND_OVERFLOW_GRACE 초 넘게 넘거나 두 배를 넘으면
+  resync_required 프레임을 보내고 연결을 끊는다. (클라이언트는 재연결 후 resume/resync)
+- 큐 길이와 coalesce/연결 종료 횟수는 워커(프로세스)별로 outbound_stats() 로 조회한다.
+
+daphne 에서는 send 가 프레임을 twisted 전송 버퍼에 넣고 바로 돌아오므로 느린 클라이언트 때문에 이 큐가 차지는 않는다.
+(큐가 차는 것은 DeferredFrame.render 의 DB 조회가 밀릴 때) 느린 클라이언트는 project/server.py 가 전송 버퍼 크기로 끊고
+그 횟수는 outbound_stats() 의 write_buffer_overflow_closed 로 같이 조회한다.
+"""
+import asyncio
+import itertools
+import time
+import weakref
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+
+OVERFLOW_CLOSE_CODE = 4409
+
+_queues = weakref.WeakSet()
+_totals = Counter()
+
+
+class DeferredFrame:
+    """보낼 때 build(**params) 로 만드는 프레임 (None 이면 보내지 않음)"""
+
+    def __init__(self, build, **params):
+        self.build = build
+        self.params = params
+
+    def merge(self, previous):
+        """아직 보내지 않은 같은 key 프레임을 대신할 때, None 인 값은 이전 값을 유지"""
+        for name, value in previous.params.items():
+            if self.params.get(name) is None:
+                self.params[name] = value
+
+    async def render(self):
+        return await self.build(**self.params)
+
+
+class OutboundQueue:
+    def __init__(self, send, on_overflow, limit, grace, label=None):
+        self.send = send
+        self.on_overflow = on_overflow
+        self.limit = limit
+        self.grace = grace
+        self.label = label or {}
+        self.entries = OrderedDict()
+        self.sequence = itertools.count()
+        self.ready = asyncio.Event()
+        self.over_limit_since = None
+        self.overflowed = False
+        self.peak_depth = 0
+        self.task = asyncio.create_task(self.run())
+        _queues.add(self)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def put(self, frame, key=None):
+        if self.overflowed:
+            return
+        if key is None:
+            key = next(self.sequence)
+        elif key in self.entries:
+            previous = self.entries.pop(key)
+            if isinstance(frame, DeferredFrame) and isinstance(previous, DeferredFrame):
+                frame.merge(previous)
+            _totals["coalesced"] += 1
+        self.entries[key] = frame
+        self.peak_depth = max(self.peak_depth, len(self.entries))
+
+        if len(self.entries) > self.limit:
+            now = time.monotonic()
+            if self.over_limit_since is None:
+                self.over_limit_since = now
+            if len(self.entries) > self.limit * 2 or now - self.over_limit_since > self.grace:
+                self.overflowed = True
+                self.entries.clear()
+                _totals["overflow_closed"] += 1
+        self.ready.set()
+
+    async def run(self):
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            while self.entries or self.overflowed:
+                if self.overflowed:
+                    _queues.discard(self)
+                    await self.on_overflow()
+                    return
+                _, frame = self.entries.popitem(last=False)
+                if len(self.entries) <= self.limit:
+                    self.over_limit_since = None
+                try:
+                    if isinstance(frame, DeferredFrame):
+                        frame = await frame.render()
+                    if frame is not None:
+                        await self.send(frame)
+                        _totals["sent"] += 1
+                except Exception as e:
+                    print(f"Error in OutboundQueue.run: {e}")
+
+    def stop(self):
+        self.task.cancel()
+        self.entries.clear()
+        _queues.discard(self)
+
+
+def record_write_buffer_overflow():
+    """project/server.py 에서 전송 버퍼가 넘쳐 연결을 끊었을 때"""
+    _totals["write_buffer_overflow_closed"] += 1
+
+
+def outbound_stats(top=10):
+    """현재 워커의 송신 큐 상태"""
+    queues = list(_queues)
+    depths = [len(queue) for queue in queues]
+    deepest = sorted(queues, key=len, reverse=True)[:top]
+    return {
+        "connections": len(queues),
+        "queued_frames": sum(depths),
+        "max_depth": max(depths, default=0),
+        "peak_depth": max((queue.peak_depth for queue in queues), default=0),
+        "sent": _totals["sent"],
+        "coalesced": _totals["coalesced"],
+        "overflow_closed": _totals["overflow_closed"],
+        "write_buffer_overflow_closed": _totals["write_buffer_overflow_closed"],
+        "deepest": [{**queue.label, "depth": len(queue)} for queue in deepest if len(queue)],
+    }
+
+
+class OutboundQueueMixin:
+    """
+    AsyncJsonWebsocketConsumer 와 함께 사용 (NegotiatedCodecMixin 보다 앞에)
+    accept 이후의 send_json 은 모두 큐를 거치고, queue_frame(frame, key) 로 coalesce 할 프레임을 넣는다.
+    """
+    outbound = None
+
+    async def accept(self, subprotocol=None):
+        await super().accept(subprotocol=subprotocol)
+        user = self.scope.get("user")
+        self.outbound = OutboundQueue(
+            send=self.send_now,
+            on_overflow=self.close_overflowed,
+            limit=settings.WEBSOCKET_OUTBOUND_QUEUE_SIZE,
+            grace=settings.WEBSOCKET_OUTBOUND_OVERFLOW_GRACE,
+            label={"user_id": getattr(user, "id", None), "path": self.scope.get("path")}
+        )
+
+    async def queue_frame(self, frame, key=None):
+        if self.outbound is not None:
+            self.outbound.put(frame, key)
+            return
+        # accept 전에는 바로 전송
+        if isinstance(frame, DeferredFrame):
+            frame = await frame.render()
+        if frame is not None:
+            await self.send_now(frame)
+
+    async def send_json(self, content, close=False):
+        if self.outbound is None or close:
+            await self.send_now(content, close=close)
+        else:
+            await self.queue_frame(content)
+
+    async def send_now(self, content, close=False):
+        await super().send_json(content, close=close)
+
+    async def close_overflowed(self):
+        """너무 밀린 연결: 남은 프레임은 버리고 재연결 후 다시 받도록 알림"""
+        await self.send_now({"type": "resync_required", "reason": "slow_connection"})
+        await self.close(code=OVERFLOW_CLOSE_CODE)
+
+    async def websocket_disconnect(self, message):
+        if self.outbound is not None:
+            self.outbound.stop()
+        await super().websocket_disconnect(message)
@@ -0,0 +1,60 @@
+"""
+실시간 이벤트 transactional outbox
+
+REST view/serializer 에서 채널 레이어로 바로 group_send 하면 Redis 가 느릴 때 HTTP 응답도 같이 느려지고,
+트랜잭션이 롤백돼도 이벤트는 이미 나가버린다.
+여기서는 이벤트를 데이터 변경과 같은 트랜잭션에 OutboxEvent 로 저장만 하고,
+별도 프로세스(python manage.py dispatch_outbox)가 커밋된 이벤트를 모아서 그룹별로 한 번에 보낸다. (FanOut)
+
+- 전송은 at-least-once: 전송에 실패한 이벤트는 남겨두고 다음 주기에 다시 보낸다. (CHAT_OUTBOX_MAX_ATTEMPTS 번 실패하면 버림)
+- 같은 그룹의 이벤트 순서는 저장된 순서(id)대로 유지된다.
+- dispatch_outbox 는 하나만 실행한다.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .fanout import FanOut
+from .inbox import forget_inbox_snapshots
+from .models import OutboxEvent
+
+
+class Outbox(FanOut):
+    """FanOut 과 같은 방식으로 이벤트를 모으고, save() 로 현재 트랜잭션에 저장"""
+
+    def save(self):
+        rows = [
+            OutboxEvent(group_name=group_name, payload=event)
+            for group_name, events in self.events.items()
+            for event in events
+        ]
+        self.events.clear()
+        if self.inbox_emails:
+            # 이벤트가 전송되기 전에(커밋 직후) 채팅방 목록 snapshot 캐시 삭제
+            emails, self.inbox_emails = self.inbox_emails, set()
+            transaction.on_commit(lambda: forget_inbox_snapshots(emails))
+        return OutboxEvent.objects.bulk_create(rows)
+
+
+def dispatch_outbox(batch_size=None, channel_layer=None):
+    """커밋된 이벤트를 오래된 순으로 batch_size 개 보내고 보낸 이벤트 수 반환"""
+    batch_size = batch_size or settings.CHAT_OUTBOX_BATCH_SIZE
+    events = list(OutboxEvent.objects.order_by("id")[:batch_size])
+    if not events:
+        return 0
+
+    event_ids = [event.id for event in events]
+    fanout = FanOut(channel_layer)
+    for event in events:
+        fanout.add(event.group_name, event.payload)
+    try:
+        fanout.publish_sync()
+    except Exception as e:
+        print(f"outbox 이벤트 전송 실패: {e}")
+        failed = OutboxEvent.objects.filter(id__in=event_ids)
+        failed.filter(attempts__gte=settings.CHAT_OUTBOX_MAX_ATTEMPTS - 1).delete()
+        failed.update(attempts=F("attempts") + 1)
+        return 0
+
+    OutboxEvent.objects.filter(id__in=event_ids).delete()
+    return len(events)
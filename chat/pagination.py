@@ -0,0 +1,54 @@
+"""
+채팅 메시지 keyset 페이지네이션 ((timestamp, id) 기준)
+
+- 커서 없음: 최신 메시지 limit 개
+- before=<cursor>: 커서보다 이전 메시지 중 최신 limit 개
+- after=<cursor>: 커서보다 이후 메시지 중 오래된 순 limit 개
+반환하는 메시지는 항상 오래된 순. (room_id, timestamp, id) 인덱스로 범위 조회만 한다.
+"""
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+
+
+def encode_cursor(message):
+    return encode_cursor_key(message.timestamp, message.id)
+
+
+def encode_cursor_key(timestamp, message_id):
+    raw = f"{timestamp.isoformat()}|{message_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(value):
+    try:
+        raw = base64.urlsafe_b64decode(value.encode()).decode()
+        timestamp, message_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValidationError({'detail': '잘못된 cursor 입니다.'})
+
+
+def paginate_messages(queryset, before=None, after=None, limit=50):
+    """
+    (오래된 순 메시지 리스트, 이전 메시지 존재 여부, 이후 메시지 존재 여부) 반환
+    """
+    if before and after:
+        raise ValidationError({'detail': 'before 와 after 는 함께 사용할 수 없습니다.'})
+
+    if after:
+        timestamp, message_id = decode_cursor(after)
+        page = list(
+            queryset.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=message_id))
+            .order_by("timestamp", "id")[:limit + 1]
+        )
+        return page[:limit], True, len(page) > limit
+
+    if before:
+        timestamp, message_id = decode_cursor(before)
+        queryset = queryset.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=message_id))
+
+    page = list(queryset.order_by("-timestamp", "-id")[:limit + 1])
+    return page[:limit][::-1], len(page) > limit, bool(before)
@@ -0,0 +1,150 @@
+"""
+채팅 메시지 write-behind 저장
+
+ChatConsumer.receive_json 은 메시지를 바로 방에 브로드캐스트(임시 id 포함)하고 MessageWriter 큐에 넣기만 한다.
+MessageWriter 는 CHAT_MESSAGE_FLUSH_INTERVAL 동안 모인 메시지를 bulk_create 로 한 번에 저장하고
+채팅방 요약(ChatRoom.apply_new_messages)도 같은 트랜잭션에서 갱신하고 커밋 후 최근 메시지 캐시(chat/recent.py)에 붙인 뒤,
+보낸 연결에 message_persisted (임시 id -> 실제 id) 를, 채팅방에 없던 상대방에게만 채팅방 목록 변경분(inbox_delta)을 보낸다.
+- message_persisted 는 채널 레이어를 거치지 않고 보낸 consumer 에 직접 전달한다. (writer 는 이벤트 루프마다 하나라서 보낸 consumer 와 같은 루프에 있음)
+  그래서 메시지 하나의 채널 레이어 전송은 chat_message 한 번 + (상대방이 채팅방에 없을 때) inbox_delta 한 번
+
+- 큐는 이벤트 루프(프로세스)마다 하나이고 flush 는 lock 으로 직렬화되므로 같은 연결에서 보낸 메시지 순서가 유지된다.
+- 연결이 끊길 때 consumer 가 flush() 를 호출해서 남은 메시지를 저장한다.
+"""
+import asyncio
+import uuid
+import weakref
+from collections import defaultdict
+from dataclasses import dataclass
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+from .fanout import FanOut
+from .models import Message
+from .recent import remember_messages
+from .search import index_messages
+
+
+@dataclass
+class PendingMessage:
+    message: Message
+    provisional_id: str
+    group_name: str
+    sender: weakref.ref  # 보낸 연결의 consumer
+    inbox_email: str = None  # 채팅방 목록 변경분을 보낼 상대방 (채팅방에 있어서 바로 읽었으면 None)
+
+
+class MessageWriter:
+    def __init__(self, flush_interval=None, batch_size=None):
+        self.flush_interval = settings.CHAT_MESSAGE_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.batch_size = settings.CHAT_MESSAGE_BATCH_SIZE if batch_size is None else batch_size
+        self.pending = []
+        self.flush_lock = asyncio.Lock()
+        self.flush_task = None
+
+    @staticmethod
+    def make_provisional_id():
+        return f"tmp-{uuid.uuid4().hex}"
+
+    def enqueue(self, pending):
+        """저장 대기열에 추가 (flush 는 백그라운드에서 실행)"""
+        self.pending.append(pending)
+        if len(self.pending) >= self.batch_size:
+            asyncio.ensure_future(self.flush())
+        elif self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.ensure_future(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        """대기 중인 메시지를 모두 저장하고 알림 전송"""
+        async with self.flush_lock:
+            batch, self.pending = self.pending, []
+            if not batch:
+                return
+            try:
+                # 쓰기는 consumer 조회용 스레드 풀(chat/db.py)이 아닌 한 스레드에서 (SQLite 쓰기 잠금 경합 방지)
+                await database_sync_to_async(self.persist)(batch)
+            except Exception as e:
+                print(f"Error in MessageWriter.flush: {e}")
+                await self.notify_failed(batch)
+                return
+            await self.notify_persisted(batch)
+
+    @staticmethod
+    def persist(batch):
+        with transaction.atomic():
+            # 채팅방별로 메시지 번호를 한 번에 예약해서 큐에 들어온 순서대로 부여
+            by_room = defaultdict(list)
+            for pending in batch:
+                by_room[pending.message.room_id].append(pending.message)
+            for room_messages in by_room.values():
+                first_seq = room_messages[0].room.reserve_seqs(len(room_messages))
+                for offset, message in enumerate(room_messages):
+                    message.seq = first_seq + offset
+
+            messages = Message.objects.bulk_create([pending.message for pending in batch])
+            for room_messages in by_room.values():
+                room_messages[0].room.apply_new_messages(room_messages)
+            # 검색 색인은 같은 트랜잭션에서 추가 (bulk_create 는 Message.save 를 거치지 않음, chat/search.py)
+            index_messages(messages)
+            # 커밋 후 채팅방 최근 메시지 캐시에 추가
+            remember_messages(messages)
+
+    async def notify_persisted(self, batch):
+        # 임시 id -> 실제 id 는 보낸 연결에만 채팅방별로 묶어서 직접 전달
+        by_sender = defaultdict(list)
+        for pending in batch:
+            consumer = pending.sender()
+            if consumer is not None:
+                by_sender[(consumer, pending.message.room_id)].append(pending)
+        for (consumer, room_id), items in by_sender.items():
+            try:
+                await consumer.message_persisted({
+                    'type': 'message_persisted',
+                    'room_id': room_id,
+                    'messages': [
+                        {'provisional_id': pending.provisional_id, 'id': pending.message.id, 'seq': pending.message.seq}
+                        for pending in items
+                    ]
+                })
+            except Exception as e:
+                print(f"Error in MessageWriter.notify_persisted: {e}")
+
+        # 채팅방 목록은 저장이 끝난 뒤에 갱신해야 최신 메시지가 반영됨 (보낸 사람, 채팅방에 있던 상대방은 제외)
+        fanout = FanOut()
+        for email, room_id in {(pending.inbox_email, pending.message.room_id) for pending in batch if pending.inbox_email}:
+            fanout.add_inbox_delta([email], room_id, position=0)
+        await fanout.publish()
+
+    async def notify_failed(self, batch):
+        fanout = FanOut()
+        by_group = defaultdict(list)
+        room_ids = {}
+        for pending in batch:
+            by_group[pending.group_name].append(pending.provisional_id)
+            room_ids[pending.group_name] = pending.message.room_id
+        for group_name, provisional_ids in by_group.items():
+            fanout.add(group_name, {
+                'type': 'message_failed',
+                'room_id': room_ids[group_name],
+                'provisional_ids': provisional_ids
+            })
+        await fanout.publish()
+
+
+_writers = weakref.WeakKeyDictionary()
+
+
+def get_message_writer():
+    """현재 이벤트 루프의 MessageWriter"""
+    loop = asyncio.get_running_loop()
+    writer = _writers.get(loop)
+    if writer is None:
+        writer = MessageWriter()
+        _writers[loop] = writer
+    return writer
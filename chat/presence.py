@@ -0,0 +1,226 @@
+"""
+채팅방 접속 상태(presence) 레지스트리
+
+예전에는 ChatConsumer.connected_users (프로세스 로컬 defaultdict) 에 이메일을 넣고 뺐는데,
+daphne 워커가 여러 개가 되면 워커마다 다른 값을 보게 되고 탭 하나만 닫아도 접속이 끊긴 것으로 처리됐다.
+
+여기서는 연결 하나를 (그룹, 유저 id, 디바이스, 채널) 단위로 기록하고 TTL 로 만료시킨다.
+- RedisPresenceBackend: 모든 워커/노드가 공유하는 기본 백엔드
+- LocalPresenceBackend: 테스트/개발용 메모리 백엔드
+"""
+import asyncio
+import threading
+import time
+import weakref
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+DEFAULT_DEVICE = "default"
+
+
+class BasePresenceBackend:
+    """
+    연결은 "디바이스|채널이름" 멤버로 저장되고, 만료 시각이 지나면 자동으로 없는 것으로 취급한다.
+    연결이 살아있는 동안에는 consumer 가 touch() 로 만료 시각을 계속 연장해야 한다.
+    """
+
+    def __init__(self, ttl=60, **options):
+        self.ttl = ttl
+
+    @staticmethod
+    def make_member(channel_name, device_id=None):
+        return f"{device_id or DEFAULT_DEVICE}|{channel_name}"
+
+    @staticmethod
+    def split_member(member):
+        device_id, _, channel_name = member.partition("|")
+        return device_id, channel_name
+
+    def add(self, group, user_id, channel_name, device_id=None):
+        raise NotImplementedError
+
+    def remove(self, group, user_id, channel_name, device_id=None):
+        raise NotImplementedError
+
+    def members(self, group, user_id):
+        """만료되지 않은 연결 멤버 목록"""
+        raise NotImplementedError
+
+    def touch(self, group, user_id, channel_name, device_id=None):
+        """하트비트: 연결의 만료 시각을 연장"""
+        self.add(group, user_id, channel_name, device_id)
+
+    def connection_count(self, group, user_id):
+        return len(self.members(group, user_id))
+
+    def device_count(self, group, user_id):
+        return len({self.split_member(member)[0] for member in self.members(group, user_id)})
+
+    def is_present(self, group, user_id):
+        return self.connection_count(group, user_id) > 0
+
+    # async 버전 (consumer 에서 사용)
+    async def aadd(self, group, user_id, channel_name, device_id=None):
+        return self.add(group, user_id, channel_name, device_id)
+
+    async def aremove(self, group, user_id, channel_name, device_id=None):
+        return self.remove(group, user_id, channel_name, device_id)
+
+    async def amembers(self, group, user_id):
+        return self.members(group, user_id)
+
+    async def atouch(self, group, user_id, channel_name, device_id=None):
+        return await self.aadd(group, user_id, channel_name, device_id)
+
+    async def aconnection_count(self, group, user_id):
+        return len(await self.amembers(group, user_id))
+
+    async def ais_present(self, group, user_id):
+        return await self.aconnection_count(group, user_id) > 0
+
+
+class LocalPresenceBackend(BasePresenceBackend):
+    """프로세스 메모리에만 저장하는 백엔드 (테스트용)"""
+
+    def __init__(self, ttl=60, **options):
+        super().__init__(ttl=ttl, **options)
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _purge(self, key, now):
+        entries = self._entries.get(key)
+        if entries is None:
+            return {}
+        for member, expires_at in list(entries.items()):
+            if expires_at <= now:
+                del entries[member]
+        if not entries:
+            # 빈 set 이 계속 쌓이지 않도록 바로 정리
+            del self._entries[key]
+            return {}
+        return entries
+
+    def add(self, group, user_id, channel_name, device_id=None):
+        now = time.monotonic()
+        with self._lock:
+            self._purge((group, user_id), now)
+            entries = self._entries.setdefault((group, user_id), {})
+            entries[self.make_member(channel_name, device_id)] = now + self.ttl
+
+    def remove(self, group, user_id, channel_name, device_id=None):
+        with self._lock:
+            entries = self._entries.get((group, user_id))
+            if entries is not None:
+                entries.pop(self.make_member(channel_name, device_id), None)
+            self._purge((group, user_id), time.monotonic())
+
+    def members(self, group, user_id):
+        with self._lock:
+            return list(self._purge((group, user_id), time.monotonic()))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisPresenceBackend(BasePresenceBackend):
+    """
+    유저별 sorted set 에 연결을 저장한다. (score = 만료 시각)
+    key: <prefix>:<group>:<user_id>
+    """
+
+    def __init__(self, location="redis://localhost:6379/0", ttl=60, key_prefix="presence",
+                 socket_timeout=0.5, socket_connect_timeout=0.5, **options):
+        super().__init__(ttl=ttl, **options)
+        import redis
+
+        self.location = location
+        self.key_prefix = key_prefix
+        # REST 요청(약속 생성)에서도 조회하므로 Redis 가 느리면 기다리지 않고 실패 (호출하는 쪽에서 접속 안 함으로 처리)
+        self.client_options = {"socket_timeout": socket_timeout, "socket_connect_timeout": socket_connect_timeout}
+        self._client = redis.Redis.from_url(location, **self.client_options)
+        # redis.asyncio 커넥션은 이벤트 루프에 묶여 있으므로 루프마다 따로 만든다
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def make_key(self, group, user_id):
+        return f"{self.key_prefix}:{group}:{user_id}"
+
+    def _async_client(self):
+        import redis.asyncio
+
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = redis.asyncio.Redis.from_url(self.location, **self.client_options)
+            self._async_clients[loop] = client
+        return client
+
+    def _add_pipeline(self, pipe, key, member, now):
+        pipe.zremrangebyscore(key, "-inf", now)
+        pipe.zadd(key, {member: now + self.ttl})
+        pipe.expire(key, int(self.ttl) + 1)
+
+    def add(self, group, user_id, channel_name, device_id=None):
+        now = time.time()
+        with self._client.pipeline() as pipe:
+            self._add_pipeline(pipe, self.make_key(group, user_id), self.make_member(channel_name, device_id), now)
+            pipe.execute()
+
+    def remove(self, group, user_id, channel_name, device_id=None):
+        key = self.make_key(group, user_id)
+        with self._client.pipeline() as pipe:
+            pipe.zrem(key, self.make_member(channel_name, device_id))
+            pipe.zremrangebyscore(key, "-inf", time.time())
+            pipe.execute()
+
+    def members(self, group, user_id):
+        members = self._client.zrangebyscore(self.make_key(group, user_id), f"({time.time()}", "+inf")
+        return [member.decode() for member in members]
+
+    def connection_count(self, group, user_id):
+        return self._client.zcount(self.make_key(group, user_id), f"({time.time()}", "+inf")
+
+    async def aadd(self, group, user_id, channel_name, device_id=None):
+        now = time.time()
+        async with self._async_client().pipeline() as pipe:
+            self._add_pipeline(pipe, self.make_key(group, user_id), self.make_member(channel_name, device_id), now)
+            await pipe.execute()
+
+    async def aremove(self, group, user_id, channel_name, device_id=None):
+        key = self.make_key(group, user_id)
+        async with self._async_client().pipeline() as pipe:
+            pipe.zrem(key, self.make_member(channel_name, device_id))
+            pipe.zremrangebyscore(key, "-inf", time.time())
+            await pipe.execute()
+
+    async def amembers(self, group, user_id):
+        members = await self._async_client().zrangebyscore(self.make_key(group, user_id), f"({time.time()}", "+inf")
+        return [member.decode() for member in members]
+
+    async def aconnection_count(self, group, user_id):
+        return await self._async_client().zcount(self.make_key(group, user_id), f"({time.time()}", "+inf")
+
+
+_presence = None
+_presence_lock = threading.Lock()
+
+
+def get_presence():
+    """settings.CHAT_PRESENCE 로 설정된 레지스트리를 반환 (프로세스당 하나)"""
+    global _presence
+    if _presence is None:
+        with _presence_lock:
+            if _presence is None:
+                config = dict(getattr(settings, "CHAT_PRESENCE", {}))
+                backend_class = import_string(config.pop("BACKEND", "chat.presence.LocalPresenceBackend"))
+                options = {key.lower(): value for key, value in config.items()}
+                _presence = backend_class(**options)
+    return _presence
+
+
+def reset_presence():
+    """설정을 바꾼 뒤 레지스트리를 다시 만들 때 사용"""
+    global _presence
+    with _presence_lock:
+        _presence = None
@@ -0,0 +1,157 @@
+"""
+채팅방별 최근 메시지 캐시 (ring buffer)
+
+채팅방을 열 때 필요한 건 대부분 최근 메시지 한 페이지뿐이므로,
+채팅방마다 최근 CHAT_RECENT_MESSAGES_SIZE 개 메시지의 직렬화 결과(RecentMessageSerializer)를 캐시(Redis 리스트)에 유지하고
+MessageListView 의 첫 페이지는 여기서 바로 꺼내서 보낸다.
+
+- 메시지를 저장할 때(MessageWriter.persist, PromiseSerializer.create) 커밋 후 뒤에 붙이고 오래된 것은 잘라낸다.
+  캐시가 없는 채팅방에는 붙이지 않는다. (최근 메시지 일부만 있는 캐시가 생기지 않도록)
+- 캐시가 없거나 마지막 메시지가 ChatRoom.last_message 와 다르면 DB 에서 다시 만든다. (rebuild-on-miss)
+- 읽음 여부, is_sender, 상대방 프로필은 요청한 유저마다 다르므로 캐시하지 않고 조회할 때 채운다. (render_recent_messages)
+- 캐시 오류는 메시지 저장/조회를 막지 않는다. (DB 로 조회)
+"""
+import json
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from django.db import transaction
+
+from .models import ChatRoom, Message
+
+
+class RecentMessageBuffer:
+    def __init__(self, cache, size, ttl):
+        self.cache = cache
+        self.size = size
+        self.ttl = ttl
+
+    @staticmethod
+    def make_key(room_id):
+        return f"chat:recent:{room_id}"
+
+    def _redis(self, room_id):
+        """Redis 캐시면 (클라이언트, 실제 키), 아니면 None (테스트용 locmem 등은 get/set 으로 처리)"""
+        if not isinstance(self.cache, RedisCache):
+            return None
+        key = self.cache.make_and_validate_key(self.make_key(room_id))
+        return self.cache._cache.get_client(key, write=True), key
+
+    def get(self, room_id):
+        """오래된 순 메시지 리스트, 캐시가 없으면 None"""
+        redis = self._redis(room_id)
+        if redis is None:
+            return self.cache.get(self.make_key(room_id))
+        client, key = redis
+        entries = client.lrange(key, 0, -1)
+        return [json.loads(entry) for entry in entries] if entries else None
+
+    def append(self, room_id, entries):
+        """캐시가 있을 때만 뒤에 붙이고 size 개로 자름"""
+        redis = self._redis(room_id)
+        if redis is None:
+            cached = self.cache.get(self.make_key(room_id))
+            if cached is not None:
+                self.cache.set(self.make_key(room_id), (cached + entries)[-self.size:], self.ttl)
+            return
+        client, key = redis
+        with client.pipeline() as pipe:
+            pipe.rpushx(key, *[json.dumps(entry, ensure_ascii=False) for entry in entries])
+            pipe.ltrim(key, -self.size, -1)
+            pipe.expire(key, self.ttl)
+            pipe.execute()
+
+    def replace(self, room_id, entries):
+        redis = self._redis(room_id)
+        if redis is None:
+            self.cache.set(self.make_key(room_id), entries[-self.size:], self.ttl)
+            return
+        client, key = redis
+        with client.pipeline() as pipe:
+            pipe.delete(key)
+            if entries:
+                pipe.rpush(key, *[json.dumps(entry, ensure_ascii=False) for entry in entries[-self.size:]])
+                pipe.expire(key, self.ttl)
+            pipe.execute()
+
+    def delete(self, room_id):
+        self.cache.delete(self.make_key(room_id))
+
+
+_buffer = None
+
+
+def get_recent_buffer():
+    global _buffer
+    if _buffer is None:
+        _buffer = RecentMessageBuffer(
+            caches["default"], settings.CHAT_RECENT_MESSAGES_SIZE, settings.CHAT_RECENT_MESSAGES_TTL
+        )
+    return _buffer
+
+
+def serialize_entries(messages):
+    """메시지 -> 캐시 항목 (sender, promise 는 미리 채워져 있어야 추가 쿼리가 없음)"""
+    from .serializers import RecentMessageSerializer
+
+    return RecentMessageSerializer(messages, many=True).data
+
+
+def remember_messages(messages):
+    """저장된 메시지를 채팅방 캐시에 추가 (트랜잭션 안이면 커밋 후)"""
+    def append():
+        by_room = defaultdict(list)
+        for message in messages:
+            by_room[message.room_id].append(message)
+        try:
+            buffer = get_recent_buffer()
+            for room_id, room_messages in by_room.items():
+                buffer.append(room_id, serialize_entries(room_messages))
+        except Exception as e:
+            print(f"최근 메시지 캐시 추가 실패: {e}")
+
+    transaction.on_commit(append)
+
+
+def forget_rooms(room_ids):
+    """채팅방 캐시 삭제 (다음 조회 때 DB 에서 다시 만듦)"""
+    try:
+        buffer = get_recent_buffer()
+        for room_id in room_ids:
+            buffer.delete(room_id)
+    except Exception as e:
+        print(f"최근 메시지 캐시 삭제 실패: {e}")
+
+
+def rebuild(room):
+    buffer = get_recent_buffer()
+    messages = list(
+        Message.objects.filter(room=room).select_related("sender", "promise").order_by("-timestamp", "-id")[:buffer.size]
+    )
+    entries = serialize_entries(messages[::-1])
+    buffer.replace(room.id, entries)
+    # 다시 만드는 동안 저장된 메시지는 append 가 무시됐을 수 있으므로 확인 후 다음 조회 때 다시 만들게 함
+    last_message_id = ChatRoom.objects.filter(id=room.id).values_list("last_message_id", flat=True).first()
+    if entries and entries[-1]["id"] != last_message_id:
+        buffer.delete(room.id)
+    return entries
+
+
+def load_recent_messages(room, limit):
+    """
+    채팅방 최근 메시지 limit + 1 개(이전 메시지 존재 여부 확인용)를 오래된 순으로 반환
+    캐시 크기보다 큰 페이지를 요청하거나 캐시를 쓸 수 없으면 None (DB 로 조회)
+    """
+    buffer = get_recent_buffer()
+    if limit + 1 > buffer.size:
+        return None
+    try:
+        entries = buffer.get(room.id)
+        if entries is None or entries[-1]["id"] != room.last_message_id:
+            entries = rebuild(room)
+    except Exception as e:
+        print(f"최근 메시지 캐시 조회 실패: {e}")
+        return None
+    return entries[-(limit + 1):]
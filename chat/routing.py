@@ -5,4 +5,6 @@ from chat import consumers
 websocket_urlpatterns = [
     path("ws/room/<int:room_id>/messages", consumers.ChatConsumer.as_asgi()),
     path("ws/user/chatrooms", consumers.UserChatConsumer.as_asgi()),
+    # 채팅방 목록 + 채팅방 여러 개를 연결 하나로 (join/leave)
+    path("ws/user/stream", consumers.MultiplexConsumer.as_asgi()),
 ]
\ No newline at end of file
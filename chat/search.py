@@ -0,0 +1,181 @@
+"""
+채팅 메시지 검색 (역색인)
+
+메시지 조회 API 로 전부 받아서 클라이언트에서 찾던 것을 서버 검색으로 바꾼다.
+- 한국어는 띄어쓰기 단위 단어로는 검색이 안 되므로(조사) 단어를 2글자씩 겹쳐 자른 n-gram(bigram) 으로 색인한다.
+  "헌혈약속" -> "헌혈 혈약 약속 속", 검색어도 같은 방식으로 잘라서 연속된 bigram(phrase)으로 찾는다. (한 글자는 prefix 검색)
+- 메시지를 저장할 때 같은 트랜잭션에서 바로 색인한다. (Message.save, bulk_create 로 저장하는 MessageWriter.persist)
+- 색인에 본문/보낸 사람/시간도 같이 저장하므로 보관(archive)된 메시지도 그대로 검색된다.
+- 결과는 최신 메시지부터, 메시지 id cursor(before) 로 페이지를 나눈다.
+- 백엔드는 settings.CHAT_SEARCH 로 바꿀 수 있다. (기본: SQLite FTS5, 테이블은 0018 migration 에서 생성)
+"""
+import re
+import threading
+from datetime import datetime
+
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+
+WORD_RE = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """본문 -> 색인용 bigram 토큰 문자열"""
+    tokens = []
+    for word in WORD_RE.findall((text or "").lower()):
+        if len(word) > 1:
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        tokens.append(word[-1])
+    return " ".join(tokens)
+
+
+def query_words(query):
+    return WORD_RE.findall((query or "").lower())
+
+
+def find_highlights(text, words):
+    """text 안에서 검색어가 나오는 [시작, 끝) 위치 목록"""
+    lowered = text.lower()
+    spans = []
+    for word in words:
+        start = lowered.find(word)
+        while start != -1:
+            spans.append([start, start + len(word)])
+            start = lowered.find(word, start + 1)
+    return sorted(spans)
+
+
+def make_snippet(text, words, size):
+    """첫 번째 검색어 주변 size 글자 정도만 잘라서 (snippet, snippet 안에서의 highlights) 반환"""
+    spans = find_highlights(text, words)
+    if len(text) <= size:
+        return text, spans
+    center = spans[0][0] if spans else 0
+    start = max(0, min(center - size // 3, len(text) - size))
+    end = start + size
+    snippet = text[start:end]
+    highlights = [[max(s, start) - start, min(e, end) - start] for s, e in spans if s < end and e > start]
+    if start > 0:
+        snippet = "…" + snippet
+        highlights = [[s + 1, e + 1] for s, e in highlights]
+    if end < len(text):
+        snippet += "…"
+    return snippet, highlights
+
+
+class BaseSearchBackend:
+    """
+    index(): 메시지 색인 (저장과 같은 트랜잭션에서 호출), search(): room_ids 안에서 검색
+    search 결과 행: {"message_id", "room_id", "sender_id", "text", "timestamp"} 최신순
+    """
+
+    def __init__(self, **options):
+        pass
+
+    def index(self, messages):
+        raise NotImplementedError
+
+    def clear(self, room_ids=None):
+        raise NotImplementedError
+
+    def search(self, room_ids, query, before=None, limit=20):
+        """(행 목록, 다음 페이지 존재 여부)"""
+        raise NotImplementedError
+
+
+class SQLiteFTSSearchBackend(BaseSearchBackend):
+    """
+    FTS5 가상 테이블 하나 (rowid = 메시지 id)
+    tokens 만 색인하고 나머지 컬럼은 UNINDEXED 로 결과에 바로 사용
+    """
+    table = "chat_message_search"
+
+    @staticmethod
+    def make_match_query(query):
+        clauses = []
+        for word in query_words(query):
+            if len(word) == 1:
+                clauses.append(f'"{word}"*')
+            else:
+                clauses.append('"' + " ".join(word[i:i + 2] for i in range(len(word) - 1)) + '"')
+        return " AND ".join(clauses)
+
+    def index(self, messages):
+        rows = [
+            (message.id, tokenize(message.text), message.room_id, message.sender_id, message.text,
+             message.timestamp.isoformat())
+            for message in messages
+            if message.text
+        ]
+        # 본문을 지운 메시지는 색인에서도 제거
+        emptied = [(message.id,) for message in messages if not message.text]
+        with connection.cursor() as cursor:
+            if rows:
+                cursor.executemany(
+                    f"INSERT OR REPLACE INTO {self.table} (rowid, tokens, room_id, sender_id, text, timestamp) "
+                    f"VALUES (%s, %s, %s, %s, %s, %s)",
+                    rows
+                )
+            if emptied:
+                cursor.executemany(f"DELETE FROM {self.table} WHERE rowid = %s", emptied)
+
+    def clear(self, room_ids=None):
+        with connection.cursor() as cursor:
+            if room_ids is None:
+                cursor.execute(f"DELETE FROM {self.table}")
+            else:
+                placeholders = ", ".join(["%s"] * len(room_ids))
+                cursor.execute(f"DELETE FROM {self.table} WHERE room_id IN ({placeholders})", list(room_ids))
+
+    def search(self, room_ids, query, before=None, limit=20):
+        match = self.make_match_query(query)
+        if not match or not room_ids:
+            return [], False
+        placeholders = ", ".join(["%s"] * len(room_ids))
+        params = [match, *room_ids]
+        sql = (
+            f"SELECT rowid, room_id, sender_id, text, timestamp FROM {self.table} "
+            f"WHERE {self.table} MATCH %s AND room_id IN ({placeholders})"
+        )
+        if before:
+            sql += " AND rowid < %s"
+            params.append(before)
+        sql += " ORDER BY rowid DESC LIMIT %s"
+        params.append(limit + 1)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        hits = [
+            {
+                "message_id": message_id,
+                "room_id": int(room_id),
+                "sender_id": int(sender_id),
+                "text": text,
+                "timestamp": datetime.fromisoformat(timestamp),
+            }
+            for message_id, room_id, sender_id, text, timestamp in rows[:limit]
+        ]
+        return hits, len(rows) > limit
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_search_backend():
+    """settings.CHAT_SEARCH 로 설정된 검색 백엔드 (프로세스당 하나)"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                config = dict(getattr(settings, "CHAT_SEARCH", {}))
+                backend_class = import_string(config.pop("BACKEND", "chat.search.SQLiteFTSSearchBackend"))
+                options = {key.lower(): value for key, value in config.items()}
+                _backend = backend_class(**options)
+    return _backend
+
+
+def index_messages(messages):
+    """저장된 메시지 색인 (저장과 같은 트랜잭션 안에서 호출, 실패하면 저장도 롤백)"""
+    get_search_backend().index(messages)
@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from .models import ChatRoom, Message, User, Promise
+from django.db import transaction
+from .models import ChatRoom, ChatRoomMember, Message, User, Promise, resolve_is_read
 from accounts.models import User, Dog
 from accounts.serializers import DogSerializer
 from datetime import datetime, timedelta
@@ -8,6 +9,9 @@ from django.utils.timezone import get_current_timezone
 from collections import defaultdict
 import locale
 
+from .utils import format_latest_message_time
+from .inbox import dog_image_url
+
 class PromiseSerializer(serializers.ModelSerializer):
     day = serializers.DateField(format="%Y-%m-%d")  # 날짜 포맷 지정
     time = serializers.TimeField(format="%H:%M")  # 시간 포맷 지정
@@ -52,46 +56,90 @@ class PromiseSerializer(serializers.ModelSerializer):
         validated_data['user1'] = request_user  # 예약 요청자
         validated_data['user2'] = user2  # 상대방
 
-        promise = super().create(validated_data)
-
         # 상대방이 웹소켓에 연결되어 있는지 확인
-        from channels.layers import get_channel_layer
-        from asgiref.sync import async_to_sync
-        from .consumers import ChatConsumer
-        channel_layer = get_channel_layer()
+        from .outbox import Outbox
+        from .presence import get_presence
+        from .recent import remember_messages
 
         group_name = f"chat_room_{room_id}"
-        is_read = False
-        if group_name in ChatConsumer.connected_users:
-            if user2.email in ChatConsumer.connected_users[group_name]:
-                is_read = True
-
-        # 채팅방에 자동 메시지 추가
-        message_text = "헌혈 약속을 만들었어요"
-        message = Message.objects.create(
-            room=chat_room,
-            sender=request_user,  # 예약을 요청한 사람이 sender
-            text=message_text,
-            promise=promise,
-            is_read=is_read  # 읽음 여부 설정
-        )
+        try:
+            is_read = get_presence().is_present(group_name, user2.id)
+        except Exception as e:
+            print(f"접속 상태 조회 실패: {e}")
+            is_read = False
 
-        # 웹소켓 메시지 전송
-        async_to_sync(channel_layer.group_send)(
-            group_name,
-            {
-                "type": "chat_message",
-                "message": message.text,
-                "sender_email": request_user.email,
-                "is_read": is_read,  # is_read 추가
-                "promise_id": promise.id,
-                "promise_day": promise.day.strftime("%Y-%m-%d"),
-                "promise_time": promise.time.strftime("%H:%M")
-            }
-        )
+        # 예약, 자동 메시지, 웹소켓 이벤트(outbox)를 한 트랜잭션으로 저장 (이벤트는 커밋된 뒤 dispatch_outbox 가 전송)
+        with transaction.atomic():
+            promise = super().create(validated_data)
+
+            # 채팅방에 자동 메시지 추가
+            message_text = "헌혈 약속을 만들었어요"
+            message = Message.objects.create(
+                room=chat_room,
+                sender=request_user,  # 예약을 요청한 사람이 sender
+                text=message_text,
+                promise=promise,
+                is_read=is_read  # 읽음 여부 설정
+            )
+            remember_messages([message])  # 커밋 후 채팅방 최근 메시지 캐시에 추가
+
+            # 채팅방 + 두 사람의 채팅방 목록 변경분
+            outbox = Outbox().add(
+                group_name,
+                {
+                    "type": "chat_message",
+                    "room_id": chat_room.id,
+                    "message": message.text,
+                    "sender_email": request_user.email,
+                    "is_read": is_read,  # is_read 추가
+                    "promise_id": promise.id,
+                    "promise_day": promise.day.strftime("%Y-%m-%d"),
+                    "promise_time": promise.time.strftime("%H:%M")
+                }
+            )
+            outbox.add_inbox_delta([request_user.email, user2.email], chat_room.id, position=0)
+            outbox.save()
 
         return promise
     
+def get_dog_images(user_ids, context):
+    """작성자 id -> 대표 강아지 이미지 (한 번에 조회)"""
+    images = {}
+    dogs = Dog.objects.filter(user_id__in=user_ids, represent=True).order_by('user_id', 'id')
+    for dog in dogs:
+        if dog.user_id not in images:
+            images[dog.user_id] = DogSerializer(dog, context=context).data.get('dog_image', None)
+    return images
+
+
+def get_read_watermarks(room_ids):
+    """채팅방 id -> {user_id: 읽음 위치} (한 번에 조회)"""
+    watermarks = defaultdict(dict)
+    members = ChatRoomMember.objects.filter(room_id__in=room_ids)
+    for room_id, user_id, read_id in members.values_list('room_id', 'user_id', 'last_read_message_id'):
+        watermarks[room_id][user_id] = read_id
+    return watermarks
+
+
+class MessageListSerializer(serializers.ListSerializer):
+    """
+    메시지 목록 직렬화 시 작성자별 대표 강아지 이미지와 채팅방별 읽음 위치를 한 번에 조회해서 child 에 넘겨줌
+    (queryset 은 select_related('sender', 'promise') 로 가져와야 메시지별 추가 쿼리가 없음)
+    """
+    def to_representation(self, data):
+        messages = list(data.all() if hasattr(data, 'all') else data)
+        request_user = self.context["request"].user
+        sender_ids = {msg.sender_id for msg in messages if msg.sender_id != request_user.id}
+
+        self.child.opponent_profiles = get_dog_images(sender_ids, self.context)
+        self.child.read_watermarks = get_read_watermarks({msg.room_id for msg in messages})
+        try:
+            return super().to_representation(messages)
+        finally:
+            self.child.opponent_profiles = None
+            self.child.read_watermarks = None
+
+
 class MessageSerializer(serializers.ModelSerializer):
     formatted_time = serializers.SerializerMethodField()
     opponent_profile = serializers.SerializerMethodField()
@@ -99,6 +147,7 @@ class MessageSerializer(serializers.ModelSerializer):
     is_sender = serializers.SerializerMethodField()
     promise_info = serializers.SerializerMethodField()
     image_url = serializers.SerializerMethodField()
+    is_read = serializers.SerializerMethodField()
 
     class Meta:
         model = Message
@@ -113,8 +162,15 @@ class MessageSerializer(serializers.ModelSerializer):
                 "promise_info",
                 "promise",
                 "is_read",
-                "image_url"
+                "image_url",
+                "seq"
                 ]
+        list_serializer_class = MessageListSerializer
+
+    # MessageListSerializer 가 채워주는 작성자 id -> 대표 강아지 이미지
+    opponent_profiles = None
+    # MessageListSerializer 가 채워주는 채팅방 id -> {user_id: 읽음 위치}
+    read_watermarks = None
 
     def get_formatted_time(self, obj):
         """오전/오후 HH:MM 형식으로 변환"""
@@ -127,8 +183,10 @@ class MessageSerializer(serializers.ModelSerializer):
     def get_opponent_profile(self, obj):
         """메시지 작성자가 요청한 유저가 아닐 때만 상대방 프로필 반환"""
         request_user = self.context["request"].user
-        if obj.sender != request_user:
-            dog = Dog.objects.filter(user=obj.sender, represent=True).first()
+        if obj.sender_id != request_user.id:
+            if self.opponent_profiles is not None:
+                return self.opponent_profiles.get(obj.sender_id)
+            dog = Dog.objects.filter(user_id=obj.sender_id, represent=True).first()
             if dog:
                 return DogSerializer(dog, context=self.context).data.get('dog_image', None)  # 상대방 프로필 데이터 추가
         return None  # 내가 작성한 메시지는 opponent_profile 없음
@@ -138,9 +196,8 @@ class MessageSerializer(serializers.ModelSerializer):
         return sender.user_name
 
     def get_is_sender(self, instance):
-        sender = instance.sender
         user = self.context["request"].user
-        return sender == user
+        return instance.sender_id == user.id
 
     def get_promise_info(self, obj):
         """메시지와 연결된 예약 정보를 반환"""
@@ -151,7 +208,13 @@ class MessageSerializer(serializers.ModelSerializer):
         if obj.image:
             return obj.image.url
         return None
-    
+
+    def get_is_read(self, obj):
+        """참여자 읽음 위치로 계산한 읽음 여부 (이전 API 의 is_read 필드 호환)"""
+        if self.read_watermarks is not None:
+            return resolve_is_read(obj, self.read_watermarks.get(obj.room_id, {}))
+        return resolve_is_read(obj, obj.room.get_read_watermarks())
+
 class GroupedMessageSerializer(serializers.Serializer):
     """날짜별 메시지 그룹화"""
     date = serializers.CharField()
@@ -174,6 +237,42 @@ class GroupedMessageSerializer(serializers.Serializer):
             for date, msgs in grouped_messages.items()
         ]
 
+class RecentMessageSerializer(MessageSerializer):
+    """
+    최근 메시지 캐시(chat/recent.py)에 넣는 형태 - 요청한 유저와 상관없는 필드만 직렬화
+    is_sender, opponent_profile, is_read 는 조회할 때 render_recent_messages 에서 채운다.
+    """
+    timestamp = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Message
+        fields = ["id", "text", "formatted_time", "room", "sender", "sender_name", "promise_info", "promise",
+                  "image_url", "seq", "timestamp"]
+        list_serializer_class = serializers.ListSerializer
+
+    def get_timestamp(self, obj):
+        return obj.timestamp.isoformat()
+
+
+def render_recent_messages(entries, request):
+    """캐시한 메시지에 요청 유저별 필드를 채워서 MessageSerializer 와 같은 형태로 반환"""
+    user_id = request.user.id
+    profiles = get_dog_images({entry["sender"] for entry in entries if entry["sender"] != user_id}, {"request": request})
+    watermarks = get_read_watermarks({entry["room"] for entry in entries})
+
+    rendered = []
+    for entry in entries:
+        message = Message(id=entry["id"], sender_id=entry["sender"], is_read=False)
+        values = dict(
+            entry,
+            is_sender=entry["sender"] == user_id,
+            opponent_profile=profiles.get(entry["sender"]) if entry["sender"] != user_id else None,
+            is_read=resolve_is_read(message, watermarks.get(entry["room"], {}))
+        )
+        rendered.append({field: values[field] for field in MessageSerializer.Meta.fields})
+    return rendered
+
+
 class ChatRoomSerializer(serializers.ModelSerializer):
     latest_message = serializers.SerializerMethodField()
     latest_message_time = serializers.SerializerMethodField()
@@ -197,67 +296,56 @@ class ChatRoomSerializer(serializers.ModelSerializer):
                 'unread_messages'
                 ]
     def get_latest_message(self, obj):
-        latest_msg = Message.objects.filter(room=obj).order_by('-timestamp').first()
-        return latest_msg.text if latest_msg else ""
+        return obj.last_message.text if obj.last_message else ""
 
     def get_latest_message_time(self, obj):
-        latest_msg = Message.objects.filter(room=obj).order_by('-timestamp').first()
-        if not latest_msg:
+        if not obj.last_message_at:
             return None
-        
-        tz = get_current_timezone()  # 현재 설정된 타임존 가져오기
-        message_time = latest_msg.timestamp.astimezone(tz)  # 서버 타임존에서 현재 타임존으로 변환
-        now = datetime.now(tz)  # 현재 시간 가져오기 (타임존 적용)
-
-        if message_time.date() == now.date():
-            period = "오전" if message_time.hour < 12 else "오후"
-            formatted_hour = message_time.hour if message_time.hour == 12 or message_time.hour == 0 else message_time.hour % 12
-            return f"{period} {formatted_hour}:{message_time.minute:02d}"
-        
-        elif message_time.date() == (now - timedelta(days=1)).date():
-            return "어제"
-        
-        elif message_time.year == now.year:
-            return message_time.strftime("%m월 %d일")
-        
-        else:
-            return message_time.strftime("%Y.%m.%d")
+        return format_latest_message_time(obj.last_message_at)
 
-
-    def get_opponent_email(self, obj):
-        request_user = self.context['request'].user
-        if request_user.is_authenticated:
-            opponent = obj.participants.exclude(id=request_user.id).first()
-            return opponent.email if opponent else None
-        return None
-    
-    def get_opponent_user(self, obj):
-        request_user = self.context['request'].user
-        if request_user.is_authenticated:
-            opponent = obj.participants.exclude(id=request_user.id).first()
-            return opponent.user_name if opponent else None
-        return None
-    
-    def get_opponent_user_profile(self, obj):
-        request_user = self.context['request'].user
-        if request_user.is_authenticated:
-            opponent = obj.participants.exclude(id=request_user.id).first()
+    def get_opponent_summary(self, obj):
+        """
+        (상대방 이메일, 이름, 대표 강아지 이미지 URL)
+        get_inbox_queryset(chat/inbox.py) 으로 가져온 채팅방은 annotate 된 값을 사용 (채팅방 수와 상관없이 추가 쿼리 없음)
+        """
+        summary = getattr(obj, '_opponent_summary', None)
+        if summary is not None:
+            return summary
+        request = self.context['request']
+        if not request.user.is_authenticated:
+            summary = (None, None, None)
+        elif hasattr(obj, 'opponent_email'):
+            url = dog_image_url(obj.opponent_dog_image)
+            summary = (obj.opponent_email, obj.opponent_name, request.build_absolute_uri(url) if url else None)
+        else:
+            opponent = obj.participants.exclude(id=request.user.id).first()
+            image = None
             if opponent:
                 # 상대방의 대표 Dog 객체에서 dog_image 가져오기
                 dog = Dog.objects.filter(user=opponent, represent=True).first()
                 if dog:
-                    return DogSerializer(dog, context=self.context).data.get('dog_image', None)
-        return None
-    
+                    image = DogSerializer(dog, context=self.context).data.get('dog_image', None)
+            summary = (opponent.email, opponent.user_name, image) if opponent else (None, None, None)
+        obj._opponent_summary = summary
+        return summary
+
+    def get_opponent_email(self, obj):
+        return self.get_opponent_summary(obj)[0]
+
+    def get_opponent_user(self, obj):
+        return self.get_opponent_summary(obj)[1]
+
+    def get_opponent_user_profile(self, obj):
+        return self.get_opponent_summary(obj)[2]
+
     def get_is_promise(self, instance):
-        latest_msg = Message.objects.filter(room=instance).order_by('-timestamp').first()
-        return bool(latest_msg and latest_msg.promise)
+        return instance.last_message_has_promise
     
     unread_messages = serializers.SerializerMethodField()
     def get_unread_messages(self, instance):
         request_user = self.context['request'].user
         if request_user.is_authenticated:
-            opponent = instance.participants.exclude(id=request_user.id).first()
-            if opponent:
-                return Message.objects.filter(room=instance, sender=opponent, is_read=False).count()
+            if hasattr(instance, 'unread_messages'):  # get_inbox_queryset 으로 가져온 경우
+                return instance.unread_messages
+            return instance.get_unread_count(request_user)
         return 0
\ No newline at end of file
@@ -0,0 +1,41 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import ChatRoom, ChatRoomMember, Message, Promise
+from .recent import forget_rooms
+
+
+@receiver(m2m_changed, sender=ChatRoom.participants.through)
+def sync_chat_room_members(sender, instance, action, pk_set, reverse, **kwargs):
+    """ChatRoom.participants 가 바뀌면 ChatRoomMember 도 맞춰서 생성/삭제"""
+    if reverse:
+        # user.chat_rooms.add(...) 처럼 반대 방향에서 바뀐 경우
+        pairs = [(room_id, instance.pk) for room_id in (pk_set or [])]
+    else:
+        pairs = [(instance.pk, user_id) for user_id in (pk_set or [])]
+
+    if action == "post_add":
+        ChatRoomMember.objects.bulk_create(
+            [ChatRoomMember(room_id=room_id, user_id=user_id) for room_id, user_id in pairs],
+            ignore_conflicts=True
+        )
+    elif action == "post_remove":
+        for room_id, user_id in pairs:
+            ChatRoomMember.objects.filter(room_id=room_id, user_id=user_id).delete()
+    elif action == "pre_clear":
+        if reverse:
+            ChatRoomMember.objects.filter(user=instance).delete()
+        else:
+            ChatRoomMember.objects.filter(room=instance).delete()
+
+
+@receiver(post_save, sender=Promise)
+@receiver(pre_delete, sender=Promise)
+def forget_promise_rooms(sender, instance, **kwargs):
+    """예약이 수정/삭제되면 그 예약 메시지가 있는 채팅방의 최근 메시지 캐시를 커밋 후 삭제 (promise_info 가 바뀜)"""
+    if kwargs.get("created"):
+        return
+    room_ids = set(Message.objects.filter(promise=instance).values_list("room_id", flat=True))
+    if room_ids:
+        transaction.on_commit(lambda: forget_rooms(room_ids))
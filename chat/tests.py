@@ -1,3 +1,462 @@
-from django.test import TestCase
+import asyncio
+from datetime import date, datetime, time
 
-# Create your tests here.
+import msgpack
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+
+from accounts.models import Dog, User
+from chat import routing
+from chat.codecs import MSGPACK_SUBPROTOCOL
+from chat.inbox import build_inbox
+from chat.models import ChatRoom, Message, Promise
+from chat.pagination import encode_cursor_key
+from chat.presence import reset_presence
+from chat.throttle import reset_rate_limiter
+from chat.utils import get_user_group_name
+from project.middleware import JWTAuthMiddleware
+
+# Redis 없이 실행하기 위한 채널 레이어/캐시/접속 상태/속도 제한 설정
+REALTIME_TEST_SETTINGS = {
+    "CHANNEL_LAYERS": {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    "CACHES": {
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "email_verification": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    },
+    "CHAT_PRESENCE": {"BACKEND": "chat.presence.LocalPresenceBackend", "TTL": 60},
+    "CHAT_RATE_LIMIT": {"BACKEND": "chat.throttle.LocalRateLimiter"},
+}
+
+
+@override_settings(**REALTIME_TEST_SETTINGS)
+class WebsocketTestCase(TransactionTestCase):
+    """consumer 의 DB 조회는 다른 스레드(chat/db.py)에서 실행되므로 TransactionTestCase 사용"""
+
+    def setUp(self):
+        reset_presence()
+        reset_rate_limiter()
+        self.application = URLRouter(routing.websocket_urlpatterns)
+        self.user = User.objects.create_user("a@example.com", "pw", user_name="a")
+        self.opponent = User.objects.create_user("b@example.com", "pw", user_name="b")
+        self.room, _ = ChatRoom.get_or_create_direct(self.user, self.opponent)
+
+    async def connect(self, path, user):
+        communicator = WebsocketCommunicator(self.application, path)
+        communicator.scope["user"] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def receive_until(self, communicator, frame_type):
+        while True:
+            frame = await communicator.receive_json_from()
+            if frame.get("type") == frame_type:
+                return frame
+
+
+class MultiplexCommandTests(WebsocketTestCase):
+    async def test_invalid_room_commands_keep_connection_open(self):
+        communicator = await self.connect("/ws/user/stream", self.user)
+        await self.receive_until(communicator, "chatrooms_list")
+
+        await communicator.send_json_to({"type": "send", "room_id": self.room.id, "message": "hi"})
+        frame = await self.receive_until(communicator, "room_error")
+        self.assertEqual((frame["command"], frame["code"]), ("send", 4403))
+
+        await communicator.send_json_to({"type": "join", "room_id": "abc"})
+        frame = await self.receive_until(communicator, "room_error")
+        self.assertEqual((frame["command"], frame["code"]), ("join", 4400))
+
+        await communicator.send_json_to({"type": "join", "room_id": self.room.id})
+        await self.receive_until(communicator, "backlog")
+        await communicator.send_json_to({"type": "load_backlog", "room_id": self.room.id, "before": 10, "limit": "x"})
+        frame = await self.receive_until(communicator, "room_error")
+        self.assertEqual((frame["command"], frame["code"]), ("load_backlog", 4400))
+
+        # 연결이 그대로 유지되어 있음
+        await communicator.send_json_to({"type": "ping"})
+        await self.receive_until(communicator, "pong")
+        await communicator.disconnect()
+
+
+class RoomBacklogCommandTests(WebsocketTestCase):
+    async def test_invalid_load_backlog_keeps_connection_open(self):
+        communicator = await self.connect(f"/ws/room/{self.room.id}/messages", self.user)
+        await self.receive_until(communicator, "backlog")
+
+        for content in ({}, {"before": "abc"}, {"before": 10, "limit": "x"}):
+            with self.subTest(content=content):
+                await communicator.send_json_to({"type": "load_backlog", **content})
+                frame = await self.receive_until(communicator, "room_error")
+                self.assertEqual((frame["command"], frame["room_id"], frame["code"]), ("load_backlog", self.room.id, 4400))
+
+        # 0 이하 limit 은 1 개로 조회
+        await Message.objects.acreate(room=self.room, sender=self.opponent, text="hi")
+        for limit in (0, -3):
+            with self.subTest(limit=limit):
+                await communicator.send_json_to({"type": "load_backlog", "before": 10 ** 9, "limit": limit})
+                frame = await self.receive_until(communicator, "backlog")
+                self.assertEqual(len(frame["messages"]), 1)
+
+        await communicator.send_json_to({"type": "ping"})
+        await self.receive_until(communicator, "pong")
+        await communicator.disconnect()
+
+
+class WriteBehindNotificationTests(WebsocketTestCase):
+    async def test_persisted_ids_go_to_sender_and_inbox_delta_to_absent_opponent(self):
+        sender = await self.connect(f"/ws/room/{self.room.id}/messages", self.user)
+        await self.receive_until(sender, "backlog")
+        sender_inbox = await self.connect("/ws/user/chatrooms", self.user)
+        await self.receive_until(sender_inbox, "chatrooms_list")
+        opponent = await self.connect(f"/ws/room/{self.room.id}/messages", self.opponent)
+        await self.receive_until(opponent, "backlog")
+        opponent_inbox = await self.connect("/ws/user/chatrooms", self.opponent)
+        await self.receive_until(opponent_inbox, "chatrooms_list")
+        for communicator in (sender, sender_inbox, opponent, opponent_inbox):
+            while not await communicator.receive_nothing(0.2):
+                await communicator.receive_output()
+
+        # 상대방이 채팅방에 있음: 상대방은 chat_message 만, 임시 id -> 실제 id 는 보낸 연결에만
+        await sender.send_json_to({"message": "hi"})
+        frame = await self.receive_until(sender, "message_persisted")
+        message = await Message.objects.aget(room=self.room, text="hi")
+        self.assertEqual(frame["messages"][0]["id"], message.id)
+        frame = await opponent.receive_json_from()
+        self.assertEqual((frame["message"], frame["is_read"]), ("hi", True))
+        for communicator in (opponent, sender_inbox, opponent_inbox):
+            self.assertTrue(await communicator.receive_nothing(0.3))
+
+        # 상대방이 채팅방을 나감: 상대방 채팅방 목록에만 변경분
+        await opponent.disconnect()
+        await sender.send_json_to({"message": "bye"})
+        await self.receive_until(sender, "message_persisted")
+        frame = await self.receive_until(opponent_inbox, "chatroom_update")
+        self.assertEqual(frame["room"]["id"], self.room.id)
+        self.assertTrue(await sender_inbox.receive_nothing(0.3))
+
+        for communicator in (sender, sender_inbox, opponent_inbox):
+            await communicator.disconnect()
+
+
+class FanOutPublishCountTests(WebsocketTestCase):
+    """메시지 하나의 group_send 횟수가 예전 코드(상대방이 있으면 1, 없으면 3)보다 많지 않아야 함"""
+
+    async def count_group_sends(self, sender, text):
+        channel_layer = get_channel_layer()
+        group_send = channel_layer.group_send
+        groups = []
+
+        async def counted_group_send(group, message):
+            groups.append(group)
+            return await group_send(group, message)
+
+        channel_layer.group_send = counted_group_send
+        try:
+            await sender.send_json_to({"message": text})
+            await self.receive_until(sender, "message_persisted")
+            await asyncio.sleep(0.2)
+        finally:
+            channel_layer.group_send = group_send
+        return groups
+
+    async def test_group_sends_per_message(self):
+        sender = await self.connect(f"/ws/room/{self.room.id}/messages", self.user)
+        await self.receive_until(sender, "backlog")
+        opponent = await self.connect(f"/ws/room/{self.room.id}/messages", self.opponent)
+        await self.receive_until(opponent, "backlog")
+        # 입장 알림(update_read_status 등)이 끝난 뒤에 측정
+        for communicator in (sender, opponent):
+            while not await communicator.receive_nothing(0.2):
+                await communicator.receive_output()
+
+        groups = await self.count_group_sends(sender, "hi")
+        self.assertEqual(groups, [f"chat_room_{self.room.id}"])
+
+        await opponent.disconnect()
+        groups = await self.count_group_sends(sender, "bye")
+        self.assertEqual(sorted(groups), sorted([f"chat_room_{self.room.id}", get_user_group_name(self.opponent.email)]))
+        await sender.disconnect()
+
+
+class SeqResumeTests(WebsocketTestCase):
+    """재연결 시 last_seq 이후 메시지만 받는 resume 과 너무 밀렸을 때의 resync_required"""
+
+    def setUp(self):
+        super().setUp()
+        self.messages = [
+            Message.objects.create(room=self.room, sender=self.opponent, text=f"메시지 {i}") for i in range(1, 6)
+        ]
+
+    async def resume_room(self, last_seq):
+        communicator = await self.connect(f"/ws/room/{self.room.id}/messages?last_seq={last_seq}", self.user)
+        while True:
+            frame = await communicator.receive_json_from()
+            if frame.get("type") in ("resume", "resync_required"):
+                await communicator.disconnect()
+                return frame
+
+    async def test_room_resume_sends_only_missed_messages(self):
+        frame = await self.resume_room(2)
+        self.assertEqual(frame["type"], "resume")
+        self.assertEqual([message["message"] for message in frame["messages"]], ["메시지 3", "메시지 4", "메시지 5"])
+        self.assertEqual(frame["last_seq"], 5)
+
+        frame = await self.resume_room(5)
+        self.assertEqual((frame["type"], frame["messages"]), ("resume", []))
+
+    async def test_room_resume_requires_resync(self):
+        cases = {"ahead of the room": 9, "negative": -1}
+        for case, last_seq in cases.items():
+            with self.subTest(case=case):
+                self.assertEqual(await self.resume_room(last_seq), {"type": "resync_required", "last_seq": 5})
+
+        with self.subTest(case="too far behind"), override_settings(CHAT_RESUME_MAX_MESSAGES=2):
+            self.assertEqual(await self.resume_room(2), {"type": "resync_required", "last_seq": 5})
+
+        # 중간 메시지가 없으면(보관 등) 이어 붙일 수 없음
+        await self.messages[3].adelete()
+        with self.subTest(case="missing message"):
+            self.assertEqual(await self.resume_room(2), {"type": "resync_required", "last_seq": 5})
+
+    async def test_inbox_resume_sends_changed_rooms_only(self):
+        communicator = await self.connect("/ws/user/chatrooms?resume=1", self.user)
+
+        await communicator.send_json_to({"type": "resume", "rooms": {str(self.room.id): 2, "999999": 1}})
+        frame = await self.receive_until(communicator, "chatrooms_delta")
+        self.assertEqual([room["id"] for room in frame["rooms"]], [self.room.id])
+        self.assertEqual(frame["rooms"][0]["last_seq"], 5)
+        self.assertEqual(frame["removed"], [999999])
+        self.assertEqual(frame["unread"], {str(self.room.id): 5})
+
+        await communicator.send_json_to({"type": "resume", "rooms": {str(self.room.id): 5}})
+        frame = await self.receive_until(communicator, "chatrooms_delta")
+        self.assertEqual((frame["rooms"], frame["removed"]), ([], []))
+        await communicator.disconnect()
+
+
+class MsgpackCodecTests(WebsocketTestCase):
+    async def connect_msgpack(self, path):
+        communicator = WebsocketCommunicator(self.application, path, subprotocols=[MSGPACK_SUBPROTOCOL])
+        communicator.scope["user"] = self.user
+        connected, subprotocol = await communicator.connect()
+        self.assertEqual((connected, subprotocol), (True, MSGPACK_SUBPROTOCOL))
+        return communicator
+
+    async def receive_msgpack(self, communicator, frame_type):
+        while True:
+            frame = msgpack.unpackb(await communicator.receive_from(), raw=False, strict_map_key=False)
+            if frame.get("type") == frame_type or (frame_type == "error" and "error" in frame):
+                return frame
+
+    async def test_resume_with_int_room_keys(self):
+        communicator = await self.connect_msgpack("/ws/user/chatrooms?resume=1")
+        await communicator.send_to(bytes_data=msgpack.packb({"type": "resume", "rooms": {self.room.id: -1}}))
+        frame = await self.receive_msgpack(communicator, "chatrooms_delta")
+        self.assertEqual([room["id"] for room in frame["rooms"]], [self.room.id])
+        await communicator.disconnect()
+
+    async def test_malformed_frame_keeps_connection_open(self):
+        communicator = await self.connect_msgpack("/ws/user/chatrooms?resume=1")
+        for payload in (b"\xc1", b"\x81\x01", msgpack.packb({"type": "ping"}) + b"\x01", msgpack.packb([1, 2])):
+            await communicator.send_to(bytes_data=payload)
+            await self.receive_msgpack(communicator, "error")
+        await communicator.send_to(bytes_data=msgpack.packb({"type": "ping"}))
+        await self.receive_msgpack(communicator, "pong")
+        await communicator.disconnect()
+
+
+class MessageSearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("a@example.com", "pw", user_name="a")
+        self.opponent = User.objects.create_user("b@example.com", "pw", user_name="b")
+        self.room, _ = ChatRoom.get_or_create_direct(self.user, self.opponent)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def search(self, **params):
+        response = self.client.get("/api/chat/search", params)
+        self.assertEqual(response.status_code, 200)
+        return [result["message_id"] for result in response.json()["results"]]
+
+    def test_messages_saved_through_orm_are_searchable(self):
+        messages = [
+            Message.objects.create(room=self.room, sender=self.opponent, text=f"헌혈 약속 {i}번") for i in range(5)
+        ]
+        self.assertEqual(self.search(q="헌혈"), [message.id for message in reversed(messages)])
+
+        # 수정하면 다시 색인
+        messages[0].text = "산책 가요"
+        messages[0].save()
+        self.assertEqual(self.search(q="산책"), [messages[0].id])
+        self.assertNotIn(messages[0].id, self.search(q="헌혈"))
+
+
+class HandshakeCloseCodeTests(WebsocketTestCase):
+    """거부한 연결도 수락 후 close 해야 클라이언트가 close code 를 받음 (수락 전 close 는 daphne 에서 HTTP 403)"""
+
+    async def assert_closed_with(self, communicator, code):
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        message = await communicator.receive_output()
+        self.assertEqual(message, {"type": "websocket.close", "code": code})
+
+    async def test_invalid_token_closes_with_4401(self):
+        application = JWTAuthMiddleware(self.application)
+        communicator = WebsocketCommunicator(application, f"/ws/room/{self.room.id}/messages?token=invalid")
+        await self.assert_closed_with(communicator, 4401)
+
+    async def test_room_consumer_close_codes(self):
+        outsider = await User.objects.acreate(email="c@example.com", user_name="c")
+        cases = [
+            (f"/ws/room/{self.room.id}/messages", AnonymousUser(), 4401),
+            ("/ws/room/999999/messages", self.user, 4404),
+            (f"/ws/room/{self.room.id}/messages", outsider, 4403),
+            ("/ws/user/chatrooms", AnonymousUser(), 4401),
+        ]
+        for path, user, code in cases:
+            with self.subTest(path=path, code=code):
+                communicator = WebsocketCommunicator(self.application, path)
+                communicator.scope["user"] = user
+                await self.assert_closed_with(communicator, code)
+
+
+def create_dog(user, image=None):
+    return Dog.objects.create(
+        user=user, dog_name="dog", dog_age=3, weight="10", gender="M", neuter=True, blood="DEA1.1", represent=True,
+        dog_image=image
+    )
+
+
+@override_settings(CACHES=REALTIME_TEST_SETTINGS["CACHES"])
+class QueryCountTests(TestCase):
+    """방/메시지 수가 늘어나도 쿼리 수가 일정해야 함 (N+1 방지)"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("a@example.com", "pw", user_name="a")
+        create_dog(self.user, "dogs/a.png")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_rooms(self, count):
+        existing = ChatRoom.objects.count()
+        for i in range(existing, existing + count):
+            opponent = User.objects.create_user(f"user{i}@example.com", "pw", user_name=f"user{i}")
+            create_dog(opponent, f"dogs/{i}.png")
+            room, _ = ChatRoom.get_or_create_direct(self.user, opponent)
+            Message.objects.create(room=room, sender=opponent, text=f"안녕하세요 {i}")
+
+    def test_inbox_builder_query_count_is_constant(self):
+        for rooms in (2, 20):
+            with self.subTest(rooms=rooms):
+                self.create_rooms(rooms - ChatRoom.objects.count())
+                with self.assertNumQueries(2):
+                    inbox = build_inbox(self.user)
+                self.assertEqual(len(inbox), rooms)
+
+    def test_chatroom_list_query_count_is_constant(self):
+        for rooms in (2, 20):
+            with self.subTest(rooms=rooms):
+                self.create_rooms(rooms - ChatRoom.objects.count())
+                with self.assertNumQueries(2):
+                    response = self.client.get("/api/chat/rooms")
+                self.assertEqual(len(response.json()), rooms)
+
+        latest = response.json()[0]
+        self.assertEqual(latest["opponent_email"], "user19@example.com")
+        self.assertTrue(latest["opponent_user_profile"].endswith("/media/dogs/19.png"))
+        self.assertEqual(latest["unread_messages"], 1)
+
+    def test_message_page_query_count_is_constant(self):
+        opponent = User.objects.create_user("b@example.com", "pw", user_name="b")
+        create_dog(opponent, "dogs/b.png")
+        room, _ = ChatRoom.get_or_create_direct(self.user, opponent)
+        for i in range(60):
+            sender = opponent if i % 2 else self.user
+            promise = None
+            if i % 10 == 0:
+                promise = Promise.objects.create(
+                    day=date(2026, 1, 1), time=time(10, 0), place="병원", user1=self.user, user2=opponent
+                )
+            Message.objects.create(room=room, sender=sender, text=f"메시지 {i}", promise=promise)
+
+        # 첫 페이지는 최근 메시지 캐시를 쓰므로 cursor 로 DB 조회 경로를 확인
+        before = encode_cursor_key(datetime(2100, 1, 1), 0)
+        for limit in (5, 50):
+            with self.subTest(limit=limit):
+                with self.assertNumQueries(11):
+                    response = self.client.get(f"/api/chat/{room.id}/messages", {"before": before, "limit": limit})
+                messages = [message for day in response.json()["messages_by_date"] for message in day["messages"]]
+                self.assertEqual(len(messages), limit)
+
+
+class DirectRoomMigrationTests(TransactionTestCase):
+    """0013: 같은 두 사람의 채팅방을 가장 먼저 만든 방으로 합치고(메시지 이동, 나머지 삭제) low_user/high_user 를 채움"""
+    migrate_from = [("accounts", "0002_remove_user_phone"), ("chat", "0012_message_room_timestamp_index")]
+    migrate_to = [("accounts", "0002_remove_user_phone"), ("chat", "0013_chatroom_direct_pair")]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        # 다른 테스트를 위해 최신 migration 으로 되돌림
+        executor = MigrationExecutor(connection)
+        self.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_duplicate_rooms_are_merged(self):
+        apps = self.migrate(self.migrate_from)
+        User = apps.get_model("accounts", "User")
+        ChatRoom = apps.get_model("chat", "ChatRoom")
+        ChatRoomMember = apps.get_model("chat", "ChatRoomMember")
+        Message = apps.get_model("chat", "Message")
+
+        a, b, c, d = (User.objects.create(email=f"{name}@example.com", user_name=name) for name in "abcd")
+        first, duplicate, single, group = (ChatRoom.objects.create() for _ in range(4))
+        first.participants.set([b, a])
+        duplicate.participants.set([a, b])
+        single.participants.set([a, c])
+        group.participants.set([a, c, d])
+        for room, user in ((first, a), (first, b)):
+            ChatRoomMember.objects.create(room=room, user=user)
+        messages = [
+            Message.objects.create(room=first, sender=a, text="1", is_read=True),
+            Message.objects.create(room=duplicate, sender=b, text="2"),
+            Message.objects.create(room=duplicate, sender=b, text="3"),
+        ]
+        Message.objects.create(room=single, sender=c, text="4")
+
+        apps = self.migrate(self.migrate_to)
+        ChatRoom = apps.get_model("chat", "ChatRoom")
+        ChatRoomMember = apps.get_model("chat", "ChatRoomMember")
+        Message = apps.get_model("chat", "Message")
+
+        self.assertFalse(ChatRoom.objects.filter(id=duplicate.id).exists())
+        self.assertEqual(
+            list(Message.objects.filter(room_id=first.id).order_by("id").values_list("id", flat=True)),
+            [message.id for message in messages]
+        )
+        merged = ChatRoom.objects.get(id=first.id)
+        self.assertEqual((merged.low_user_id, merged.high_user_id), (a.id, b.id))
+        self.assertEqual(merged.last_message_id, messages[-1].id)
+        unread = dict(ChatRoomMember.objects.filter(room_id=first.id).values_list("user_id", "unread_count"))
+        self.assertEqual(unread, {a.id: 2, b.id: 0})
+
+        # 두 사람 방은 쌍만 채우고, 3명 이상인 방은 그대로
+        self.assertEqual(
+            ChatRoom.objects.filter(id=single.id).values_list("low_user_id", "high_user_id").get(), (a.id, c.id)
+        )
+        self.assertEqual(Message.objects.filter(room_id=single.id).count(), 1)
+        self.assertEqual(
+            ChatRoom.objects.filter(id=group.id).values_list("low_user_id", "high_user_id").get(), (None, None)
+        )
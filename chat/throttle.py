@@ -0,0 +1,190 @@
+"""
+웹소켓 메시지 전송 속도 제한 (token bucket)
+
+메시지 하나마다 DB 저장과 채널 레이어 publish 가 여러 번 일어나므로,
+클라이언트 버그로 같은 소켓에서 메시지를 계속 보내면 SQLite 쓰기와 채널 레이어가 다른 사용자까지 느려진다.
+연결(channel_name)별, 유저별 bucket 두 개에서 토큰을 하나씩 써야 보낼 수 있고, 모자라면 보낸 메시지는 버리고
+{"type": "throttled", "retry_after": 초} 프레임으로 알린다.
+
+- RedisRateLimiter: 모든 워커/노드가 공유하는 기본 백엔드 (Lua 스크립트로 두 bucket 을 한 번에 확인/차감)
+- LocalRateLimiter: 테스트/개발용 메모리 백엔드
+- 제한 저장소에 문제가 있으면 메시지 전송을 막지 않는다. (fail open)
+"""
+import asyncio
+import math
+import threading
+import time
+import weakref
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class BaseRateLimiter:
+    """
+    rate: 초당 채워지는 토큰 수, burst: 최대 토큰 수 (연속으로 보낼 수 있는 메시지 수)
+    acquire() 는 두 bucket 모두 토큰이 있을 때만 차감하고 0 을, 아니면 다시 보낼 수 있을 때까지 남은 초를 반환
+    """
+
+    def __init__(self, connection_rate=5, connection_burst=10, user_rate=10, user_burst=20, **options):
+        self.connection_limit = (connection_rate, connection_burst)
+        self.user_limit = (user_rate, user_burst)
+
+    @staticmethod
+    def make_keys(channel_name, user_id):
+        return f"conn:{channel_name}", f"user:{user_id}"
+
+    def acquire(self, channel_name, user_id):
+        raise NotImplementedError
+
+    async def aacquire(self, channel_name, user_id):
+        return self.acquire(channel_name, user_id)
+
+
+class LocalRateLimiter(BaseRateLimiter):
+    """프로세스 메모리에만 저장하는 백엔드 (테스트용)"""
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, channel_name, user_id):
+        now = time.monotonic()
+        limits = list(zip(self.make_keys(channel_name, user_id), (self.connection_limit, self.user_limit)))
+        with self._lock:
+            states = []
+            retry_after = 0.0
+            for key, (rate, burst) in limits:
+                tokens, updated_at = self._buckets.get(key, (burst, now))
+                tokens = min(burst, tokens + (now - updated_at) * rate)
+                states.append(tokens)
+                if tokens < 1:
+                    retry_after = max(retry_after, (1 - tokens) / rate)
+            for (key, _), tokens in zip(limits, states):
+                self._buckets[key] = (tokens - 1 if not retry_after else tokens, now)
+            return retry_after
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+# KEYS: bucket 키들, ARGV: rate1, burst1, rate2, burst2, ...
+# 모든 bucket 에 토큰이 있으면 하나씩 차감하고 "0", 아니면 차감하지 않고 기다려야 하는 초를 반환
+TOKEN_BUCKET_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local states = {}
+local retry_after = 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2 - 1])
+    local burst = tonumber(ARGV[i * 2])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or burst
+    local updated_at = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate)
+    states[i] = tokens
+    if tokens < 1 then
+        retry_after = math.max(retry_after, (1 - tokens) / rate)
+    end
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2 - 1])
+    local burst = tonumber(ARGV[i * 2])
+    local tokens = states[i]
+    if retry_after == 0 then
+        tokens = tokens - 1
+    end
+    redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', tostring(now))
+    redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+end
+return tostring(retry_after)
+"""
+
+
+class RedisRateLimiter(BaseRateLimiter):
+    """
+    bucket 은 hash (tokens, ts) 로 저장하고 가득 찰 시간이 지나면 만료된다.
+    key: <prefix>:conn:<channel_name>, <prefix>:user:<user_id>
+    """
+
+    def __init__(self, location="redis://localhost:6379/0", key_prefix="ratelimit",
+                 socket_timeout=0.5, socket_connect_timeout=0.5, **options):
+        super().__init__(**options)
+        import redis
+
+        self.location = location
+        self.key_prefix = key_prefix
+        # Redis 가 느리면 기다리지 않고 실패 (check_flood 에서 fail open)
+        self.client_options = {"socket_timeout": socket_timeout, "socket_connect_timeout": socket_connect_timeout}
+        self._script = redis.Redis.from_url(location, **self.client_options).register_script(TOKEN_BUCKET_SCRIPT)
+        # redis.asyncio 커넥션은 이벤트 루프에 묶여 있으므로 루프마다 따로 만든다
+        self._async_scripts = weakref.WeakKeyDictionary()
+
+    def _script_args(self, channel_name, user_id):
+        keys = [f"{self.key_prefix}:{key}" for key in self.make_keys(channel_name, user_id)]
+        return keys, [*self.connection_limit, *self.user_limit]
+
+    def _async_script(self):
+        import redis.asyncio
+
+        loop = asyncio.get_running_loop()
+        script = self._async_scripts.get(loop)
+        if script is None:
+            script = redis.asyncio.Redis.from_url(self.location, **self.client_options).register_script(TOKEN_BUCKET_SCRIPT)
+            self._async_scripts[loop] = script
+        return script
+
+    def acquire(self, channel_name, user_id):
+        keys, args = self._script_args(channel_name, user_id)
+        return float(self._script(keys=keys, args=args))
+
+    async def aacquire(self, channel_name, user_id):
+        keys, args = self._script_args(channel_name, user_id)
+        return float(await self._async_script()(keys=keys, args=args))
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """settings.CHAT_RATE_LIMIT 로 설정된 제한기를 반환 (프로세스당 하나)"""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                config = dict(getattr(settings, "CHAT_RATE_LIMIT", {}))
+                backend_class = import_string(config.pop("BACKEND", "chat.throttle.LocalRateLimiter"))
+                options = {key.lower(): value for key, value in config.items()}
+                _limiter = backend_class(**options)
+    return _limiter
+
+
+def reset_rate_limiter():
+    """설정을 바꾼 뒤 제한기를 다시 만들 때 사용"""
+    global _limiter
+    with _limiter_lock:
+        _limiter = None
+
+
+class FloodControlMixin:
+    """메시지를 보내기 전에 check_flood() 로 확인 (False 면 throttled 프레임을 보냈으므로 메시지는 버림)"""
+
+    async def check_flood(self, room_id=None):
+        try:
+            retry_after = await get_rate_limiter().aacquire(self.channel_name, self.scope["user"].id)
+        except Exception as e:
+            print(f"Error in check_flood: {e}")
+            return True
+        if not retry_after:
+            return True
+        # 같은 채팅방의 throttled 프레임은 밀려 있으면 마지막 것만 전송 (chat/outbound.py)
+        room_id = int(room_id) if room_id else None
+        await self.queue_frame({
+            "type": "throttled",
+            "room_id": room_id,
+            "retry_after": math.ceil(retry_after * 1000) / 1000
+        }, key=("throttled", room_id))
+        return False
@@ -10,5 +10,7 @@ promise_router.register(r'rooms/(?P<room_id>\d+)/promise', PromiseViewSet, basen
 urlpatterns = [
     path('rooms', views.ChatRoomListCreateView.as_view(), name='chat_rooms'),
     path('<int:room_id>/messages', views.MessageListView.as_view(), name='chat_messages'),
+    path('search', views.MessageSearchView.as_view(), name='chat_search'),
+    path('ws/stats', views.WebsocketStatsView.as_view(), name='chat_ws_stats'),
     path('', include(promise_router.urls))
 ]
\ No newline at end of file
@@ -0,0 +1,52 @@
+import re
+from datetime import datetime, timedelta
+from django.utils.timezone import get_current_timezone
+
+
+def format_latest_message_time(timestamp, tz=None):
+    """채팅방 목록용 시간 표시 (오늘: 오전/오후 hh:mm, 어제, 올해: mm월 dd일, 그 외: yyyy.mm.dd)"""
+    if not timestamp:
+        return ""
+
+    tz = tz or get_current_timezone()  # 현재 설정된 타임존 가져오기
+    message_time = timestamp.astimezone(tz)  # 서버 타임존에서 현재 타임존으로 변환
+    now = datetime.now(tz)  # 현재 시간 가져오기 (타임존 적용)
+
+    if message_time.date() == now.date():
+        period = "오전" if message_time.hour < 12 else "오후"
+        formatted_hour = message_time.hour if message_time.hour == 12 or message_time.hour == 0 else message_time.hour % 12
+        return f"{period} {formatted_hour}:{message_time.minute:02d}"
+
+    elif message_time.date() == (now - timedelta(days=1)).date():
+        return "어제"
+
+    elif message_time.year == now.year:
+        return message_time.strftime("%m월 %d일")
+
+    else:
+        return message_time.strftime("%Y.%m.%d")
+
+
+def get_user_group_name(email):
+    """UserChatConsumer 그룹 이름 (채널 레이어 그룹 이름에 쓸 수 없는 문자는 _ 로 치환)"""
+    return re.sub(r'[^a-zA-Z0-9._-]', '_', f"user_{email}")
+
+
+def serialize_chat_message(message, is_read=None):
+    """웹소켓으로 보내는 메시지 한 건 (sender, promise 는 select_related 로 가져온 상태여야 함)"""
+    data = {
+        'id': message.id,
+        'seq': message.seq,
+        'message': message.text,
+        'sender_email': message.sender.email,
+        'is_read': message.is_read if is_read is None else is_read,
+        'image_url': message.image.url if message.image else None,
+        'timestamp': message.timestamp.isoformat() if message.timestamp else None,
+    }
+    if message.promise_id:
+        data.update({
+            'promise_id': message.promise_id,
+            'promise_day': message.promise.day.strftime("%Y-%m-%d"),
+            'promise_time': message.promise.time.strftime("%H:%M")
+        })
+    return data
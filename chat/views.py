@@ -1,17 +1,26 @@
 from rest_framework import viewsets, generics, serializers, status
 from rest_framework.response import Response
 from .models import ChatRoom, Message, User, Promise
-from .serializers import ChatRoomSerializer, MessageSerializer, PromiseSerializer
+from .serializers import ChatRoomSerializer, MessageSerializer, PromiseSerializer, render_recent_messages
+from .pagination import encode_cursor_key
+from .archive import has_archived_before, paginate_with_archive
+from .recent import load_recent_messages
+from .outbound import outbound_stats
+from .inbox import forget_inbox_snapshots, get_inbox_queryset
+from .heartbeat import connection_stats
+from .db import db_executor_stats
+from .search import get_search_backend, make_snippet, query_words
+from .utils import format_latest_message_time
 from rest_framework.exceptions import ValidationError
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from django.http import Http404
-from django.db.models import Count
 from django.conf import settings
 from django.utils.timezone import get_current_timezone
 from collections import defaultdict
+from datetime import datetime
+import os
 from rest_framework.views import APIView
 from django.db.models import Q
-from django.db.models import OuterRef, Subquery
 
 from accounts.models import Dog
 
@@ -28,13 +37,9 @@ class ChatRoomListCreateView(generics.ListCreateAPIView):
         if not user_email:
             raise ValidationError({'detail': 'Email 파라미터가 필요합니다.'})  # ValidationError를 그대로 발생
         
-        last_message_timestamp_subquery = Message.objects.filter(
-            room=OuterRef('id')
-        ).order_by('-timestamp').values('timestamp')[:1]
-        
-        return ChatRoom.objects.filter(participants__email=user_email).annotate(
-            last_message_timestamp=Subquery(last_message_timestamp_subquery)
-        ).order_by('-last_message_timestamp')
+        # 상대방/대표 강아지/안 읽은 메시지 수를 annotate 한 채팅방 목록 쿼리 (chat/inbox.py, 채팅방 수와 상관없이 쿼리 수 일정)
+        # 최근 메시지 시간은 ChatRoom.last_message_at 에 저장되어 있으므로 인덱스로 바로 정렬
+        return get_inbox_queryset(self.request.user)
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -60,24 +65,22 @@ class ChatRoomListCreateView(generics.ListCreateAPIView):
 
         other_user, _ = User.objects.get_or_create(email=other_user_email)
 
-        # 정확히 두 명의 유저만 포함된 채팅방 찾기
-        existing_chatroom = ChatRoom.objects.annotate(num_participants=Count('participants')).filter(
-            num_participants=2,
-            participants=current_user
-        ).filter(participants=other_user).first()
-        if existing_chatroom:
-            serializer = ChatRoomSerializer(existing_chatroom, context={'request': self.request})
+        # 두 사람의 채팅방은 (low_user, high_user) 로 하나만 존재
+        chatroom, created = ChatRoom.get_or_create_direct(current_user, other_user)
+        if created:
+            forget_inbox_snapshots([current_user.email, other_user.email])
+        if not created:
+            serializer = ChatRoomSerializer(chatroom, context={'request': self.request})
             raise ImmediateResponseException(Response(serializer.data, status=status.HTTP_200_OK))
 
-        chatroom = serializer.save()
-        chatroom.participants.add(current_user, other_user)
+        serializer.instance = chatroom
 
 class MessageListView(APIView):
     def get(self, request, room_id, *args, **kwargs):
         if not room_id:
             return Response({'detail': 'room_id 파라미터가 필요합니다.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        messages = Message.objects.filter(room_id=room_id).order_by("timestamp")
+        messages = Message.objects.filter(room_id=room_id).select_related('sender', 'promise')
 
         # 현재 로그인한 사용자
         current_user = request.user
@@ -99,8 +102,8 @@ class MessageListView(APIView):
             dog_image = request.build_absolute_uri(opponent_dog.dog_image.url)
         else:
             dog_image = None  # 또는 기본 이미지 설정
-        unread_messages = messages.filter(sender=opponent, is_read=False)
-        unread_messages.update(is_read=True)
+        if chat_room.mark_read_by(current_user):
+            forget_inbox_snapshots([current_user.email])
 
 
         user_info = {
@@ -117,22 +120,62 @@ class MessageListView(APIView):
             }
         }
 
-        if not messages.exists():
-            return Response({"user_info": user_info, "messages_by_date": []})
+        # (timestamp, id) 커서로 한 페이지만 조회 (?before=<cursor> 이전, ?after=<cursor> 이후, ?limit=)
+        # Message 테이블 범위를 넘어가면 보관 세그먼트(chat/archive.py)에서 이어서 가져옴
+        try:
+            limit = int(request.query_params.get('limit', settings.CHAT_MESSAGE_PAGE_SIZE))
+        except ValueError:
+            return Response({'detail': 'limit 은 숫자여야 합니다.'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, settings.CHAT_MESSAGE_PAGE_MAX_SIZE))
+        before = request.query_params.get('before')
+        after = request.query_params.get('after')
+
+        # 커서 없는 첫 페이지는 채팅방 최근 메시지 캐시(chat/recent.py)에서 (없으면 DB 에서 다시 만듦)
+        recent = load_recent_messages(chat_room, limit) if not before and not after else None
+        if recent and len(recent) <= limit:
+            # 캐시에 있는 게 Message 테이블 전부 -> 보관된 메시지가 있으면 페이지를 채워야 하므로 DB 로 조회
+            first = recent[0]
+            if has_archived_before(chat_room, (datetime.fromisoformat(first['timestamp']), first['id'])):
+                recent = None
+        if recent is not None:
+            entries = recent[-limit:]
+            keys = [(datetime.fromisoformat(entry['timestamp']), entry['id']) for entry in entries]
+            serialized_messages = render_recent_messages(entries, request)
+            has_more_before = len(recent) > limit
+            has_more_after = False
+        else:
+            page, has_more_before, has_more_after = paginate_with_archive(
+                chat_room,
+                messages,
+                before=before,
+                after=after,
+                limit=limit
+            )
+            keys = [(msg.timestamp, msg.id) for msg in page]
+            serialized_messages = MessageSerializer(page, many=True, context={'request': request}).data
+
+        cursors = {
+            "before": encode_cursor_key(*keys[0]) if keys and has_more_before else None,
+            "after": encode_cursor_key(*keys[-1]) if keys else None,
+            "has_more_before": has_more_before,
+            "has_more_after": has_more_after
+        }
+
+        if not keys:
+            return Response({"user_info": user_info, "messages_by_date": [], "cursors": cursors})
         
-        # 날짜별 메시지 그룹화
-        grouped_messages = self.group_messages_by_date(messages, request)
-        return Response({"user_info": user_info, "messages_by_date": grouped_messages})
+        # 날짜별 메시지 그룹화 (현재 페이지만)
+        grouped_messages = self.group_messages_by_date(keys, serialized_messages)
+        return Response({"user_info": user_info, "messages_by_date": grouped_messages, "cursors": cursors})
 
-    def group_messages_by_date(self, messages, request):
-        """메시지를 날짜별로 그룹화"""
+    def group_messages_by_date(self, keys, serialized_messages):
+        """직렬화된 페이지를 (timestamp, id) 기준 날짜별로 그룹화"""
         tz = get_current_timezone()
         grouped_messages = defaultdict(list)
 
-        for msg in messages:
-            message_time = msg.timestamp.astimezone(tz)
+        for (timestamp, _), serialized_msg in zip(keys, serialized_messages):
+            message_time = timestamp.astimezone(tz)
             date_str = message_time.strftime("%Y년 %m월 %d일")
-            serialized_msg = MessageSerializer(msg, context={'request': request}).data
             grouped_messages[date_str].append(serialized_msg)
 
         # 반환 형태 정리
@@ -140,6 +183,57 @@ class MessageListView(APIView):
         
 
 
+class MessageSearchView(APIView):
+    """
+    메시지 검색 (chat/search.py): ?q= 검색어, ?room_id= 채팅방 (없으면 내 모든 채팅방), ?before= 메시지 id cursor, ?limit=
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        query = request.query_params.get('q', '').strip()
+        if not query_words(query):
+            return Response({'detail': 'q 파라미터가 필요합니다.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = int(request.query_params.get('limit', settings.CHAT_SEARCH_PAGE_SIZE))
+            before = int(request.query_params.get('before') or 0) or None
+            room_id = int(request.query_params.get('room_id') or 0) or None
+        except ValueError:
+            return Response({'detail': 'limit, before, room_id 는 숫자여야 합니다.'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, settings.CHAT_SEARCH_PAGE_MAX_SIZE))
+
+        # 내가 참여한 채팅방 안에서만 검색
+        room_ids = request.user.chat_rooms.values_list('id', flat=True)
+        if room_id is not None:
+            room_ids = room_ids.filter(id=room_id)
+        room_ids = list(room_ids)
+        if room_id is not None and not room_ids:
+            return Response({'detail': '채팅방을 찾을 수 없습니다.'}, status=status.HTTP_404_NOT_FOUND)
+
+        hits, has_more = get_search_backend().search(room_ids, query, before=before, limit=limit)
+        senders = User.objects.in_bulk({hit['sender_id'] for hit in hits})
+        words = query_words(query)
+        results = []
+        for hit in hits:
+            sender = senders.get(hit['sender_id'])
+            snippet, highlights = make_snippet(hit['text'], words, settings.CHAT_SEARCH_SNIPPET_SIZE)
+            results.append({
+                "message_id": hit['message_id'],
+                "room_id": hit['room_id'],
+                "sender_email": sender.email if sender else None,
+                "sender_name": sender.user_name if sender else None,
+                "snippet": snippet,
+                "highlights": highlights,
+                "timestamp": hit['timestamp'].isoformat(),
+                "formatted_time": format_latest_message_time(hit['timestamp'])
+            })
+
+        cursors = {
+            "before": hits[-1]['message_id'] if hits and has_more else None,
+            "has_more": has_more
+        }
+        return Response({"results": results, "cursors": cursors})
+
+
 class PromiseViewSet(viewsets.ModelViewSet):
     serializer_class = PromiseSerializer
     permission_classes = [IsAuthenticated]
@@ -148,3 +242,14 @@ class PromiseViewSet(viewsets.ModelViewSet):
         """현재 로그인한 사용자가 포함된 예약만 조회"""
         user = self.request.user
         return Promise.objects.filter(Q(user1=user) | Q(user2=user))
+
+
+class WebsocketStatsView(APIView):
+    """
+    이 요청을 처리한 워커(프로세스)의 웹소켓 송신 큐 상태(chat/outbound.py), 연결 현황(chat/heartbeat.py),
+    DB 스레드 풀 상태(chat/db.py) - 관리자만
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({"pid": os.getpid(), **outbound_stats(), "live": connection_stats(), "db": db_executor_stats()})
@@ -9,6 +9,9 @@ from .serializers import *
 from .permissions import *
 from rest_framework.permissions import IsAuthenticated
 from django.utils import timezone
+from django.db import transaction
+from chat.outbox import Outbox
+from chat.utils import get_user_group_name
 
 # Create your views here.
 
@@ -81,14 +84,24 @@ class PostViewSet(viewsets.ModelViewSet):
         if request.user == like_post.writer:
             response = Response({"error": "본인이 작성한 글에는 좋아요를 누를 수 없습니다."})
         else:
-            if request.user in like_post.like.all():
-                like_post.like.remove(request.user)
+            with transaction.atomic():
+                liked = not like_post.like.filter(id=request.user.id).exists()
+                if liked:
+                    like_post.like.add(request.user)
+                else:
+                    like_post.like.remove(request.user)
                 like_post.save()
-                response = Response({"success": "좋아요 취소 성공"})
-            else:
-                like_post.like.add(request.user)
-                like_post.save()
-                response = Response({"success": "좋아요 성공"})
+
+                # 글 작성자에게 실시간 알림 (커밋된 뒤 dispatch_outbox 가 전송)
+                Outbox().add(get_user_group_name(like_post.writer.email), {
+                    "type": "community_event",
+                    "event": "post_like",
+                    "post_id": like_post.id,
+                    "liked": liked,
+                    "like_count": like_post.like.count(),
+                    "user_name": request.user.user_name
+                }).save()
+            response = Response({"success": "좋아요 성공" if liked else "좋아요 취소 성공"})
         return response
 
 class CommentViewSet(viewsets.ModelViewSet):
@@ -106,7 +119,18 @@ class CommentViewSet(viewsets.ModelViewSet):
         post = get_object_or_404(Post, id=post_id)
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        serializer.save(post=post, writer=self.request.user)
+        with transaction.atomic():
+            comment = serializer.save(post=post, writer=self.request.user)
+            if post.writer_id != request.user.id:
+                # 글 작성자에게 실시간 알림 (커밋된 뒤 dispatch_outbox 가 전송)
+                Outbox().add(get_user_group_name(post.writer.email), {
+                    "type": "community_event",
+                    "event": "comment",
+                    "post_id": post.id,
+                    "comment_id": comment.id,
+                    "content": comment.content,
+                    "user_name": request.user.user_name
+                }).save()
         return Response(serializer.data)
 
 class SearchHistoryViewSet(viewsets.ModelViewSet):
@@ -8,14 +8,14 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
 # Django ASGI 애플리케이션 초기화
 django_asgi_app = get_asgi_application()
 
-from channels.auth import AuthMiddlewareStack
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.security.websocket import AllowedHostsOriginValidator
 import chat.routing
 from project.middleware import JWTAuthMiddleware
 
 def JWTAuthMiddlewareStack(inner):
-    return JWTAuthMiddleware(AuthMiddlewareStack(inner))
+    # 세션 기반 AuthMiddlewareStack 없이 JWT 로만 인증 (DB 조회 한 번 줄임)
+    return JWTAuthMiddleware(inner)
 
 application = ProtocolTypeRouter({
     "http": django_asgi_app,
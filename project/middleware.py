@@ -1,47 +1,138 @@
+import threading
+import time
+from collections import OrderedDict
+from copy import copy
+from urllib.parse import parse_qs
+
 from channels.db import database_sync_to_async
-import jwt
+from django.apps import apps
 from django.conf import settings
-from channels.auth import AuthMiddlewareStack
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.db.models.signals import post_delete, post_save
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken, TokenError
 
 User = get_user_model()
 
+# 토큰이 없거나 잘못된 경우 웹소켓 close 코드
+CLOSE_CODE_UNAUTHORIZED = 4401
+
+
+class TTLCache:
+    """크기 제한(LRU) + 만료 시간이 있는 프로세스 로컬 캐시"""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+# 인증된 유저 스냅샷 (user_id -> User), 블랙리스트 확인이 끝난 토큰 (jti -> user_id)
+user_cache = TTLCache(settings.WEBSOCKET_AUTH_CACHE_SIZE, settings.WEBSOCKET_AUTH_CACHE_TTL)
+token_cache = TTLCache(settings.WEBSOCKET_AUTH_CACHE_SIZE, settings.WEBSOCKET_AUTH_CACHE_TTL)
+
+
+def invalidate_user_cache(sender, instance, **kwargs):
+    """User 가 저장/삭제되면 캐시된 스냅샷 제거 (다른 프로세스는 TTL 후 만료)"""
+    user_cache.delete(instance.pk)
+
+
+post_save.connect(invalidate_user_cache, sender=User, dispatch_uid="websocket_user_cache_save")
+post_delete.connect(invalidate_user_cache, sender=User, dispatch_uid="websocket_user_cache_delete")
+
+
 class JWTAuthMiddleware:
+    """
+    ?token=<access token> 으로 웹소켓 연결을 인증
+    - 토큰 검증은 simplejwt(JWTAuthentication) 사용, token_blacklist 앱이 있으면 블랙리스트도 확인
+    - 유저 조회 결과는 TTLCache 에 저장해서 재연결이 몰려도 DB 를 다시 조회하지 않음
+    - 토큰이 잘못된 경우 예외 대신 4401 로 연결 거부, 토큰이 없으면 AnonymousUser
+    """
+    authentication = JWTAuthentication()
+
     def __init__(self, inner):
         self.inner = inner
 
     async def __call__(self, scope, receive, send):
-        print("DEBUG: Scope ->", scope)  # 디버깅용 로그
-        print("DEBUG: Query String ->", scope.get('query_string', b'').decode())  # 추가 로그
-
         token = self.get_token_from_scope(scope)
-        print("DEBUG: Extracted Token ->", token)  # 토큰 확인
+        if not token:
+            scope['user'] = AnonymousUser()
+            return await self.inner(scope, receive, send)
 
-        if token:
-            user = await self.authenticate_user(token)
-            scope['user'] = user
+        user = await self.authenticate_user(token)
+        if user is None:
+            return await self.reject(receive, send)
+
+        scope['user'] = user
         return await self.inner(scope, receive, send)
 
     def get_token_from_scope(self, scope):
-        query_string = scope.get('query_string', b'').decode()
-        token = None
-        for param in query_string.split('&'):
-            if param.startswith('token='):
-                token = param.split('=')[1]
-        return token
+        query = parse_qs(scope.get('query_string', b'').decode())
+        tokens = query.get('token')
+        return tokens[0] if tokens else None
+
+    async def authenticate_user(self, raw_token):
+        try:
+            validated_token = self.authentication.get_validated_token(raw_token)
+        except (InvalidToken, TokenError):
+            return None
+
+        user_id = validated_token.get(settings.SIMPLE_JWT.get('USER_ID_CLAIM', 'user_id'))
+        jti = validated_token.get('jti')
+        if token_cache.get(jti) != user_id or user_cache.get(user_id) is None:
+            user = await self.load_user(validated_token)
+            if user is None:
+                return None
+            token_cache.set(jti, user_id)
+            user_cache.set(user_id, user)
+
+        # 연결마다 복사본을 넘겨서 캐시된 객체가 수정되지 않도록
+        return copy(user_cache.get(user_id))
 
     @database_sync_to_async
-    def authenticate_user(self, token):
+    def load_user(self, validated_token):
+        if apps.is_installed('rest_framework_simplejwt.token_blacklist'):
+            from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+            if BlacklistedToken.objects.filter(token__jti=validated_token.get('jti')).exists():
+                return None
         try:
-            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-            print("DEBUG: JWT Payload ->", payload)  # 추가 로그
-            return User.objects.get(id=payload['user_id'])
-        except jwt.ExpiredSignatureError:
-            print("ERROR: Token has expired")  # 로그 추가
-            raise Exception('Token has expired')
-        except jwt.DecodeError:
-            print("ERROR: Token is invalid")  # 로그 추가
-            raise Exception('Token is invalid')
-        except User.DoesNotExist:
-            print("ERROR: User does not exist")  # 로그 추가
-            raise Exception('User does not exist')
+            return self.authentication.get_user(validated_token)
+        except (InvalidToken, AuthenticationFailed):
+            return None
+
+    async def reject(self, receive, send):
+        # 핸드셰이크(websocket.connect)를 받은 뒤 수락하고 바로 4401 로 종료
+        # (수락 전에 close 하면 daphne 가 HTTP 403 으로 거절해서 클라이언트는 close code 를 받지 못함)
+        message = await receive()
+        if message['type'] == 'websocket.connect':
+            await send({'type': 'websocket.accept'})
+            await send({'type': 'websocket.close', 'code': CLOSE_CODE_UNAUTHORIZED})
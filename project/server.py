@@ -0,0 +1,126 @@
+"""
+permessage-deflate 를 지원하는 daphne 실행
+
+    python -m project.server -b 0.0.0.0 -p 8000 project.asgi:application
+
+daphne 기본 실행과 옵션은 같고, 클라이언트가 permessage-deflate 를 요청하면 수락한다.
+WEBSOCKET_COMPRESSION_MIN_SIZE 보다 작은 프레임은 압축하지 않는다 (채팅방 목록 snapshot 같은 큰 프레임만 압축).
+
+daphne 는 보낼 프레임을 twisted 전송 버퍼에 바로 쓰고(크기 제한 없음) consumer 의 send 는 기다리지 않으므로,
+느린 클라이언트에게 보낼 데이터는 consumer 송신 큐(chat/outbound.py)가 아니라 전송 버퍼에 쌓인다.
+전송 버퍼가 WEBSOCKET_WRITE_BUFFER_SIZE 를 넘은 상태가 WEBSOCKET_OUTBOUND_OVERFLOW_GRACE 초 넘게 이어지거나 두 배를 넘으면 연결을 끊는다.
+
+SIGTERM 을 받으면 바로 종료하지 않고 새 연결을 받지 않은 채 기존 연결에 server_restart 를 보낸 뒤(chat/drain.py)
+WEBSOCKET_DRAIN_TIMEOUT 초 후에 종료한다.
+"""
+import asyncio
+import os
+import signal
+import time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+
+from autobahn.websocket.compress import PerMessageDeflateOffer, PerMessageDeflateOfferAccept
+from daphne import server as daphne_server
+from daphne.cli import CommandLineInterface
+from daphne.ws_protocol import WebSocketFactory, WebSocketProtocol
+from django.conf import settings
+
+
+def accept_permessage_deflate(offers):
+    for offer in offers:
+        if isinstance(offer, PerMessageDeflateOffer):
+            return PerMessageDeflateOfferAccept(offer)
+    return None
+
+
+def pending_write_bytes(transport):
+    """twisted 전송 버퍼에 쌓여 있고 아직 클라이언트로 보내지 못한 bytes (TLS 면 아래 TCP transport 기준)"""
+    while transport is not None and not hasattr(transport, "dataBuffer"):
+        transport = getattr(transport, "transport", None)
+    if transport is None:
+        return 0
+    return len(transport.dataBuffer) - transport.offset + transport._tempDataLen
+
+
+class CompressedWebSocketProtocol(WebSocketProtocol):
+    write_buffer_over_limit_since = None
+    write_buffer_overflowed = False
+
+    def sendMessage(self, payload, isBinary=False, fragmentSize=None, sync=False, doNotCompress=False):
+        if self.write_buffer_overflowed:
+            # 끊은 뒤 application 이 websocket.disconnect 를 받기 전에 보낸 프레임은 버림
+            return
+        if len(payload) < settings.WEBSOCKET_COMPRESSION_MIN_SIZE:
+            doNotCompress = True
+        super().sendMessage(payload, isBinary, fragmentSize, sync, doNotCompress)
+        self.check_write_buffer()
+
+    def check_write_buffer(self):
+        """
+        느린 클라이언트: 전송 버퍼가 한도를 넘은 채로 유지되면 연결을 바로 끊음 (abort)
+        쌓인 데이터 뒤에 close 프레임을 보내면 그만큼 다 보낼 때까지 메모리를 잡고 있으므로 close code 없이 끊고,
+        클라이언트는 비정상 종료(1006)로 보고 재연결 후 resume 한다.
+        """
+        limit = settings.WEBSOCKET_WRITE_BUFFER_SIZE
+        pending = pending_write_bytes(self.transport)
+        if pending <= limit:
+            self.write_buffer_over_limit_since = None
+            return
+        now = time.monotonic()
+        if self.write_buffer_over_limit_since is None:
+            self.write_buffer_over_limit_since = now
+        if pending > limit * 2 or now - self.write_buffer_over_limit_since > settings.WEBSOCKET_OUTBOUND_OVERFLOW_GRACE:
+            from chat.outbound import record_write_buffer_overflow
+
+            record_write_buffer_overflow()
+            self.write_buffer_overflowed = True
+            self.dropConnection(abort=True)
+
+
+class CompressedWebSocketFactory(WebSocketFactory):
+    protocol = CompressedWebSocketProtocol
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.setProtocolOptions(perMessageCompressionAccept=accept_permessage_deflate)
+
+
+class DrainingServer(daphne_server.Server):
+    def run(self):
+        self.ports = []
+        self.draining = False
+        if self.signal_handlers:
+            # twisted 가 기본 SIGTERM 핸들러(바로 종료)를 설치한 뒤에 교체
+            daphne_server.reactor.callWhenRunning(self.install_drain_handler)
+        super().run()
+
+    def listen_success(self, port):
+        self.ports.append(port)
+        super().listen_success(port)
+
+    def install_drain_handler(self):
+        signal.signal(signal.SIGTERM, lambda signum, frame: daphne_server.reactor.callFromThread(self.drain))
+
+    def drain(self):
+        if self.draining:
+            return
+        self.draining = True
+        from chat.drain import start_drain
+
+        # 새 연결은 받지 않음 (로드밸런서가 다른 워커로 보냄)
+        for port in self.ports:
+            port.stopListening()
+        asyncio.ensure_future(start_drain())
+        daphne_server.reactor.callLater(settings.WEBSOCKET_DRAIN_TIMEOUT, self.stop)
+
+
+def main():
+    # daphne Server.run() 이 만드는 WebSocketFactory 를 압축 지원 factory 로 교체
+    daphne_server.WebSocketFactory = CompressedWebSocketFactory
+    CommandLineInterface.server_class = DrainingServer
+    CommandLineInterface.entrypoint()
+
+
+if __name__ == "__main__":
+    main()
@@ -131,14 +131,122 @@ CHANNEL_LAYERS = {
     },
 }
 
+# 캐시/접속 상태/속도 제한 Redis 연결/응답 제한 시간(초) - REST 요청이 느린 Redis 를 기다리지 않도록
+# (채널 레이어는 blocking pop 으로 이벤트를 받으므로 제외)
+REDIS_SOCKET_TIMEOUT = 0.5
+
+# 채팅방 접속 상태 (chat/presence.py) - 워커/노드 간 공유
+CHAT_PRESENCE = {
+    'BACKEND': 'chat.presence.RedisPresenceBackend',
+    'LOCATION': f"redis://{os.environ.get('REDIS_HOST', 'localhost')}:6379/3",
+    'TTL': 60,  # 하트비트가 끊기고 이 시간(초)이 지나면 접속 종료로 간주
+    'SOCKET_TIMEOUT': REDIS_SOCKET_TIMEOUT,
+    'SOCKET_CONNECT_TIMEOUT': REDIS_SOCKET_TIMEOUT,
+}
+
+# 웹소켓 메시지 전송 속도 제한 (chat/throttle.py) - 워커/노드 간 공유
+# 연결별, 유저별 token bucket: RATE 는 초당 채워지는 메시지 수, BURST 는 연속으로 보낼 수 있는 최대 메시지 수
+CHAT_RATE_LIMIT = {
+    'BACKEND': 'chat.throttle.RedisRateLimiter',
+    'LOCATION': f"redis://{os.environ.get('REDIS_HOST', 'localhost')}:6379/3",
+    'CONNECTION_RATE': 5,
+    'CONNECTION_BURST': 10,
+    'USER_RATE': 10,
+    'USER_BURST': 20,
+    'SOCKET_TIMEOUT': REDIS_SOCKET_TIMEOUT,
+    'SOCKET_CONNECT_TIMEOUT': REDIS_SOCKET_TIMEOUT,
+}
+
+# consumer DB 조회용 스레드 풀 크기 (chat/db.py) - 워커(프로세스)당 동시 DB 조회/연결 수
+CHAT_DB_EXECUTOR_WORKERS = 4
+
+# 채팅방 입장 시 한 번에 보내는 안 읽은 메시지 최대 개수 (이전 메시지는 cursor 로 이어서 조회)
+CHAT_BACKLOG_LIMIT = 50
+
+# 재연결(?last_seq=N) 시 이보다 많은 메시지가 밀렸으면 resume 대신 resync_required 로 전체 다시 조회 요청
+CHAT_RESUME_MAX_MESSAGES = 200
+
+# ws/user/stream 연결 하나에서 동시에 join 할 수 있는 채팅방 수
+CHAT_MULTIPLEX_MAX_ROOMS = 20
+
+# 채팅방 목록 snapshot 캐시 유지 시간(초) (chat/inbox.py) - 재연결이 몰릴 때 같은 목록을 다시 만들지 않도록
+CHAT_INBOX_SNAPSHOT_TTL = 10
+
+# 채팅방 메시지 조회 API 페이지 크기 (기본값, 최대값)
+CHAT_MESSAGE_PAGE_SIZE = 50
+CHAT_MESSAGE_PAGE_MAX_SIZE = 200
+
+# 채팅방별 최근 메시지 캐시 (chat/recent.py): 캐시할 메시지 수(첫 페이지 + 1 이상), 유지 시간(초)
+CHAT_RECENT_MESSAGES_SIZE = 60
+CHAT_RECENT_MESSAGES_TTL = 60 * 60
+
+# 채팅 메시지 write-behind 저장 (chat/pipeline.py): 이 시간(초) 동안 모인 메시지를 bulk_create 로 한 번에 저장
+CHAT_MESSAGE_FLUSH_INTERVAL = 0.05
+CHAT_MESSAGE_BATCH_SIZE = 100
+
+# REST 요청의 실시간 이벤트 outbox (chat/outbox.py, dispatch_outbox 명령): 조회 주기(초), 한 번에 보낼 개수, 최대 재시도 횟수
+CHAT_OUTBOX_POLL_INTERVAL = 0.2
+CHAT_OUTBOX_BATCH_SIZE = 200
+CHAT_OUTBOX_MAX_ATTEMPTS = 5
+
+# 메시지 검색 (chat/search.py, rebuild_chat_search 명령) - 기본은 SQLite FTS5 (0018 migration 에서 테이블 생성)
+CHAT_SEARCH = {
+    'BACKEND': 'chat.search.SQLiteFTSSearchBackend',
+}
+
+# 메시지 검색 API 페이지 크기 (기본값, 최대값), 결과 snippet 최대 글자 수
+CHAT_SEARCH_PAGE_SIZE = 20
+CHAT_SEARCH_PAGE_MAX_SIZE = 100
+CHAT_SEARCH_SNIPPET_SIZE = 60
+
+# 오래된 메시지 보관 (chat/archive.py, archive_chat_messages 명령): 이 일수보다 오래된 메시지를 세그먼트당 최대 개수씩 압축 보관
+CHAT_ARCHIVE_AFTER_DAYS = 90
+CHAT_ARCHIVE_SEGMENT_SIZE = 500
+
+# 웹소켓 JWT 인증 결과 캐시 (project/middleware.py): 프로세스당 최대 개수, 유지 시간(초)
+WEBSOCKET_AUTH_CACHE_SIZE = 10000
+WEBSOCKET_AUTH_CACHE_TTL = 60
+
+# 웹소켓 heartbeat (chat/heartbeat.py): 이 시간(초) 동안 받은 프레임이 없으면 ping, IDLE_TIMEOUT 동안 없으면 연결 종료
+# (PING_INTERVAL 은 CHAT_PRESENCE TTL 보다 짧아야 유저별 연결 수가 유지됨)
+WEBSOCKET_PING_INTERVAL = 25
+WEBSOCKET_IDLE_TIMEOUT = 75
+
+# 유저 한 명의 동시 웹소켓 연결 수 (모든 워커 합계, 넘으면 새 연결을 4429 로 종료)
+WEBSOCKET_MAX_CONNECTIONS_PER_USER = 10
+
+# 배포 시 drain (project/server.py, chat/drain.py): SIGTERM 후 연결에 server_restart 를 보내고 이 시간(초) 뒤 종료,
+# 클라이언트 재연결 시각은 0 ~ RECONNECT_SPREAD 초 사이에서 랜덤
+WEBSOCKET_DRAIN_TIMEOUT = 5
+WEBSOCKET_DRAIN_RECONNECT_SPREAD = 15
+
+# 웹소켓 연결별 송신 큐 (chat/outbound.py): 최대 프레임 수, 이 시간(초) 넘게 가득 차 있으면(또는 두 배를 넘으면) resync_required 후 연결 종료
+# daphne 에서는 send 가 기다리지 않으므로 이 큐는 프레임을 만드는 DB 조회가 밀릴 때만 차고, 느린 클라이언트는 아래 전송 버퍼 한도로 끊음
+WEBSOCKET_OUTBOUND_QUEUE_SIZE = 200
+WEBSOCKET_OUTBOUND_OVERFLOW_GRACE = 5
+
+# 연결별 twisted 전송 버퍼 한도(bytes, project/server.py 로 실행할 때): 이 크기를 OVERFLOW_GRACE 초 넘게 넘거나 두 배를 넘으면 연결을 끊음
+WEBSOCKET_WRITE_BUFFER_SIZE = 512 * 1024
+
+# permessage-deflate (project/server.py 로 실행할 때): 이 크기(bytes) 미만 프레임은 압축하지 않음
+WEBSOCKET_COMPRESSION_MIN_SIZE = 1024
+
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.redis.RedisCache',
         'LOCATION': 'redis://localhost:6379/1',  # 1번 DB 사용
+        'OPTIONS': {
+            'socket_timeout': REDIS_SOCKET_TIMEOUT,
+            'socket_connect_timeout': REDIS_SOCKET_TIMEOUT,
+        },
     },
     'email_verification': {  # 이메일 인증 전용 캐시
         'BACKEND': 'django.core.cache.backends.redis.RedisCache',
         'LOCATION': 'redis://localhost:6379/2',  # 2번 DB 사용
+        'OPTIONS': {
+            'socket_timeout': REDIS_SOCKET_TIMEOUT,
+            'socket_connect_timeout': REDIS_SOCKET_TIMEOUT,
+        },
     },
 }
 
@@ -149,6 +257,12 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # consumer 조회가 여러 스레드(chat/db.py)에서 동시에 실행되므로
+        # WAL: 읽기와 쓰기가 서로 막지 않음, IMMEDIATE: 트랜잭션 시작 시 쓰기 잠금을 잡아서 중간에 database is locked 로 실패하지 않음
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': 'PRAGMA journal_mode=WAL;',
+        },
     }
 }
 